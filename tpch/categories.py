@@ -0,0 +1,41 @@
+from itertools import product
+from typing import Dict, Iterable, List, Optional
+
+import pandas as pd
+from datagen import CONTAINER_SYLLABLES, INSTRUCTIONS, MODES, NATIONS, REGIONS
+
+# low-cardinality string columns and every value the TPC-H specification
+# allows for them. Declaring the whole domain gives every table, partition
+# and refresh the same categories; they are sorted so that ordering by a
+# categorical column matches ordering by the strings.
+DOMAINS: Dict[str, Dict[str, List[str]]] = {
+    "lineitem": {
+        "L_RETURNFLAG": ["A", "N", "R"],
+        "L_LINESTATUS": ["F", "O"],
+        "L_SHIPMODE": sorted(MODES),
+        "L_SHIPINSTRUCT": sorted(INSTRUCTIONS),
+    },
+    "part": {
+        "P_BRAND": [f"Brand#{m}{n}" for m, n in product(range(1, 6), repeat=2)],
+        "P_CONTAINER": sorted(" ".join(p) for p in product(*CONTAINER_SYLLABLES)),
+    },
+    "nation": {"N_NAME": sorted(name for name, _ in NATIONS)},
+    "region": {"R_NAME": sorted(REGIONS)},
+}
+
+
+def category_dtype(table: str, column: str) -> pd.CategoricalDtype:
+    return pd.CategoricalDtype(DOMAINS[table][column])
+
+
+def encode_categories(df, table: str, columns: Optional[Iterable[str]] = None):
+    """Convert the low-cardinality columns of `table` in `df` to categoricals.
+
+    Works on any frame with a pandas-like `astype`, e.g. pandas, modin, dask
+    or xorbits. `columns` restricts the conversion to some of the columns;
+    columns missing from `df`, e.g. pruned ones, are skipped.
+    """
+    for column in DOMAINS.get(table, {}):
+        if column in df.columns and (columns is None or column in columns):
+            df[column] = df[column].astype(category_dtype(table, column))
+    return df
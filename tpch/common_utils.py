@@ -1,13 +1,31 @@
 import json
 import os
-from argparse import ArgumentParser
+import time
+from argparse import ArgumentParser, ArgumentTypeError
+from contextlib import contextmanager
+from typing import Dict
 
 import pandas as pd
+import pyarrow as pa
 
 SCALE_FACTOR = os.environ.get("SCALE_FACTOR", "1")
 
 CWD = os.path.dirname(os.path.realpath(__file__))
 
+# seconds loaders spent converting columns after reading them, per table. The
+# driver resets it before loading and reads it back to split load times.
+convert_times: Dict[str, float] = {}
+
+
+@contextmanager
+def convert_timer(table: str):
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start_time
+        convert_times[table] = convert_times.get(table, 0.0) + elapsed
+
 
 def log_time_fn(
     solution: str,
@@ -16,20 +34,19 @@ def log_time_fn(
     without_io_time: float = 0.0,
     with_io_time: float = 0.0,
     success=True,
-):
-    TIMINGS_FILE = f"time-{solution}.csv"
-    with open(TIMINGS_FILE, "a") as f:
-        metric = {
-            "framework": solution,
-            "version": version,
-            "query": q,
-            "without_io_time": without_io_time,
-            "with_io_time": with_io_time,
-            "is_success": success,
-        }
-        json_metric = json.dumps(metric)
-        f.write(json_metric + "\n")
-        print(json_metric)
+    **metrics,
+) -> Dict:
+    metric = {
+        "framework": solution,
+        "version": version,
+        "query": q,
+        "without_io_time": without_io_time,
+        "with_io_time": with_io_time,
+        "is_success": success,
+    }
+    metric.update(metrics)
+    print(json.dumps(metric))
+    return metric
 
 
 def print_result_fn(solution: str, result: pd.DataFrame, query: str):
@@ -38,12 +55,32 @@ def print_result_fn(solution: str, result: pd.DataFrame, query: str):
     if not os.path.exists(result_prefix):
         os.makedirs(result_prefix)
     result_path = f"{result_prefix}/{query}.out"
+    # duckdb results may be Arrow tables, polars frames or, with fetchall, row
+    # tuples; they are written like its pandas results.
+    if solution != "polars" and hasattr(result, "to_arrow"):
+        result = result.to_arrow()
+    if isinstance(result, pa.Table):
+        result = result.to_pandas()
+    elif isinstance(result, list):
+        result = pd.DataFrame.from_records(result)
     if(solution == "polars"):
         result.write_csv(result_path)
         return
     result.to_csv(result_path, index=False)
 
 
+def at_least(minimum: int):
+    """Argument type of integers no smaller than `minimum`."""
+
+    def integer(value: str) -> int:
+        number = int(value)
+        if number < minimum:
+            raise ArgumentTypeError(f"must be at least {minimum}, got {number}")
+        return number
+
+    return integer
+
+
 def parse_common_arguments(parser: ArgumentParser):
     parser.add_argument(
         "--path", type=str, required=True, help="path to the TPC-H dataset."
@@ -68,7 +105,96 @@ def parse_common_arguments(parser: ArgumentParser):
     parser.add_argument(
         "--include_io",
         action="store_true",
-        help="include io or not.",
+        help="load the tables of every query run inside the timer, from scratch.",
+    )
+    parser.add_argument(
+        "--warmup",
+        type=at_least(0),
+        default=0,
+        help="untimed runs of each query before measuring.",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=at_least(1),
+        default=1,
+        help="timed runs of each query, summarized in the time metrics.",
+    )
+    parser.add_argument(
+        "--isolate",
+        action="store_true",
+        help="run each query in a fresh process, handing tables over in shared memory.",
+    )
+    parser.add_argument(
+        "--drop_cache_cmd",
+        type=str,
+        required=False,
+        help="shell command dropping the OS page cache before io runs.",
+    )
+    parser.add_argument(
+        "--trace_memory",
+        action="store_true",
+        help="also trace Python allocations with tracemalloc (slows queries down).",
+    )
+    parser.add_argument(
+        "--streams",
+        type=at_least(0),
+        default=0,
+        help="concurrent query streams of a throughput test run after the queries.",
+    )
+    parser.add_argument(
+        "--stream_executor",
+        type=str,
+        default="thread",
+        choices=["thread", "process"],
+        help="run throughput test streams in threads or in separate processes.",
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="run the TPC-H refresh functions around the queries and with the streams.",
+    )
+    parser.add_argument(
+        "--load_threads",
+        type=at_least(1),
+        required=False,
+        help="threads loading tables concurrently (default: the CPU count).",
+    )
+    parser.add_argument(
+        "--metrics_dir",
+        type=str,
+        default="metrics",
+        help="root of the Parquet dataset the time metrics are appended to.",
+    )
+    parser.add_argument(
+        "--scale_factor",
+        type=str,
+        default=SCALE_FACTOR,
+        help="scale factor of the dataset, recorded with the time metrics.",
+    )
+    parser.add_argument(
+        "--run_id",
+        type=str,
+        required=False,
+        help="id recorded with the time metrics, generated when not given.",
     )
 
     return parser
+
+
+def get_run_options(args) -> Dict:
+    """Pick the driver options out of arguments parsed by `parse_common_arguments`."""
+    return {
+        "warmup": args.warmup,
+        "repeat": args.repeat,
+        "isolate": args.isolate,
+        "drop_cache_cmd": args.drop_cache_cmd,
+        "trace_memory": args.trace_memory,
+        "metrics_dir": args.metrics_dir,
+        "scale_factor": args.scale_factor,
+        "run_id": args.run_id,
+        "dataset_path": args.path,
+        "streams": args.streams,
+        "stream_executor": args.stream_executor,
+        "refresh": args.refresh,
+        "load_threads": args.load_threads,
+    }
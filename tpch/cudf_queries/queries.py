@@ -5,12 +5,13 @@ cudf.pandas.install()
 import argparse
 import json
 import os
-import time
-import traceback
 from typing import Dict
 
+import numpy as np
 import pandas as pd
-from common_utils import log_time_fn, parse_common_arguments, print_result_fn
+import pyarrow as pa
+from common_utils import convert_timer, get_run_options, parse_common_arguments
+from driver import Engine, run_engine
 
 dataset_dict = {}
 
@@ -19,9 +20,10 @@ def load_lineitem(root: str, storage_options: Dict):
     if "lineitem" not in dataset_dict:
         data_path = root + "/lineitem"
         df = pd.read_parquet(data_path, storage_options=storage_options)
-        df.L_SHIPDATE = pd.to_datetime(df.L_SHIPDATE, format="%Y-%m-%d")
-        df.L_RECEIPTDATE = pd.to_datetime(df.L_RECEIPTDATE, format="%Y-%m-%d")
-        df.L_COMMITDATE = pd.to_datetime(df.L_COMMITDATE, format="%Y-%m-%d")
+        with convert_timer("lineitem"):
+            df.L_SHIPDATE = pd.to_datetime(df.L_SHIPDATE, format="%Y-%m-%d")
+            df.L_RECEIPTDATE = pd.to_datetime(df.L_RECEIPTDATE, format="%Y-%m-%d")
+            df.L_COMMITDATE = pd.to_datetime(df.L_COMMITDATE, format="%Y-%m-%d")
         result = df
         dataset_dict["lineitem"] = result
     else:
@@ -44,7 +46,8 @@ def load_orders(root: str, storage_options: Dict):
     if "orders" not in dataset_dict:
         data_path = root + "/orders"
         df = pd.read_parquet(data_path, storage_options=storage_options)
-        df.O_ORDERDATE = pd.to_datetime(df.O_ORDERDATE, format="%Y-%m-%d")
+        with convert_timer("orders"):
+            df.O_ORDERDATE = pd.to_datetime(df.O_ORDERDATE, format="%Y-%m-%d")
         result = df
         dataset_dict["orders"] = result
     else:
@@ -1152,6 +1155,17 @@ def q22(root: str, storage_options: Dict):
     return total
 
 
+table_loaders = {
+    "lineitem": load_lineitem,
+    "part": load_part,
+    "orders": load_orders,
+    "customer": load_customer,
+    "nation": load_nation,
+    "region": load_region,
+    "supplier": load_supplier,
+    "partsupp": load_partsupp,
+}
+
 query_to_loaders = {
     1: [load_lineitem],
     2: [load_part, load_partsupp, load_supplier, load_nation, load_region],
@@ -1225,6 +1239,26 @@ query_to_runner = {
 }
 
 
+def refresh_insert(tables: Dict[str, pa.Table]):
+    for name, table in tables.items():
+        if name in dataset_dict:
+            df = dataset_dict[name]
+            new = table.to_pandas().astype(df.dtypes.to_dict())
+            dataset_dict[name] = pd.concat([df, new], ignore_index=True)
+
+
+def refresh_delete(order_keys: np.ndarray):
+    for name, column in (("orders", "O_ORDERKEY"), ("lineitem", "L_ORDERKEY")):
+        if name in dataset_dict:
+            df = dataset_dict[name]
+            df = df[~df[column].isin(order_keys)]
+            dataset_dict[name] = df.reset_index(drop=True)
+
+
+def unload_tables():
+    dataset_dict.clear()
+
+
 def run_queries(
     path,
     storage_options,
@@ -1232,42 +1266,23 @@ def run_queries(
     log_time=True,
     print_result=False,
     include_io=False,
+    **run_options,
 ):
-    version = cudf.__version__
-    data_start_time = time.time()
-    for query in queries:
-        loaders = query_to_loaders[query]
-        for loader in loaders:
-            loader(path, storage_options)
-    print(f"Total data loading time (s): {time.time() - data_start_time}")
-
-    total_start = time.time()
-    for query in queries:
-        try:
-            start_time = time.time()
-            result = query_to_runner[query](path, storage_options)
-            without_io_time = time.time() - start_time
-            success = True
-            if print_result:
-                print_result_fn("cudf", result, query)
-        except Exception as e:
-            print("".join(traceback.TracebackException.from_exception(e).format()))
-            without_io_time = 0.0
-            success = False
-        finally:
-            pass
-        if log_time:
-            log_time_fn(
-                "cudf",
-                query,
-                version=version,
-                without_io_time=without_io_time,
-                success=success,
-            )
-    print(f"Total query execution time (s): {time.time() - total_start}")
+    engine = Engine(
+        name="cudf",
+        version=cudf.__version__,
+        query_to_loaders=query_to_loaders,
+        table_loaders=table_loaders,
+        query_to_runner=query_to_runner,
+        args=(path, storage_options),
+        refresh_insert=refresh_insert,
+        refresh_delete=refresh_delete,
+        unload=unload_tables,
+    )
+    run_engine(engine, queries, log_time, print_result, include_io, **run_options)
 
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(description="TPC-H benchmark.")
     parser.add_argument(
         "--storage_options",
@@ -1276,7 +1291,7 @@ def main():
         help="storage options json file.",
     )
     parser = parse_common_arguments(parser)
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # path to TPC-H data in parquet.
     path = args.path
@@ -1302,6 +1317,7 @@ def main():
         args.log_time,
         args.print_result,
         args.include_io,
+        **get_run_options(args),
     )
 
 
@@ -3,15 +3,15 @@ import datetime
 import json
 import os
 import sys
-import time
-import traceback
-from typing import Dict
+from typing import Dict, Optional
 
 import daft
+import numpy as np
 import pandas as pd
-import ray
-from common_utils import log_time_fn, parse_common_arguments, print_result_fn
+import pyarrow as pa
+from common_utils import get_run_options, parse_common_arguments
 from daft import DataFrame, col
+from driver import Engine, run_engine
 
 dataset_dict = {}
 
@@ -519,6 +519,466 @@ def q10(root: str) -> DataFrame:
     return daft_df
 
 
+def q11(root: str) -> DataFrame:
+    partsupp = load_partsupp(root)
+    supplier = load_supplier(root)
+    nation = load_nation(root)
+
+    nation_name = "GERMANY"
+    fraction = 0.0001
+
+    stock = (
+        nation.where(col("N_NAME") == nation_name)
+        .join(supplier, left_on=col("N_NATIONKEY"), right_on=col("S_NATIONKEY"))
+        .join(partsupp, left_on=col("S_SUPPKEY"), right_on=col("PS_SUPPKEY"))
+        .select(
+            col("PS_PARTKEY"),
+            (col("PS_SUPPLYCOST") * col("PS_AVAILQTY")).alias("value"),
+        )
+    )
+    threshold = stock.agg([(col("value").alias("total_value"), "sum")]).select(
+        (col("total_value") * fraction).alias("threshold"),
+        daft.lit(1).alias("lit"),
+    )
+
+    daft_df = (
+        stock.groupby(col("PS_PARTKEY"))
+        .agg([(col("value"), "sum")])
+        .with_column("lit", daft.lit(1))
+        .join(threshold, on=col("lit"))
+        .where(col("value") > col("threshold"))
+        .select(col("PS_PARTKEY"), col("value"))
+        .sort(col("value"), desc=True)
+    )
+    return daft_df
+
+
+def q12(root: str) -> DataFrame:
+    lineitem = load_lineitem(root)
+    orders = load_orders(root)
+
+    shipmode1 = "MAIL"
+    shipmode2 = "SHIP"
+    date1 = datetime.date(1994, 1, 1)
+    date2 = datetime.date(1995, 1, 1)
+
+    high_priority = col("O_ORDERPRIORITY").is_in(["1-URGENT", "2-HIGH"])
+
+    daft_df = (
+        lineitem.where(
+            col("L_SHIPMODE").is_in([shipmode1, shipmode2])
+            & (col("L_COMMITDATE") < col("L_RECEIPTDATE"))
+            & (col("L_SHIPDATE") < col("L_COMMITDATE"))
+            & (col("L_RECEIPTDATE") >= date1)
+            & (col("L_RECEIPTDATE") < date2)
+        )
+        .join(orders, left_on=col("L_ORDERKEY"), right_on=col("O_ORDERKEY"))
+        .select(
+            col("L_SHIPMODE"),
+            high_priority.if_else(1, 0).alias("high_line_count"),
+            high_priority.if_else(0, 1).alias("low_line_count"),
+        )
+        .groupby(col("L_SHIPMODE"))
+        .agg([(col("high_line_count"), "sum"), (col("low_line_count"), "sum")])
+        .sort(col("L_SHIPMODE"))
+    )
+    return daft_df
+
+
+def q13(root: str) -> DataFrame:
+    customer = load_customer(root)
+    orders = load_orders(root)
+
+    word1 = "special"
+    word2 = "requests"
+
+    orders = orders.where(~col("O_COMMENT").str.match(f".*{word1}.*{word2}.*"))
+
+    daft_df = (
+        customer.join(
+            orders, left_on=col("C_CUSTKEY"), right_on=col("O_CUSTKEY"), how="left"
+        )
+        .groupby(col("C_CUSTKEY"))
+        .agg([(col("O_ORDERKEY").alias("c_count"), "count")])
+        .groupby(col("c_count"))
+        .agg([(col("C_CUSTKEY").alias("custdist"), "count")])
+        .sort(by=["custdist", "c_count"], desc=[True, True])
+    )
+    return daft_df
+
+
+def q14(root: str) -> DataFrame:
+    lineitem = load_lineitem(root)
+    part = load_part(root)
+
+    date1 = datetime.date(1994, 3, 1)
+    date2 = datetime.date(1994, 4, 1)
+
+    def decrease(x, y):
+        return x * (1 - y)
+
+    volume = decrease(col("L_EXTENDEDPRICE"), col("L_DISCOUNT"))
+
+    daft_df = (
+        lineitem.where((col("L_SHIPDATE") >= date1) & (col("L_SHIPDATE") < date2))
+        .join(part, left_on=col("L_PARTKEY"), right_on=col("P_PARTKEY"))
+        .select(
+            col("P_TYPE").str.startswith("PROMO").if_else(volume, 0.0).alias("promo"),
+            volume.alias("volume"),
+        )
+        .agg([(col("promo"), "sum"), (col("volume"), "sum")])
+        .select((100.0 * col("promo") / col("volume")).alias("promo_revenue"))
+    )
+    return daft_df
+
+
+def q15(root: str) -> DataFrame:
+    lineitem = load_lineitem(root)
+    supplier = load_supplier(root)
+
+    date1 = datetime.date(1996, 1, 1)
+    date2 = datetime.date(1996, 4, 1)
+
+    def decrease(x, y):
+        return x * (1 - y)
+
+    revenue = (
+        lineitem.where((col("L_SHIPDATE") >= date1) & (col("L_SHIPDATE") < date2))
+        .groupby(col("L_SUPPKEY"))
+        .agg(
+            [
+                (
+                    decrease(col("L_EXTENDEDPRICE"), col("L_DISCOUNT")).alias(
+                        "total_revenue"
+                    ),
+                    "sum",
+                )
+            ]
+        )
+        .with_column("lit", daft.lit(1))
+    )
+    max_revenue = revenue.agg([(col("total_revenue").alias("max_revenue"), "max")])
+
+    daft_df = (
+        revenue.join(max_revenue.with_column("lit", daft.lit(1)), on=col("lit"))
+        # both sides sum the same revenues, possibly in a different order.
+        .where(col("max_revenue") - col("total_revenue") < 1e-4)
+        .join(supplier, left_on=col("L_SUPPKEY"), right_on=col("S_SUPPKEY"))
+        .select(
+            col("S_SUPPKEY"),
+            col("S_NAME"),
+            col("S_ADDRESS"),
+            col("S_PHONE"),
+            col("total_revenue"),
+        )
+        .sort(col("S_SUPPKEY"))
+    )
+    return daft_df
+
+
+def q16(root: str) -> DataFrame:
+    part = load_part(root)
+    partsupp = load_partsupp(root)
+    supplier = load_supplier(root)
+
+    brand = "Brand#45"
+    p_type = "MEDIUM POLISHED"
+    size_list = [49, 14, 23, 45, 19, 3, 36, 9]
+
+    complaints = supplier.where(
+        col("S_COMMENT").str.match(".*CUSTOMER.*COMPLAINTS.*")
+    ).select(col("S_SUPPKEY"))
+
+    daft_df = (
+        part.where(
+            (col("P_BRAND") != brand)
+            & ~col("P_TYPE").str.startswith(p_type)
+            & col("P_SIZE").is_in(size_list)
+        )
+        .join(partsupp, left_on=col("P_PARTKEY"), right_on=col("PS_PARTKEY"))
+        .join(
+            complaints, left_on=col("PS_SUPPKEY"), right_on=col("S_SUPPKEY"), how="left"
+        )
+        .where(col("S_SUPPKEY").is_null())
+        .select(col("P_BRAND"), col("P_TYPE"), col("P_SIZE"), col("PS_SUPPKEY"))
+        .distinct()
+        .groupby(col("P_BRAND"), col("P_TYPE"), col("P_SIZE"))
+        .agg([(col("PS_SUPPKEY").alias("supplier_cnt"), "count")])
+        .sort(
+            by=["supplier_cnt", "P_BRAND", "P_TYPE", "P_SIZE"],
+            desc=[True, False, False, False],
+        )
+    )
+    return daft_df
+
+
+def q17(root: str) -> DataFrame:
+    lineitem = load_lineitem(root)
+    part = load_part(root)
+
+    brand = "Brand#23"
+    container = "MED BOX"
+
+    part_lineitem = part.where(
+        (col("P_BRAND") == brand) & (col("P_CONTAINER") == container)
+    ).join(lineitem, left_on=col("P_PARTKEY"), right_on=col("L_PARTKEY"))
+    avg_quantity = (
+        part_lineitem.groupby(col("P_PARTKEY"))
+        .agg([(col("L_QUANTITY").alias("avg_quantity"), "mean")])
+        .select(
+            col("P_PARTKEY").alias("key"),
+            (0.2 * col("avg_quantity")).alias("avg_quantity"),
+        )
+    )
+
+    daft_df = (
+        part_lineitem.join(avg_quantity, left_on=col("P_PARTKEY"), right_on=col("key"))
+        .where(col("L_QUANTITY") < col("avg_quantity"))
+        .agg([(col("L_EXTENDEDPRICE").alias("sum_price"), "sum")])
+        .select((col("sum_price") / 7.0).alias("avg_yearly"))
+    )
+    return daft_df
+
+
+def q18(root: str) -> DataFrame:
+    customer = load_customer(root)
+    orders = load_orders(root)
+    lineitem = load_lineitem(root)
+
+    quantity = 300
+
+    large_orders = (
+        lineitem.groupby(col("L_ORDERKEY"))
+        .agg([(col("L_QUANTITY").alias("sum_quantity"), "sum")])
+        .where(col("sum_quantity") > quantity)
+    )
+
+    daft_df = (
+        orders.join(large_orders, left_on=col("O_ORDERKEY"), right_on=col("L_ORDERKEY"))
+        .join(customer, left_on=col("O_CUSTKEY"), right_on=col("C_CUSTKEY"))
+        .select(
+            col("C_NAME"),
+            col("O_CUSTKEY").alias("C_CUSTKEY"),
+            col("O_ORDERKEY"),
+            col("O_ORDERDATE"),
+            col("O_TOTALPRICE"),
+            col("sum_quantity"),
+        )
+        .sort(by=["O_TOTALPRICE", "O_ORDERDATE"], desc=[True, False])
+        .limit(100)
+    )
+    return daft_df
+
+
+def q19(root: str) -> DataFrame:
+    lineitem = load_lineitem(root)
+    part = load_part(root)
+
+    quantity1 = 4
+    quantity2 = 15
+    quantity3 = 26
+    brand1 = "Brand#31"
+    brand2 = "Brand#24"
+    brand3 = "Brand#35"
+
+    def decrease(x, y):
+        return x * (1 - y)
+
+    daft_df = (
+        lineitem.where(
+            col("L_SHIPMODE").is_in(["AIR", "AIR REG"])
+            & (col("L_SHIPINSTRUCT") == "DELIVER IN PERSON")
+        )
+        .join(part, left_on=col("L_PARTKEY"), right_on=col("P_PARTKEY"))
+        .where(
+            (
+                (col("P_BRAND") == brand1)
+                & col("P_CONTAINER").is_in(["SM CASE", "SM BOX", "SM PACK", "SM PKG"])
+                & (col("L_QUANTITY") >= quantity1)
+                & (col("L_QUANTITY") <= quantity1 + 10)
+                & (col("P_SIZE") >= 1)
+                & (col("P_SIZE") <= 5)
+            )
+            | (
+                (col("P_BRAND") == brand2)
+                & col("P_CONTAINER").is_in(
+                    ["MED BAG", "MED BOX", "MED PKG", "MED PACK"]
+                )
+                & (col("L_QUANTITY") >= quantity2)
+                & (col("L_QUANTITY") <= quantity2 + 10)
+                & (col("P_SIZE") >= 1)
+                & (col("P_SIZE") <= 10)
+            )
+            | (
+                (col("P_BRAND") == brand3)
+                & col("P_CONTAINER").is_in(["LG CASE", "LG BOX", "LG PACK", "LG PKG"])
+                & (col("L_QUANTITY") >= quantity3)
+                & (col("L_QUANTITY") <= quantity3 + 10)
+                & (col("P_SIZE") >= 1)
+                & (col("P_SIZE") <= 15)
+            )
+        )
+        .agg(
+            [
+                (
+                    decrease(col("L_EXTENDEDPRICE"), col("L_DISCOUNT")).alias(
+                        "revenue"
+                    ),
+                    "sum",
+                )
+            ]
+        )
+    )
+    return daft_df
+
+
+def q20(root: str) -> DataFrame:
+    lineitem = load_lineitem(root)
+    part = load_part(root)
+    nation = load_nation(root)
+    partsupp = load_partsupp(root)
+    supplier = load_supplier(root)
+
+    date1 = datetime.date(1996, 1, 1)
+    date2 = datetime.date(1997, 1, 1)
+    nation_name = "JORDAN"
+    p_name = "azure"
+
+    shipped = (
+        lineitem.where((col("L_SHIPDATE") >= date1) & (col("L_SHIPDATE") < date2))
+        .groupby(col("L_PARTKEY"), col("L_SUPPKEY"))
+        .agg([(col("L_QUANTITY").alias("sum_quantity"), "sum")])
+        .select(
+            col("L_PARTKEY"),
+            col("L_SUPPKEY"),
+            (0.5 * col("sum_quantity")).alias("half_quantity"),
+        )
+    )
+    excess = (
+        part.where(col("P_NAME").str.startswith(p_name))
+        .select(col("P_PARTKEY"))
+        .distinct()
+        .join(partsupp, left_on=col("P_PARTKEY"), right_on=col("PS_PARTKEY"))
+        .join(
+            shipped,
+            left_on=[col("P_PARTKEY"), col("PS_SUPPKEY")],
+            right_on=[col("L_PARTKEY"), col("L_SUPPKEY")],
+        )
+        .where(col("PS_AVAILQTY") > col("half_quantity"))
+        .select(col("PS_SUPPKEY"))
+        .distinct()
+    )
+
+    daft_df = (
+        nation.where(col("N_NAME") == nation_name)
+        .join(supplier, left_on=col("N_NATIONKEY"), right_on=col("S_NATIONKEY"))
+        .join(excess, left_on=col("S_SUPPKEY"), right_on=col("PS_SUPPKEY"))
+        .select(col("S_NAME"), col("S_ADDRESS"))
+        .sort(col("S_NAME"))
+    )
+    return daft_df
+
+
+def q21(root: str) -> DataFrame:
+    lineitem = load_lineitem(root)
+    orders = load_orders(root)
+    supplier = load_supplier(root)
+    nation = load_nation(root)
+
+    nation_name = "SAUDI ARABIA"
+
+    late = lineitem.where(col("L_RECEIPTDATE") > col("L_COMMITDATE")).select(
+        col("L_ORDERKEY"), col("L_SUPPKEY")
+    )
+    # orders with lines of more than one supplier...
+    multi_supplier = (
+        lineitem.select(col("L_ORDERKEY"), col("L_SUPPKEY"))
+        .distinct()
+        .groupby(col("L_ORDERKEY"))
+        .agg([(col("L_SUPPKEY").alias("num_suppliers"), "count")])
+        .where(col("num_suppliers") > 1)
+        .select(col("L_ORDERKEY"))
+    )
+    # ...of which only one supplier delivered late.
+    single_late = (
+        late.join(multi_supplier, on=col("L_ORDERKEY"))
+        .distinct()
+        .groupby(col("L_ORDERKEY"))
+        .agg([(col("L_SUPPKEY").alias("num_late"), "count")])
+        .where(col("num_late") == 1)
+        .select(col("L_ORDERKEY"))
+    )
+
+    daft_df = (
+        late.join(single_late, on=col("L_ORDERKEY"))
+        .join(
+            orders.where(col("O_ORDERSTATUS") == "F"),
+            left_on=col("L_ORDERKEY"),
+            right_on=col("O_ORDERKEY"),
+        )
+        .join(supplier, left_on=col("L_SUPPKEY"), right_on=col("S_SUPPKEY"))
+        .join(
+            nation.where(col("N_NAME") == nation_name),
+            left_on=col("S_NATIONKEY"),
+            right_on=col("N_NATIONKEY"),
+        )
+        .groupby(col("S_NAME"))
+        .agg([(col("L_ORDERKEY").alias("numwait"), "count")])
+        .sort(by=["numwait", "S_NAME"], desc=[True, False])
+        .limit(100)
+    )
+    return daft_df
+
+
+def q22(root: str) -> DataFrame:
+    customer = load_customer(root)
+    orders = load_orders(root)
+
+    country_codes = ["13", "31", "23", "29", "30", "18", "17"]
+
+    customers = customer.select(
+        col("C_PHONE").str.left(2).alias("cntrycode"),
+        col("C_ACCTBAL"),
+        col("C_CUSTKEY"),
+    ).where(col("cntrycode").is_in(country_codes))
+    avg_balance = (
+        customers.where(col("C_ACCTBAL") > 0.0)
+        .agg([(col("C_ACCTBAL").alias("avg_acctbal"), "mean")])
+        .with_column("lit", daft.lit(1))
+    )
+    ordering = orders.select(col("O_CUSTKEY")).distinct()
+
+    daft_df = (
+        customers.join(
+            ordering, left_on=col("C_CUSTKEY"), right_on=col("O_CUSTKEY"), how="left"
+        )
+        .where(col("O_CUSTKEY").is_null())
+        .with_column("lit", daft.lit(1))
+        .join(avg_balance, on=col("lit"))
+        .where(col("C_ACCTBAL") > col("avg_acctbal"))
+        .groupby(col("cntrycode"))
+        .agg(
+            [
+                (col("C_ACCTBAL").alias("numcust"), "count"),
+                (col("C_ACCTBAL").alias("totacctbal"), "sum"),
+            ]
+        )
+        .sort(col("cntrycode"))
+    )
+    return daft_df
+
+
+table_loaders = {
+    "lineitem": load_lineitem,
+    "part": load_part,
+    "orders": load_orders,
+    "customer": load_customer,
+    "nation": load_nation,
+    "region": load_region,
+    "supplier": load_supplier,
+    "partsupp": load_partsupp,
+}
+
 query_to_loaders = {
     1: [load_lineitem],
     2: [load_part, load_partsupp, load_supplier, load_nation, load_region],
@@ -552,18 +1012,18 @@ query_to_loaders = {
         load_supplier,
     ],
     10: [load_lineitem, load_orders, load_nation, load_customer],
-    # 11: [load_partsupp, load_supplier, load_nation],
-    # 12: [load_lineitem, load_orders],
-    # 13: [load_customer, load_orders],
-    # 14: [load_lineitem, load_part],
-    # 15: [load_lineitem, load_supplier],
-    # 16: [load_part, load_partsupp, load_supplier],
-    # 17: [load_lineitem, load_part],
-    # 18: [load_lineitem, load_orders, load_customer],
-    # 19: [load_lineitem, load_part],
-    # 20: [load_lineitem, load_part, load_nation, load_partsupp, load_supplier],
-    # 21: [load_lineitem, load_orders, load_supplier, load_nation],
-    # 22: [load_customer, load_orders],
+    11: [load_partsupp, load_supplier, load_nation],
+    12: [load_lineitem, load_orders],
+    13: [load_customer, load_orders],
+    14: [load_lineitem, load_part],
+    15: [load_lineitem, load_supplier],
+    16: [load_part, load_partsupp, load_supplier],
+    17: [load_lineitem, load_part],
+    18: [load_lineitem, load_orders, load_customer],
+    19: [load_lineitem, load_part],
+    20: [load_lineitem, load_part, load_nation, load_partsupp, load_supplier],
+    21: [load_lineitem, load_orders, load_supplier, load_nation],
+    22: [load_customer, load_orders],
 }
 
 query_to_runner = {
@@ -577,64 +1037,88 @@ query_to_runner = {
     8: q08,
     9: q09,
     10: q10,
-    # 11: q11,
-    # 12: q12,
-    # 13: q13,
-    # 14: q14,
-    # 15: q15,
-    # 16: q16,
-    # 17: q17,
-    # 18: q18,
-    # 19: q19,
-    # 20: q20,
-    # 21: q21,
-    # 22: q22,
+    11: q11,
+    12: q12,
+    13: q13,
+    14: q14,
+    15: q15,
+    16: q16,
+    17: q17,
+    18: q18,
+    19: q19,
+    20: q20,
+    21: q21,
+    22: q22,
 }
 
 
+def materialize(result: DataFrame) -> pd.DataFrame:
+    return result.to_pandas()
+
+
+def refresh_insert(tables: Dict[str, pa.Table]):
+    # tables are lazy scans, so this only extends the plan; the cost of the
+    # refresh shows up in the queries that read the table next.
+    for name, table in tables.items():
+        if name in dataset_dict:
+            df = dataset_dict[name]
+            columns = [col(field.name).cast(field.dtype) for field in df.schema()]
+            new = daft.from_arrow(table).select(*columns)
+            dataset_dict[name] = df.concat(new)
+
+
+def refresh_delete(order_keys: np.ndarray):
+    keys = order_keys.tolist()
+    for name, column in (("orders", "O_ORDERKEY"), ("lineitem", "L_ORDERKEY")):
+        if name in dataset_dict:
+            dataset_dict[name] = dataset_dict[name].where(~col(column).is_in(keys))
+
+
+def unload_tables():
+    dataset_dict.clear()
+
+
+def set_runner(runner: str, address: Optional[str] = None):
+    """Select the daft runner: the native multithreaded executor of this
+    process, a Ray instance started on this machine, or an existing Ray
+    cluster at `address` (found automatically when not given)."""
+    if runner == "native":
+        daft.set_runner_native()
+    elif runner == "ray-local":
+        import ray
+
+        ray.init()
+        daft.set_runner_ray()
+    else:
+        daft.set_runner_ray(address=address or "auto")
+
+
 def run_queries(
     path,
     queries,
     log_time=True,
     print_result=False,
     include_io=False,
+    runner="ray-cluster",
+    **run_options,
 ):
-    version = daft.__version__
-    data_start_time = time.time()
-    for query in queries:
-        loaders = query_to_loaders[query]
-        for loader in loaders:
-            loader(path)
-    print(f"Total data loading time (s): {time.time() - data_start_time}")
-
-    total_start = time.time()
-    for query in queries:
-        try:
-            start_time = time.time()
-            result = query_to_runner[query](path)
-            result = result.to_pandas()
-            without_io_time = time.time() - start_time
-            success = True
-            if print_result:
-                print_result_fn("daft", result, query)
-        except Exception as e:
-            print("".join(traceback.TracebackException.from_exception(e).format()))
-            without_io_time = 0.0
-            success = False
-        finally:
-            pass
-        if log_time:
-            log_time_fn(
-                "daft",
-                query,
-                version=version,
-                without_io_time=without_io_time,
-                success=success,
-            )
-    print(f"Total query execution time (s): {time.time() - total_start}")
+    engine = Engine(
+        name="daft",
+        version=daft.__version__,
+        query_to_loaders=query_to_loaders,
+        table_loaders=table_loaders,
+        query_to_runner=query_to_runner,
+        args=(path,),
+        materialize=materialize,
+        refresh_insert=refresh_insert,
+        refresh_delete=refresh_delete,
+        unload=unload_tables,
+        config={"runner": runner},
+    )
+    run_engine(engine, queries, log_time, print_result, include_io, **run_options)
 
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(description="TPC-H benchmark.")
     # aws settings
     parser.add_argument("--account", type=str, help="AWS access id")
@@ -645,9 +1129,16 @@ def main():
         required=False,
         help="the endpoint of existing Ray cluster.",
     )
+    parser.add_argument(
+        "--runner",
+        type=str,
+        default="ray-cluster",
+        choices=["native", "ray-local", "ray-cluster"],
+        help="run on daft's native executor, a local Ray instance or a Ray cluster.",
+    )
     parser = parse_common_arguments(parser)
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # path to TPC-H data in parquet.
     print(f"Path: {args.path}")
@@ -657,6 +1148,7 @@ def main():
         queries = args.queries
     print(f"Queries to run: {queries}")
     print(f"Include IO: {args.include_io}")
+    print(f"Runner: {args.runner}")
 
     if "s3://" in args.path:
         import boto3
@@ -665,7 +1157,7 @@ def main():
             "s3", aws_access_key_id=args.account, aws_secret_access_key=args.key
         )
 
-    ray.init(address="auto")
+    set_runner(args.runner, args.endpoint)
 
     try:
         run_queries(
@@ -674,10 +1166,14 @@ def main():
             args.log_time,
             args.print_result,
             args.include_io,
+            args.runner,
+            **get_run_options(args),
         )
     finally:
-        ray.shutdown()
-    ray.shutdown()
+        if args.runner != "native":
+            import ray
+
+            ray.shutdown()
 
 
 if __name__ == "__main__":
@@ -1,29 +1,105 @@
 import argparse
 import json
 import os
-import time
-import traceback
-from typing import Dict
+from typing import Dict, Optional
 
 import dask
 import dask.dataframe as dd
+import numpy as np
 import pandas as pd
-from common_utils import log_time_fn, parse_common_arguments, print_result_fn
+import pyarrow as pa
+from categories import DOMAINS, encode_categories
+from common_utils import get_run_options, parse_common_arguments
 from dask.distributed import Client, wait
+from driver import Engine, run_engine
+from table_cache import TableCache
 
 dataset_dict = {}
+client: Client = None
+# tables whose low-cardinality columns are loaded as categoricals, set by
+# run_queries.
+categorical_tables = set()
+# converted tables cached on disk, opened by run_queries with --cache_dir. The
+# workers map the cached files, so the directory must be visible to them.
+cache = TableCache()
+# how persist_tables lays out the loaded tables, set by run_queries:
+# "partition_size" repartitions every table to partitions of about this size,
+# e.g. "128MB", and "index_orderkey" sorts lineitem and orders into an
+# ORDERKEY index with known divisions, so that merge_orderkey joins them
+# partition by partition instead of shuffling both sides.
+partition_options = {"partition_size": None, "index_orderkey": False}
+ORDERKEY_COLUMNS = {"lineitem": "L_ORDERKEY", "orders": "O_ORDERKEY"}
+
+
+def cache_key(table: str, data_path: str) -> Optional[str]:
+    return cache.key(
+        data_path, engine="dask", categorical=table in categorical_tables
+    )
+
+
+def read_cached_batch(path: str, index: int) -> pd.DataFrame:
+    reader = pa.ipc.open_file(pa.memory_map(path, "r"))
+    return reader.get_batch(index).to_pandas()
+
+
+def read_cached(key: Optional[str]):
+    # one partition per record batch, i.e. per partition of the cached frame.
+    table = cache.read(key)
+    if table is None:
+        return None
+    path = cache.path(key)
+    num_batches = len(table.to_batches())
+    meta = table.schema.empty_table().to_pandas()
+    return dd.from_map(
+        read_cached_batch, [path] * num_batches, range(num_batches), meta=meta
+    )
+
+
+def write_cached(key: Optional[str], df: dd.DataFrame) -> dd.DataFrame:
+    """Cache `df` and return the frame to load: the cached one, or `df` itself
+    when it is not cached. `df` is computed once on the cluster and its
+    partitions are written one by one."""
+    if key is None:
+        return df
+    df = df.persist()
+    cache.write(
+        key,
+        (
+            pa.Table.from_pandas(partition.compute(), preserve_index=False)
+            for partition in df.to_delayed()
+        ),
+    )
+    cached = read_cached(key)
+    return df if cached is None else cached
+
+
+def merge_orderkey(left, right, left_on: str, right_on: str, **kwargs):
+    """Merge frames of lineitem and orders on their order keys.
+
+    Goes through the ORDERKEY index when both frames still carry it, which
+    dask aligns by divisions without a shuffle.
+    """
+    if left.index.name == "ORDERKEY" and right.index.name == "ORDERKEY":
+        return left.merge(right, left_index=True, right_index=True, **kwargs)
+    return left.merge(right, left_on=left_on, right_on=right_on, **kwargs)
 
 
 def load_lineitem(root: str, storage_options: Dict):
     if "lineitem" not in dataset_dict:
         data_path = root + "/lineitem"
-        df = dd.read_parquet(
-            data_path,
-            storage_options=storage_options,
-        )
-        df.L_SHIPDATE = dd.to_datetime(df.L_SHIPDATE, format="%Y-%m-%d")
-        df.L_RECEIPTDATE = dd.to_datetime(df.L_RECEIPTDATE, format="%Y-%m-%d")
-        df.L_COMMITDATE = dd.to_datetime(df.L_COMMITDATE, format="%Y-%m-%d")
+        key = cache_key("lineitem", data_path)
+        df = read_cached(key)
+        if df is None:
+            df = dd.read_parquet(
+                data_path,
+                storage_options=storage_options,
+            )
+            df.L_SHIPDATE = dd.to_datetime(df.L_SHIPDATE, format="%Y-%m-%d")
+            df.L_RECEIPTDATE = dd.to_datetime(df.L_RECEIPTDATE, format="%Y-%m-%d")
+            df.L_COMMITDATE = dd.to_datetime(df.L_COMMITDATE, format="%Y-%m-%d")
+            if "lineitem" in categorical_tables:
+                encode_categories(df, "lineitem")
+            df = write_cached(key, df)
         dataset_dict["lineitem"] = df
         result = df
     else:
@@ -38,6 +114,8 @@ def load_part(root: str, storage_options: Dict):
             data_path,
             storage_options=storage_options,
         )
+        if "part" in categorical_tables:
+            encode_categories(df, "part")
         dataset_dict["part"] = df
         result = df
     else:
@@ -48,11 +126,15 @@ def load_part(root: str, storage_options: Dict):
 def load_orders(root: str, storage_options: Dict):
     if "orders" not in dataset_dict:
         data_path = root + "/orders"
-        df = dd.read_parquet(
-            data_path,
-            storage_options=storage_options,
-        )
-        df.O_ORDERDATE = dd.to_datetime(df.O_ORDERDATE, format="%Y-%m-%d")
+        key = cache_key("orders", data_path)
+        df = read_cached(key)
+        if df is None:
+            df = dd.read_parquet(
+                data_path,
+                storage_options=storage_options,
+            )
+            df.O_ORDERDATE = dd.to_datetime(df.O_ORDERDATE, format="%Y-%m-%d")
+            df = write_cached(key, df)
         dataset_dict["orders"] = df
         result = df
     else:
@@ -81,6 +163,8 @@ def load_nation(root: str, storage_options: Dict):
             data_path,
             storage_options=storage_options,
         )
+        if "nation" in categorical_tables:
+            encode_categories(df, "nation")
         dataset_dict["nation"] = df
         result = df
     else:
@@ -95,6 +179,8 @@ def load_region(root: str, storage_options: Dict):
             data_path,
             storage_options=storage_options,
         )
+        if "region" in categorical_tables:
+            encode_categories(df, "region")
         dataset_dict["region"] = df
         result = df
     else:
@@ -159,7 +245,7 @@ def q01(root: str, storage_options: Dict):
         * (1 - lineitem_filtered.L_DISCOUNT)
         * (1 + lineitem_filtered.L_TAX)
     )
-    gb = lineitem_filtered.groupby(["L_RETURNFLAG", "L_LINESTATUS"])
+    gb = lineitem_filtered.groupby(["L_RETURNFLAG", "L_LINESTATUS"], observed=True)
     total = gb.agg(
         {
             "L_QUANTITY": "sum",
@@ -359,8 +445,8 @@ def q04(root: str, storage_options: Dict):
     # so we must use a different approach than the pandas query
     # jn = forders[forders["O_ORDERKEY"].isin(flineitem["L_ORDERKEY"])]
     forders = forders[["O_ORDERKEY", "O_ORDERPRIORITY"]]
-    jn = forders.merge(
-        flineitem, left_on="O_ORDERKEY", right_on="L_ORDERKEY"
+    jn = merge_orderkey(
+        forders, flineitem, left_on="O_ORDERKEY", right_on="L_ORDERKEY"
     ).drop_duplicates(subset=["O_ORDERKEY"])[["O_ORDERPRIORITY", "O_ORDERKEY"]]
     total = (
         jn.groupby("O_ORDERPRIORITY")["O_ORDERKEY"]
@@ -398,7 +484,7 @@ def q05(root: str, storage_options: Dict):
         jn4, left_on=["S_SUPPKEY", "S_NATIONKEY"], right_on=["L_SUPPKEY", "N_NATIONKEY"]
     )
     jn5["REVENUE"] = jn5.L_EXTENDEDPRICE * (1.0 - jn5.L_DISCOUNT)
-    gb = jn5.groupby("N_NAME")["REVENUE"].sum()
+    gb = jn5.groupby("N_NAME", observed=True)["REVENUE"].sum()
 
     total = gb.compute().reset_index().sort_values("REVENUE", ascending=False)
     return total
@@ -511,7 +597,9 @@ def q07(root: str, storage_options: Dict):
 
     # concat results
     total = dd.concat([total1, total2])
-    total = total.groupby(["SUPP_NATION", "CUST_NATION", "L_YEAR"]).VOLUME.agg("sum")
+    total = total.groupby(
+        ["SUPP_NATION", "CUST_NATION", "L_YEAR"], observed=True
+    ).VOLUME.agg("sum")
     total.columns = ["SUPP_NATION", "CUST_NATION", "L_YEAR", "REVENUE"]
 
     total = (
@@ -620,7 +708,7 @@ def q09(root: str, storage_options: Dict):
         (1 * jn5.PS_SUPPLYCOST) * jn5.L_QUANTITY
     )
     jn5["O_YEAR"] = jn5.O_ORDERDATE.dt.year
-    gb = jn5.groupby(["N_NAME", "O_YEAR"])["TMP"].sum()
+    gb = jn5.groupby(["N_NAME", "O_YEAR"], observed=True)["TMP"].sum()
     total = (
         gb.compute()
         .reset_index()
@@ -643,7 +731,9 @@ def q10(root: str, storage_options: Dict):
     lsel = lineitem.L_RETURNFLAG == "R"
     forders = orders[osel]
     flineitem = lineitem[lsel]
-    jn1 = flineitem.merge(forders, left_on="L_ORDERKEY", right_on="O_ORDERKEY")
+    jn1 = merge_orderkey(
+        flineitem, forders, left_on="L_ORDERKEY", right_on="O_ORDERKEY"
+    )
     jn2 = jn1.merge(customer, left_on="O_CUSTKEY", right_on="C_CUSTKEY")
     jn3 = jn2.merge(nation, left_on="C_NATIONKEY", right_on="N_NATIONKEY")
     jn3["REVENUE"] = jn3.L_EXTENDEDPRICE * (1.0 - jn3.L_DISCOUNT)
@@ -657,6 +747,7 @@ def q10(root: str, storage_options: Dict):
             "C_ADDRESS",
             "C_COMMENT",
         ],
+        observed=True,
     )["REVENUE"].sum()
     total = gb.compute().reset_index().sort_values(by="REVENUE", ascending=False)
     total = total.head(20)
@@ -726,7 +817,9 @@ def q12(root: str, storage_options: Dict):
         & ((lineitem.L_SHIPMODE == shipmode1) | (lineitem.L_SHIPMODE == shipmode2))
     )
     flineitem = lineitem[sel]
-    jn = flineitem.merge(orders, left_on="L_ORDERKEY", right_on="O_ORDERKEY")
+    jn = merge_orderkey(
+        flineitem, orders, left_on="L_ORDERKEY", right_on="O_ORDERKEY"
+    )
 
     def g1(x):
         return x.apply(lambda s: ((s == "1-URGENT") | (s == "2-HIGH")).sum())
@@ -734,7 +827,7 @@ def q12(root: str, storage_options: Dict):
     def g2(x):
         return x.apply(lambda s: ((s != "1-URGENT") & (s != "2-HIGH")).sum())
 
-    gb = jn.groupby("L_SHIPMODE")["O_ORDERPRIORITY"]
+    gb = jn.groupby("L_SHIPMODE", observed=True)["O_ORDERPRIORITY"]
     g1_agg = dd.Aggregation("g1", g1, lambda s0: s0.sum())
     g2_agg = dd.Aggregation("g2", g2, lambda s0: s0.sum())
     total = gb.agg([g1_agg, g2_agg])
@@ -871,7 +964,7 @@ def q16(root: str, storage_options: Dict):
     total = total[total["S_SUPPKEY"].isna()]
     total = total.loc[:, ["P_BRAND", "P_TYPE", "P_SIZE", "PS_SUPPKEY"]]
     total = (
-        total.groupby(["P_BRAND", "P_TYPE", "P_SIZE"])["PS_SUPPKEY"]
+        total.groupby(["P_BRAND", "P_TYPE", "P_SIZE"], observed=True)["PS_SUPPKEY"]
         .nunique()
         .reset_index()
     )
@@ -1198,6 +1291,17 @@ def q22(root: str, storage_options: Dict):
     return total
 
 
+table_loaders = {
+    "lineitem": load_lineitem,
+    "part": load_part,
+    "orders": load_orders,
+    "customer": load_customer,
+    "nation": load_nation,
+    "region": load_region,
+    "supplier": load_supplier,
+    "partsupp": load_partsupp,
+}
+
 query_to_loaders = {
     1: [load_lineitem],
     2: [load_part, load_partsupp, load_supplier, load_nation, load_region],
@@ -1271,59 +1375,102 @@ query_to_runner = {
 }
 
 
-def run_queries(
-    path,
-    storage_options,
-    client,
-    queries,
-    log_time=True,
-    print_result=False,
-    include_io=False,
-):
-    version = dask.__version__
+def partition_table(table_name: str, df: dd.DataFrame) -> dd.DataFrame:
+    if partition_options["partition_size"] is not None:
+        df = df.repartition(partition_size=partition_options["partition_size"])
+    if partition_options["index_orderkey"] and table_name in ORDERKEY_COLUMNS:
+        # a copy of the key, since the queries still select the key column.
+        key = df[ORDERKEY_COLUMNS[table_name]]
+        # order keys are spread evenly, so equal ranges make even partitions.
+        # Divisions sampled by dask may not match the partitions it builds
+        # when the files are already sorted by the key.
+        low, high = dask.compute(key.min(), key.max())
+        divisions = np.unique(np.linspace(low, high, df.npartitions + 1, dtype=int))
+        df = df.assign(ORDERKEY=key).set_index("ORDERKEY", divisions=list(divisions))
+    return df
 
-    data_start_time = time.time()
-    for query in queries:
-        loaders = query_to_loaders[query]
-        for loader in loaders:
-            loader(path, storage_options)
 
+def persist_tables():
     # trigger computation by persist and wait
     for table_name in dataset_dict:
-        df = dataset_dict[table_name]
-        start = time.time()
-        df = client.persist(df)
+        df = client.persist(partition_table(table_name, dataset_dict[table_name]))
         wait(df)
         dataset_dict[table_name] = df
-    print(f"Total data loading time (s): {time.time() - data_start_time}")
-
-    total_start = time.time()
-    for query in queries:
-        try:
-            start_time = time.time()
-            result = query_to_runner[query](path, storage_options)
-            without_io_time = time.time() - start_time
-            success = True
-            if print_result:
-                print_result_fn("dask", result, query)
-        except Exception as e:
-            print("".join(traceback.TracebackException.from_exception(e).format()))
-            without_io_time = 0.0
-            success = False
-        finally:
-            pass
-        if log_time:
-            log_time_fn(
-                "dask",
-                query,
-                version=version,
-                without_io_time=without_io_time,
-                success=success,
-            )
-    print(f"Total query execution time (s): {time.time() - total_start}")
+        print(f"{table_name}: {df.npartitions} partitions")
+
+
+def refresh_insert(tables: Dict[str, pa.Table]):
+    for name, table in tables.items():
+        if name in dataset_dict:
+            df = dataset_dict[name]
+            new = table.to_pandas().astype(df.dtypes.to_dict())
+            if df.index.name == "ORDERKEY":
+                new.index = pd.Index(new[ORDERKEY_COLUMNS[name]], name="ORDERKEY")
+            df = client.persist(dd.concat([df, dd.from_pandas(new, npartitions=1)]))
+            wait(df)
+            dataset_dict[name] = df
 
 
-def main():
+def refresh_delete(order_keys: np.ndarray):
+    for name, column in (("orders", "O_ORDERKEY"), ("lineitem", "L_ORDERKEY")):
+        if name in dataset_dict:
+            df = dataset_dict[name]
+            df = client.persist(df[~df[column].isin(order_keys)])
+            wait(df)
+            dataset_dict[name] = df
+
+
+def unload_tables():
+    dataset_dict.clear()
+
+
+def run_queries(
+    path,
+    storage_options,
+    queries,
+    log_time=True,
+    print_result=False,
+    include_io=False,
+    categorical=False,
+    cache_dir=None,
+    cache_size=50.0,
+    partition_size=None,
+    index_orderkey=False,
+    shuffle_method=None,
+    **run_options,
+):
+    if categorical:
+        categorical_tables.update(DOMAINS)
+    if cache_dir is not None:
+        cache.open(cache_dir, int(cache_size * 1024**3))
+    partition_options["partition_size"] = partition_size
+    partition_options["index_orderkey"] = index_orderkey
+    if shuffle_method is not None:
+        dask.config.set({"dataframe.shuffle.method": shuffle_method})
+    engine = Engine(
+        name="dask",
+        version=dask.__version__,
+        query_to_loaders=query_to_loaders,
+        table_loaders=table_loaders,
+        query_to_runner=query_to_runner,
+        args=(path, storage_options),
+        after_load=persist_tables,
+        refresh_insert=refresh_insert,
+        refresh_delete=refresh_delete,
+        unload=unload_tables,
+        config={
+            "categorical": categorical,
+            "cache_dir": cache_dir,
+            "partition_size": partition_size,
+            "index_orderkey": index_orderkey,
+            "shuffle_method": dask.config.get("dataframe.shuffle.method", None),
+        },
+    )
+    run_engine(engine, queries, log_time, print_result, include_io, **run_options)
+
+
+def main(argv=None):
+    global client
     parser = argparse.ArgumentParser(description="TPC-H benchmark.")
     parser.add_argument(
         "--storage_options",
@@ -1337,8 +1484,45 @@ def main():
         required=False,
         help="the endpoint of existing Dask cluster.",
     )
+    parser.add_argument(
+        "--categorical",
+        default=False,
+        action="store_true",
+        help="load low-cardinality string columns as categoricals.",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        required=False,
+        help="cache the converted lineitem and orders tables in this directory.",
+    )
+    parser.add_argument(
+        "--cache_size",
+        type=float,
+        default=50.0,
+        help="size limit of the table cache in GiB.",
+    )
+    parser.add_argument(
+        "--partition_size",
+        type=str,
+        required=False,
+        help="repartition the loaded tables to partitions of this size, e.g. 128MB.",
+    )
+    parser.add_argument(
+        "--index_orderkey",
+        default=False,
+        action="store_true",
+        help="sort lineitem and orders into an ORDERKEY index at load time.",
+    )
+    parser.add_argument(
+        "--shuffle_method",
+        type=str,
+        required=False,
+        choices=["tasks", "p2p", "disk"],
+        help="shuffle method of merges and groupbys, dask's default when not set.",
+    )
     parser = parse_common_arguments(parser)
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # path to TPC-H data in parquet.
     print(f"Path: {args.path}")
@@ -1355,6 +1539,11 @@ def main():
         queries = args.queries
     print(f"Queries to run: {queries}")
     print(f"Include IO: {args.include_io}")
+    print(f"Categorical: {args.categorical}")
+    print(f"Cache directory: {args.cache_dir}")
+    print(f"Partition size: {args.partition_size}")
+    print(f"Index ORDERKEY: {args.index_orderkey}")
+    print(f"Shuffle method: {args.shuffle_method}")
 
     if args.endpoint == "local" or args.endpoint is None:
         from dask.distributed import LocalCluster
@@ -1364,7 +1553,19 @@ def main():
         client = Client(args.endpoint)
 
     run_queries(
-        args.path, storage_options, client, queries, args.log_time, args.print_result
+        args.path,
+        storage_options,
+        queries,
+        args.log_time,
+        args.print_result,
+        args.include_io,
+        args.categorical,
+        args.cache_dir,
+        args.cache_size,
+        args.partition_size,
+        args.index_orderkey,
+        args.shuffle_method,
+        **get_run_options(args),
     )
 
 
@@ -0,0 +1,695 @@
+"""Generate the TPC-H tables as partitioned Parquet without dbgen.
+
+The generator follows the value domains and key relations of the TPC-H
+specification (clause 4.2): sparse order keys, the part/supplier mapping of
+PARTSUPP, customers without orders, ship/commit/receipt date offsets,
+return flags and line status relative to CURRENTDATE, order status and total
+price derived from the line items, and the Customer Complaints/Recommends
+supplier comments. Free text is cut from a seeded pool of spec words, so
+query answers are close to, but not identical with, the dbgen answer sets.
+
+Every output file is generated independently from `(seed, table, file)`, so
+files can be written in parallel and the output only depends on the scale
+factor, file count and seed:
+
+    python -m datagen --scale_factor 10 --output /path/to/tpch/SF10
+"""
+import argparse
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from common_utils import SCALE_FACTOR
+
+START_DATE = np.datetime64("1992-01-01")
+END_DATE = np.datetime64("1998-12-31")
+CURRENT_DATE = np.datetime64("1995-06-17")
+
+# rows per unit of scale factor.
+BASE_ROWS = {
+    "supplier": 10_000,
+    "part": 200_000,
+    "customer": 150_000,
+    "orders": 1_500_000,
+}
+
+REGIONS = ["AFRICA", "AMERICA", "ASIA", "EUROPE", "MIDDLE EAST"]
+NATIONS = [
+    ("ALGERIA", 0),
+    ("ARGENTINA", 1),
+    ("BRAZIL", 1),
+    ("CANADA", 1),
+    ("EGYPT", 4),
+    ("ETHIOPIA", 0),
+    ("FRANCE", 3),
+    ("GERMANY", 3),
+    ("INDIA", 2),
+    ("INDONESIA", 2),
+    ("IRAN", 4),
+    ("IRAQ", 4),
+    ("JAPAN", 2),
+    ("JORDAN", 4),
+    ("KENYA", 0),
+    ("MOROCCO", 0),
+    ("MOZAMBIQUE", 0),
+    ("PERU", 1),
+    ("CHINA", 2),
+    ("ROMANIA", 3),
+    ("SAUDI ARABIA", 4),
+    ("VIETNAM", 2),
+    ("RUSSIA", 3),
+    ("UNITED KINGDOM", 3),
+    ("UNITED STATES", 1),
+]
+COLORS = (
+    "almond antique aquamarine azure beige bisque black blanched blue blush "
+    "brown burlywood burnished chartreuse chiffon chocolate coral cornflower "
+    "cornsilk cream cyan dark deep dim dodger drab firebrick floral forest "
+    "frosted gainsboro ghost goldenrod green grey honeydew hot indian ivory "
+    "khaki lace lavender lawn lemon light lime linen magenta maroon medium "
+    "metallic midnight mint misty moccasin navajo navy olive orange orchid "
+    "pale papaya peach peru pink plum powder puff purple red rose rosy royal "
+    "saddle salmon sandy seashell sienna sky slate smoke snow spring steel "
+    "tan thistle tomato turquoise violet wheat white yellow"
+).split()
+TYPE_SYLLABLES = [
+    ["STANDARD", "SMALL", "MEDIUM", "LARGE", "ECONOMY", "PROMO"],
+    ["ANODIZED", "BURNISHED", "PLATED", "POLISHED", "BRUSHED"],
+    ["TIN", "NICKEL", "BRASS", "STEEL", "COPPER"],
+]
+CONTAINER_SYLLABLES = [
+    ["SM", "LG", "MED", "JUMBO", "WRAP"],
+    ["CASE", "BOX", "BAG", "JAR", "PKG", "PACK", "CAN", "DRUM"],
+]
+SEGMENTS = ["AUTOMOBILE", "BUILDING", "FURNITURE", "MACHINERY", "HOUSEHOLD"]
+PRIORITIES = ["1-URGENT", "2-HIGH", "3-MEDIUM", "4-NOT SPECIFIED", "5-LOW"]
+INSTRUCTIONS = ["DELIVER IN PERSON", "COLLECT COD", "NONE", "TAKE BACK RETURN"]
+MODES = ["REG AIR", "AIR", "RAIL", "SHIP", "TRUCK", "MAIL", "FOB"]
+
+# (word, weight) lists of the text grammar, clause 4.2.2.13.
+NOUNS = [
+    ("packages", 40), ("requests", 40), ("accounts", 40), ("deposits", 40),
+    ("foxes", 20), ("ideas", 20), ("theodolites", 20), ("pinto beans", 20),
+    ("instructions", 20), ("dependencies", 10), ("excuses", 10),
+    ("platelets", 10), ("asymptotes", 10), ("courts", 5), ("dolphins", 5),
+    ("multipliers", 1), ("sauternes", 1), ("warthogs", 1), ("frets", 1),
+    ("dinos", 1), ("attainments", 1), ("somas", 1), ("Tiresias", 1),
+    ("patterns", 1), ("forges", 1), ("braids", 1), ("frays", 1),
+    ("warhorses", 1), ("dugouts", 1), ("notornis", 1), ("epitaphs", 1),
+    ("pearls", 1), ("tithes", 1), ("waters", 1), ("orbits", 1), ("gifts", 1),
+    ("sheaves", 1), ("depths", 1), ("sentiments", 1), ("decoys", 1),
+    ("realms", 1), ("pains", 1), ("grouches", 1), ("escapades", 1),
+    ("hockey players", 1),
+]
+VERBS = [
+    ("sleep", 20), ("wake", 20), ("are", 20), ("cajole", 20), ("haggle", 20),
+    ("nag", 10), ("use", 10), ("boost", 10), ("affix", 5), ("detect", 5),
+    ("integrate", 5), ("maintain", 1), ("nod", 1), ("was", 1), ("lose", 1),
+    ("sublate", 1), ("solve", 1), ("thrash", 1), ("promise", 1),
+    ("engage", 1), ("hinder", 1), ("print", 1), ("x-ray", 1), ("breach", 1),
+    ("eat", 1), ("grow", 1), ("impress", 1), ("mold", 1), ("poach", 1),
+    ("serve", 1), ("run", 1), ("dazzle", 1), ("snooze", 1), ("doze", 1),
+    ("unwind", 1), ("kindle", 1), ("play", 1), ("hang", 1), ("believe", 1),
+    ("doubt", 1),
+]
+ADJECTIVES = [
+    ("special", 20), ("pending", 20), ("unusual", 20), ("express", 20),
+    ("furious", 1), ("sly", 1), ("careful", 1), ("blithe", 1), ("quick", 1),
+    ("fluffy", 1), ("slow", 1), ("quiet", 1), ("ruthless", 1), ("thin", 1),
+    ("close", 1), ("dogged", 1), ("daring", 1), ("brave", 1), ("stealthy", 1),
+    ("permanent", 1), ("enticing", 1), ("idle", 1), ("busy", 1),
+    ("regular", 50), ("final", 40), ("ironic", 40), ("even", 30), ("bold", 20),
+    ("silent", 10),
+]
+ADVERBS = [
+    ("sometimes", 1), ("always", 1), ("never", 1), ("furiously", 50),
+    ("slyly", 50), ("carefully", 50), ("blithely", 40), ("quickly", 30),
+    ("fluffily", 20), ("slowly", 1), ("quietly", 1), ("ruthlessly", 1),
+    ("thinly", 1), ("closely", 1), ("doggedly", 1), ("daringly", 1),
+    ("bravely", 1), ("stealthily", 1), ("permanently", 1), ("enticingly", 1),
+    ("idly", 1), ("busily", 1), ("regularly", 1), ("finally", 1),
+    ("ironically", 1), ("evenly", 1), ("boldly", 1), ("silently", 1),
+]
+PREPOSITIONS = [
+    ("about", 50), ("above", 50), ("according to", 50), ("across", 50),
+    ("after", 50), ("against", 40), ("along", 40), ("alongside of", 30),
+    ("among", 30), ("around", 20), ("at", 10), ("atop", 1), ("before", 1),
+    ("behind", 1), ("beneath", 1), ("beside", 1), ("besides", 1),
+    ("between", 1), ("beyond", 1), ("by", 1), ("despite", 1), ("during", 1),
+    ("except", 1), ("for", 1), ("from", 1), ("in place of", 1), ("inside", 1),
+    ("instead of", 1), ("into", 1), ("near", 1), ("of", 1), ("on", 1),
+    ("outside", 1), ("over", 1), ("past", 1), ("since", 1), ("through", 1),
+    ("throughout", 1), ("to", 1), ("toward", 1), ("under", 1), ("until", 1),
+    ("up", 1), ("upon", 1), ("without", 1), ("with", 1), ("within", 1),
+]
+TERMINATORS = [(".", 50), (";", 1), (":", 1), ("?", 1), ("!", 1), ("--", 1)]
+ADDRESS_ALPHABET = np.frombuffer(
+    b"0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ,", np.uint8
+)
+TEXT_POOL_SIZE = 4 * 1024 * 1024
+
+TABLES = [
+    "region",
+    "nation",
+    "supplier",
+    "part",
+    "partsupp",
+    "customer",
+    "orders",
+]
+
+
+def _pick(rng: np.random.Generator, words: List[Tuple[str, int]], size: int):
+    weights = np.array([weight for _, weight in words], dtype=float)
+    indexes = rng.choice(len(words), size=size, p=weights / weights.sum())
+    return [words[i][0] for i in indexes]
+
+
+@lru_cache(maxsize=1)
+def text_pool(seed: int, size: int = TEXT_POOL_SIZE) -> np.ndarray:
+    """Build the pool free text is cut from, as ASCII bytes."""
+    rng = np.random.default_rng([seed, 0xC0FFEE])
+    sentences = []
+    length = 0
+    while length < size:
+        n = 4096
+        adjectives = _pick(rng, ADJECTIVES, n)
+        nouns = _pick(rng, NOUNS, n)
+        adverbs = _pick(rng, ADVERBS, n)
+        verbs = _pick(rng, VERBS, n)
+        prepositions = _pick(rng, PREPOSITIONS, n)
+        objects = _pick(rng, NOUNS, n)
+        terminators = _pick(rng, TERMINATORS, n)
+        shapes = rng.integers(0, 4, n)
+        for i in range(n):
+            shape = shapes[i]
+            if shape == 0:
+                words = [nouns[i], verbs[i]]
+            elif shape == 1:
+                words = [adjectives[i], nouns[i], verbs[i], adverbs[i]]
+            elif shape == 2:
+                words = [nouns[i], adverbs[i], verbs[i], prepositions[i], "the"]
+                words += [adjectives[i], objects[i]]
+            else:
+                words = [adjectives[i], nouns[i], verbs[i], prepositions[i]]
+                words += ["the", objects[i]]
+            sentence = " ".join(words) + terminators[i] + " "
+            sentences.append(sentence)
+            length += len(sentence)
+    return np.frombuffer("".join(sentences).encode("ascii"), np.uint8)[:size]
+
+
+def _strings_from_bytes(data: np.ndarray, lengths: np.ndarray) -> pa.Array:
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return pa.LargeStringArray.from_buffers(
+        len(lengths), pa.py_buffer(offsets), pa.py_buffer(data)
+    ).cast(pa.string())
+
+
+def _gather(source: np.ndarray, starts: np.ndarray, lengths: np.ndarray):
+    """Concatenate `source[start:start + length]` for every row."""
+    offsets = np.zeros(len(lengths), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=offsets[1:])
+    index = np.arange(lengths.sum(), dtype=np.int64)
+    index += np.repeat(starts - offsets, lengths)
+    return source[index]
+
+
+def random_text(rng, pool: np.ndarray, n: int, min_len: int, max_len: int):
+    lengths = rng.integers(min_len, max_len + 1, n)
+    starts = rng.integers(0, len(pool) - max_len, n)
+    return _strings_from_bytes(_gather(pool, starts, lengths), lengths)
+
+
+def random_vstring(rng, n: int, min_len: int, max_len: int):
+    lengths = rng.integers(min_len, max_len + 1, n)
+    data = ADDRESS_ALPHABET[rng.integers(0, len(ADDRESS_ALPHABET), lengths.sum())]
+    return _strings_from_bytes(data, lengths)
+
+
+def _digits(values: np.ndarray, width: int) -> np.ndarray:
+    """Zero padded decimal digits of `values` as an (n, width) byte matrix."""
+    powers = 10 ** np.arange(width - 1, -1, -1, dtype=np.int64)
+    return ((values[:, None] // powers) % 10 + ord("0")).astype(np.uint8)
+
+
+def fixed_strings(*parts) -> pa.Array:
+    """Concatenate byte strings and digit matrices into one string per row."""
+    n = next(len(part) for part in parts if isinstance(part, np.ndarray))
+    columns = []
+    for part in parts:
+        if isinstance(part, bytes):
+            part = np.tile(np.frombuffer(part, np.uint8), (n, 1))
+        columns.append(part)
+    matrix = np.ascontiguousarray(np.hstack(columns))
+    return _strings_from_bytes(matrix.ravel(), np.full(n, matrix.shape[1]))
+
+
+def choose(rng, values: List[str], n: int) -> pa.Array:
+    return pc.take(pa.array(values), rng.integers(0, len(values), n))
+
+
+def phones(rng, nation_keys: np.ndarray) -> pa.Array:
+    n = len(nation_keys)
+    return fixed_strings(
+        _digits(nation_keys + 10, 2),
+        b"-",
+        _digits(rng.integers(100, 1000, n), 3),
+        b"-",
+        _digits(rng.integers(100, 1000, n), 3),
+        b"-",
+        _digits(rng.integers(1000, 10000, n), 4),
+    )
+
+
+def money(rng, low: int, high: int, n: int) -> np.ndarray:
+    """Uniform amounts in [low, high] cents, as dollars."""
+    return rng.integers(low, high + 1, n) / 100
+
+
+def days(offsets: np.ndarray) -> np.ndarray:
+    return offsets.astype("timedelta64[D]")
+
+
+def dates(values: np.ndarray) -> pa.Array:
+    return pa.array(values.astype("datetime64[D]"))
+
+
+def retail_price(part_keys: np.ndarray) -> np.ndarray:
+    return (90000 + (part_keys // 10) % 20001 + 100 * (part_keys % 1000)) / 100
+
+
+def part_supplier(part_keys: np.ndarray, i, suppliers: int) -> np.ndarray:
+    """Supplier key of the i-th (0-3) PARTSUPP row of each part."""
+    return (
+        part_keys + i * (suppliers // 4 + (part_keys - 1) // suppliers)
+    ) % suppliers + 1
+
+
+def row_count(table: str, scale_factor: float) -> int:
+    return max(1, int(BASE_ROWS[table] * scale_factor))
+
+
+def gen_region(rng, pool, keys, scale_factor) -> Dict[str, pa.Table]:
+    n = len(REGIONS)
+    table = pa.table(
+        {
+            "R_REGIONKEY": np.arange(n, dtype=np.int64),
+            "R_NAME": pa.array(REGIONS),
+            "R_COMMENT": random_text(rng, pool, n, 31, 115),
+        }
+    )
+    return {"region": table}
+
+
+def gen_nation(rng, pool, keys, scale_factor) -> Dict[str, pa.Table]:
+    n = len(NATIONS)
+    table = pa.table(
+        {
+            "N_NATIONKEY": np.arange(n, dtype=np.int64),
+            "N_NAME": pa.array([name for name, _ in NATIONS]),
+            "N_REGIONKEY": np.array([region for _, region in NATIONS], np.int64),
+            "N_COMMENT": random_text(rng, pool, n, 31, 114),
+        }
+    )
+    return {"nation": table}
+
+
+def gen_supplier(rng, pool, keys, scale_factor) -> Dict[str, pa.Table]:
+    n = len(keys)
+    nation_keys = rng.integers(0, len(NATIONS), n)
+    comments = random_text(rng, pool, n, 25, 100)
+    # 5 per SF10,000 suppliers complain about or recommend customers (Q16).
+    special = rng.random(n) < 10 / BASE_ROWS["supplier"]
+    if special.any():
+        indexes = np.flatnonzero(special)
+        words = ["Complaints", "Recommends"]
+        replacement = [
+            f"{comments[int(i)].as_py()[:20]} Customer {words[j % 2]}"
+            for j, i in enumerate(indexes)
+        ]
+        comments = pc.replace_with_mask(
+            comments, pa.array(special), pa.array(replacement)
+        )
+    table = pa.table(
+        {
+            "S_SUPPKEY": keys,
+            "S_NAME": fixed_strings(b"Supplier#", _digits(keys, 9)),
+            "S_ADDRESS": random_vstring(rng, n, 10, 40),
+            "S_NATIONKEY": nation_keys,
+            "S_PHONE": phones(rng, nation_keys),
+            "S_ACCTBAL": money(rng, -99999, 999999, n),
+            "S_COMMENT": comments,
+        }
+    )
+    return {"supplier": table}
+
+
+def gen_part(rng, pool, keys, scale_factor) -> Dict[str, pa.Table]:
+    n = len(keys)
+    colors = pa.array(COLORS)
+    name_words = np.argsort(rng.random((n, len(COLORS))), axis=1)[:, :5]
+    name = pc.binary_join_element_wise(
+        *[pc.take(colors, name_words[:, i]) for i in range(5)], " "
+    )
+    mfgr = rng.integers(1, 6, n)
+    type_ = pc.binary_join_element_wise(
+        *[choose(rng, syllables, n) for syllables in TYPE_SYLLABLES], " "
+    )
+    container = pc.binary_join_element_wise(
+        *[choose(rng, syllables, n) for syllables in CONTAINER_SYLLABLES], " "
+    )
+    table = pa.table(
+        {
+            "P_PARTKEY": keys,
+            "P_NAME": name,
+            "P_MFGR": fixed_strings(b"Manufacturer#", _digits(mfgr, 1)),
+            "P_BRAND": fixed_strings(
+                b"Brand#", _digits(mfgr, 1), _digits(rng.integers(1, 6, n), 1)
+            ),
+            "P_TYPE": type_,
+            "P_SIZE": rng.integers(1, 51, n),
+            "P_CONTAINER": container,
+            "P_RETAILPRICE": retail_price(keys),
+            "P_COMMENT": random_text(rng, pool, n, 5, 22),
+        }
+    )
+    return {"part": table}
+
+
+def gen_partsupp(rng, pool, keys, scale_factor) -> Dict[str, pa.Table]:
+    suppliers = row_count("supplier", scale_factor)
+    part_keys = np.repeat(keys, 4)
+    n = len(part_keys)
+    supplier_index = np.tile(np.arange(4), len(keys))
+    table = pa.table(
+        {
+            "PS_PARTKEY": part_keys,
+            "PS_SUPPKEY": part_supplier(part_keys, supplier_index, suppliers),
+            "PS_AVAILQTY": rng.integers(1, 10000, n),
+            "PS_SUPPLYCOST": money(rng, 100, 100000, n),
+            "PS_COMMENT": random_text(rng, pool, n, 49, 198),
+        }
+    )
+    return {"partsupp": table}
+
+
+def gen_customer(rng, pool, keys, scale_factor) -> Dict[str, pa.Table]:
+    n = len(keys)
+    nation_keys = rng.integers(0, len(NATIONS), n)
+    table = pa.table(
+        {
+            "C_CUSTKEY": keys,
+            "C_NAME": fixed_strings(b"Customer#", _digits(keys, 9)),
+            "C_ADDRESS": random_vstring(rng, n, 10, 40),
+            "C_NATIONKEY": nation_keys,
+            "C_PHONE": phones(rng, nation_keys),
+            "C_ACCTBAL": money(rng, -99999, 999999, n),
+            "C_MKTSEGMENT": choose(rng, SEGMENTS, n),
+            "C_COMMENT": random_text(rng, pool, n, 29, 116),
+        }
+    )
+    return {"customer": table}
+
+
+def order_key(index: np.ndarray) -> np.ndarray:
+    """Order keys are sparse: only the first 8 of every 32 keys are used."""
+    return index // 8 * 32 + index % 8 + 1
+
+
+def gen_orders(rng, pool, keys, scale_factor) -> Dict[str, pa.Table]:
+    """Generate orders together with their line items."""
+    n = len(keys)
+    customers = row_count("customer", scale_factor)
+    parts = row_count("part", scale_factor)
+    suppliers = row_count("supplier", scale_factor)
+
+    # a third of the customers, those with keys divisible by 3, never order.
+    k = rng.integers(0, customers - customers // 3, n)
+    cust_keys = k + k // 2 + 1
+    last_order_day = (END_DATE - np.timedelta64(151, "D") - START_DATE).astype(int)
+    order_days = START_DATE + days(rng.integers(0, last_order_day + 1, n))
+
+    counts = rng.integers(1, 8, n)
+    lines = counts.sum()
+    order_index = np.repeat(np.arange(n), counts)
+    first_line = np.repeat(np.cumsum(counts) - counts, counts)
+    part_keys = rng.integers(1, parts + 1, lines)
+    quantity = rng.integers(1, 51, lines).astype(np.float64)
+    extended_price = np.round(quantity * retail_price(part_keys), 2)
+    discount = rng.integers(0, 11, lines) / 100
+    tax = rng.integers(0, 9, lines) / 100
+    line_order_days = order_days[order_index]
+    ship = line_order_days + days(rng.integers(1, 122, lines))
+    commit = line_order_days + days(rng.integers(30, 91, lines))
+    receipt = ship + days(rng.integers(1, 31, lines))
+    returned = np.where(rng.random(lines) < 0.5, "R", "A")
+    return_flag = np.where(receipt <= CURRENT_DATE, returned, "N")
+    shipped = ship <= CURRENT_DATE
+    line_status = np.where(shipped, "F", "O")
+
+    shipped_lines = np.bincount(order_index, weights=shipped, minlength=n)
+    order_status = np.where(
+        shipped_lines == counts, "F", np.where(shipped_lines == 0, "O", "P")
+    )
+    charge = extended_price * (1 + tax) * (1 - discount)
+    total_price = np.bincount(order_index, weights=charge, minlength=n)
+    clerks = max(1, int(1000 * scale_factor))
+
+    orders = pa.table(
+        {
+            "O_ORDERKEY": keys,
+            "O_CUSTKEY": cust_keys,
+            "O_ORDERSTATUS": pa.array(order_status),
+            "O_TOTALPRICE": np.round(total_price, 2),
+            "O_ORDERDATE": dates(order_days),
+            "O_ORDERPRIORITY": choose(rng, PRIORITIES, n),
+            "O_CLERK": fixed_strings(
+                b"Clerk#", _digits(rng.integers(1, clerks + 1, n), 9)
+            ),
+            "O_SHIPPRIORITY": np.zeros(n, dtype=np.int64),
+            "O_COMMENT": random_text(rng, pool, n, 19, 78),
+        }
+    )
+    lineitem = pa.table(
+        {
+            "L_ORDERKEY": keys[order_index],
+            "L_PARTKEY": part_keys,
+            "L_SUPPKEY": part_supplier(part_keys, rng.integers(0, 4, lines), suppliers),
+            "L_LINENUMBER": np.arange(lines) - first_line + 1,
+            "L_QUANTITY": quantity,
+            "L_EXTENDEDPRICE": extended_price,
+            "L_DISCOUNT": discount,
+            "L_TAX": tax,
+            "L_RETURNFLAG": pa.array(return_flag),
+            "L_LINESTATUS": pa.array(line_status),
+            "L_SHIPDATE": dates(ship),
+            "L_COMMITDATE": dates(commit),
+            "L_RECEIPTDATE": dates(receipt),
+            "L_SHIPINSTRUCT": choose(rng, INSTRUCTIONS, lines),
+            "L_SHIPMODE": choose(rng, MODES, lines),
+            "L_COMMENT": random_text(rng, pool, lines, 10, 43),
+        }
+    )
+    return {"orders": orders, "lineitem": lineitem}
+
+
+GENERATORS = {
+    "region": gen_region,
+    "nation": gen_nation,
+    "supplier": gen_supplier,
+    "part": gen_part,
+    "partsupp": gen_partsupp,
+    "customer": gen_customer,
+    "orders": gen_orders,
+}
+
+
+def table_keys(table: str, scale_factor: float, file_index: int, num_files: int):
+    """Keys of the rows of `table` that go into one of its files."""
+    if table in ("region", "nation"):
+        return None
+    base = "part" if table == "partsupp" else table
+    rows = row_count(base, scale_factor)
+    start = rows * file_index // num_files
+    stop = rows * (file_index + 1) // num_files
+    index = np.arange(start, stop, dtype=np.int64)
+    return order_key(index) if table == "orders" else index + 1
+
+
+def refresh_rows(scale_factor: float) -> int:
+    """Orders inserted by RF1 and deleted by RF2 of one refresh set."""
+    return max(1, int(1500 * scale_factor))
+
+
+def refresh_orders(
+    scale_factor: float, refresh_set: int, seed: int = 0
+) -> Dict[str, pa.Table]:
+    """New orders and line items inserted by RF1 of refresh set `refresh_set`.
+
+    Refresh sets are numbered from 1. Their order keys fill the second eight
+    of every 32 keys, which the initial population leaves unused.
+    """
+    n = refresh_rows(scale_factor)
+    index = np.arange((refresh_set - 1) * n, refresh_set * n, dtype=np.int64)
+    rng = np.random.default_rng([seed, len(TABLES), refresh_set])
+    return gen_orders(rng, text_pool(seed), order_key(index) + 8, scale_factor)
+
+
+def deleted_order_keys(scale_factor: float, refresh_set: int) -> np.ndarray:
+    """Keys of the initial orders deleted by RF2 of refresh set `refresh_set`."""
+    n = refresh_rows(scale_factor)
+    return order_key(np.arange((refresh_set - 1) * n, refresh_set * n, dtype=np.int64))
+
+
+def generate_file(
+    output: str,
+    table: str,
+    scale_factor: float,
+    file_index: int,
+    num_files: int,
+    seed: int,
+    row_group_size: int,
+    compression: str,
+) -> Dict[str, int]:
+    """Generate and write one file of `table` (and of lineitem for orders)."""
+    rng = np.random.default_rng([seed, TABLES.index(table), file_index])
+    pool = text_pool(seed)
+    keys = table_keys(table, scale_factor, file_index, num_files)
+    written = {}
+    for name, data in GENERATORS[table](rng, pool, keys, scale_factor).items():
+        directory = os.path.join(output, name)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"part-{file_index:05d}.parquet")
+        pq.write_table(
+            data, path, row_group_size=row_group_size, compression=compression
+        )
+        written[name] = data.num_rows
+    return written
+
+
+def generate(
+    output: str,
+    scale_factor: float,
+    num_files: int = None,
+    seed: int = 0,
+    row_group_size: int = 1024 * 1024,
+    compression: str = "snappy",
+    workers: int = None,
+    tables: List[str] = None,
+) -> Dict[str, int]:
+    """Generate the TPC-H tables under `output`, one directory per table.
+
+    Every scalable table is split into `num_files` files (by default one per
+    unit of scale factor); orders and lineitem are generated together so
+    that each lineitem file holds the lines of the same orders file.
+    Returns the number of rows written per table.
+    """
+    if num_files is None:
+        num_files = max(1, math.ceil(scale_factor))
+    tables = tables or TABLES
+    tasks = []
+    for table in tables:
+        files = 1 if table in ("region", "nation") else num_files
+        for file_index in range(files):
+            tasks.append((table, file_index, files))
+    # largest tables first, so the pool is not left waiting on one of them.
+    order = ["orders", "partsupp", "part", "customer", "supplier", "nation", "region"]
+    tasks.sort(key=lambda task: order.index(task[0]))
+
+    rows = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(
+                generate_file,
+                output,
+                table,
+                scale_factor,
+                file_index,
+                files,
+                seed,
+                row_group_size,
+                compression,
+            )
+            for table, file_index, files in tasks
+        ]
+        for future in futures:
+            for name, count in future.result().items():
+                rows[name] = rows.get(name, 0) + count
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TPC-H data generator.")
+    parser.add_argument(
+        "--output", type=str, required=True, help="directory to write the tables to."
+    )
+    parser.add_argument(
+        "--scale_factor",
+        type=float,
+        default=float(SCALE_FACTOR),
+        help="TPC-H scale factor.",
+    )
+    parser.add_argument(
+        "--num_files",
+        type=int,
+        required=False,
+        help="files per table, one per unit of scale factor by default.",
+    )
+    parser.add_argument(
+        "--row_group_size",
+        type=int,
+        default=1024 * 1024,
+        help="maximum rows per Parquet row group.",
+    )
+    parser.add_argument(
+        "--compression",
+        type=str,
+        default="snappy",
+        help="Parquet compression codec, e.g. snappy, zstd, lz4 or none.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        required=False,
+        help="processes generating files, all cores by default.",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed.")
+    parser.add_argument(
+        "--tables",
+        type=str,
+        nargs="+",
+        required=False,
+        choices=TABLES,
+        help="tables to generate; orders also generates lineitem.",
+    )
+    args = parser.parse_args()
+    print(f"Output: {args.output}")
+    print(f"Scale factor: {args.scale_factor}")
+
+    start = time.time()
+    rows = generate(
+        args.output,
+        args.scale_factor,
+        num_files=args.num_files,
+        seed=args.seed,
+        row_group_size=args.row_group_size,
+        compression=args.compression,
+        workers=args.workers,
+        tables=args.tables,
+    )
+    for table, count in sorted(rows.items()):
+        print(f"{table}: {count} rows")
+    print(f"Total generation time (s): {time.time() - start}")
+
+
+if __name__ == "__main__":
+    main()
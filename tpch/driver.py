@@ -0,0 +1,866 @@
+import argparse
+import importlib
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Callable, Dict, List, Optional, Tuple
+
+import common_utils
+from common_utils import SCALE_FACTOR, log_time_fn, print_result_fn
+from datagen import deleted_order_keys, refresh_orders
+from isolation import (
+    drop_page_cache,
+    map_shared_tables,
+    remove_shared_tables,
+    write_dataset_tables,
+    write_shared_tables,
+)
+from memory import MemoryMonitor
+from metrics import MetricsWriter, new_run_id
+from stats import summarize
+from streams import stream_queries, throughput_metrics
+
+# engine name -> module holding its `query_to_loaders`/`query_to_runner` tables.
+ENGINES = {
+    "pandas": "pandas_queries.queries",
+    "polars": "polars_queries.queries",
+    "duckdb": "duckdb_queries.queries",
+    "dask": "dask_queries.queries",
+    "modin": "modin_queries.queries",
+    "xorbits": "xorbits_queries.queries",
+    "daft": "daft_queries.queries",
+    "cudf": "cudf_queries.queries",
+    "pyspark_sql": "pyspark_queries.sql_queries",
+    "pyspark_pandas": "pyspark_queries.pandas_queries",
+}
+# engines whose loaders can map the tables written by `--share_tables`.
+SHARED_TABLE_ENGINES = {"pandas", "polars", "duckdb"}
+
+
+def _identity(result):
+    return result
+
+
+@dataclass
+class Engine:
+    """What the driver needs to run TPC-H queries on one engine.
+
+    `args`/`kwargs` are passed verbatim to every loader and query runner.
+    `table_loaders` names the table of every loader for the load times;
+    other loaders are timed under their function name.
+    `materialize` forces a query result into a concrete (pandas or polars)
+    frame; engines whose native result format differs can set
+    `convert_result` to turn it into the requested format, timed on its own
+    as `convert_result_time` and not counted as part of the query latency.
+    `after_load` runs once all tables are loaded, e.g. to
+    persist them on a cluster. Lazy engines may set `optimize` to time plan
+    optimization on its own; that time is logged but not counted as part of
+    the query latency. Engines that can hand their loaded tables to another
+    process set `tables_to_arrow`, returning them as Arrow tables by name,
+    and `tables_from_arrow`, installing such tables as loaded. The TPC-H
+    refresh functions call `refresh_insert` with new orders and lineitem
+    Arrow tables (RF1) and `refresh_delete` with an array of order keys to
+    delete from both (RF2); they update the loaded tables in place, leaving
+    them as cached as after loading. `unload` drops all loaded tables (and
+    whatever the engine cached for them), so that the loaders read them
+    again. Engines keeping their data in worker processes can set
+    `storage_usage`, returning byte counters of that storage; their peak and
+    increase during each query are logged next to the process memory.
+    `config` holds engine settings recorded with every time metric.
+    Worker processes spawned for `--isolate` and the process stream executor
+    only receive the pickled Engine, not the module state its `run_queries`
+    set up, so engines keep their settings in `setup`, a picklable callable
+    (e.g. a `functools.partial` of a module function) that `run_queries`
+    calls and every worker calls again before installing its tables.
+    Loaders run concurrently on a thread pool unless `parallel_load` is
+    False.
+    """
+
+    name: str
+    version: str
+    query_to_loaders: Dict[int, List[Callable]]
+    query_to_runner: Dict[int, Callable]
+    table_loaders: Dict[str, Callable] = field(default_factory=dict)
+    args: Tuple = ()
+    kwargs: Dict = field(default_factory=dict)
+    materialize: Callable = _identity
+    convert_result: Optional[Callable] = None
+    after_load: Optional[Callable] = None
+    optimize: Optional[Callable] = None
+    tables_to_arrow: Optional[Callable] = None
+    tables_from_arrow: Optional[Callable] = None
+    refresh_insert: Optional[Callable] = None
+    refresh_delete: Optional[Callable] = None
+    unload: Optional[Callable] = None
+    setup: Optional[Callable] = None
+    storage_usage: Optional[Callable] = None
+    config: Dict = field(default_factory=dict)
+    parallel_load: bool = True
+
+
+def load_tables(engine: Engine, queries: List[int], threads: int = 1) -> Dict:
+    """Load the tables used by `queries` and time every table.
+
+    Each loader runs once, on a pool of up to `threads` threads; Parquet
+    readers release the GIL while decoding. Returns the total `io_time`
+    and, per table in `io_tables`, the time spent reading it and converting
+    its columns (as reported by the loaders through
+    `common_utils.convert_timer`), plus the time of `after_load`. Tables
+    loaded concurrently overlap, so their times add up to more than
+    `io_time`.
+    """
+    common_utils.convert_times.clear()
+    loaders = list(
+        dict.fromkeys(
+            loader for query in queries for loader in engine.query_to_loaders[query]
+        )
+    )
+
+    def load(loader: Callable) -> float:
+        loader_start = time.perf_counter()
+        loader(*engine.args, **engine.kwargs)
+        return time.perf_counter() - loader_start
+
+    start_time = time.perf_counter()
+    threads = min(threads, len(loaders))
+    if threads > 1 and engine.parallel_load:
+        with ThreadPoolExecutor(threads, thread_name_prefix="load") as pool:
+            elapsed = list(pool.map(load, loaders))
+    else:
+        elapsed = [load(loader) for loader in loaders]
+    load_times = {}
+    loader_tables = {loader: table for table, loader in engine.table_loaders.items()}
+    for loader, loader_time in zip(loaders, elapsed):
+        table = loader_tables.get(loader, loader.__name__)
+        load_times[table] = load_times.get(table, 0.0) + loader_time
+    after_load_time = 0.0
+    if engine.after_load is not None:
+        after_load_start = time.perf_counter()
+        engine.after_load()
+        after_load_time = time.perf_counter() - after_load_start
+    io_time = time.perf_counter() - start_time
+
+    tables = list(load_times)
+    convert_times = [common_utils.convert_times.get(table, 0.0) for table in tables]
+    return {
+        "io_time": io_time,
+        "io_tables": tables,
+        "read_times": [
+            load_times[table] - convert_time
+            for table, convert_time in zip(tables, convert_times)
+        ],
+        "convert_times": convert_times,
+        "after_load_time": after_load_time,
+    }
+
+
+def run_query(engine: Engine, query: int, optimize: bool = True):
+    """Run one query through the execute, materialize and convert phases.
+
+    Returns the converted result and a dict with the phase timings.
+    `optimize=False` skips the separately timed optimize phase.
+    """
+    start_time = time.perf_counter()
+    result = engine.query_to_runner[query](*engine.args, **engine.kwargs)
+    execute_time = time.perf_counter() - start_time
+
+    optimize_time = 0.0
+    if optimize and engine.optimize is not None:
+        start_time = time.perf_counter()
+        result = engine.optimize(result)
+        optimize_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    result = engine.materialize(result)
+    materialize_time = time.perf_counter() - start_time
+
+    convert_result_time = 0.0
+    if engine.convert_result is not None:
+        start_time = time.perf_counter()
+        result = engine.convert_result(result)
+        convert_result_time = time.perf_counter() - start_time
+
+    timings = {
+        "execute_time": execute_time,
+        "optimize_time": optimize_time,
+        "materialize_time": materialize_time,
+        "convert_result_time": convert_result_time,
+    }
+    return result, timings
+
+
+def run_query_with_io(
+    engine: Engine,
+    query: int,
+    drop_cache_cmd: Optional[str] = None,
+    load_threads: int = 1,
+):
+    """Like `run_query`, but first load the query's tables from scratch.
+
+    The returned timings also hold those of `load_tables`.
+    """
+    engine.unload()
+    if drop_cache_cmd is not None:
+        drop_page_cache(drop_cache_cmd)
+    io_timings = load_tables(engine, [query], load_threads)
+    result, timings = run_query(engine, query)
+    return result, {**timings, **io_timings}
+
+
+def measure_query(
+    engine: Engine,
+    query: int,
+    warmup: int = 0,
+    repeat: int = 1,
+    print_result: bool = False,
+    trace_memory: bool = False,
+    include_io: bool = False,
+    drop_cache_cmd: Optional[str] = None,
+    load_threads: int = 1,
+) -> Dict:
+    """Run a query `warmup` times untimed, then `repeat` times timed.
+
+    With `include_io`, every run loads the tables of the query again.
+    Returns the timing and memory fields of the query record; memory
+    high-water marks cover all runs of the query.
+    """
+    if include_io:
+        run = partial(
+            run_query_with_io,
+            drop_cache_cmd=drop_cache_cmd,
+            load_threads=load_threads,
+        )
+    else:
+        run = run_query
+    warmup_times = []
+    runs = []
+    with MemoryMonitor(
+        trace_python=trace_memory, engine_usage=engine.storage_usage
+    ) as monitor:
+        for _ in range(warmup):
+            _, timings = run(engine, query)
+            warmup_times.append(query_time(timings))
+        for _ in range(repeat):
+            result, timings = run(engine, query)
+            runs.append(timings)
+    if print_result:
+        print_result_fn(engine.name, result, query)
+    return {**summarize_runs(runs, warmup_times), **monitor.metrics()}
+
+
+def _isolated_worker(
+    engine, query, table_dir, warmup, repeat, print_result, trace_memory, conn
+):
+    try:
+        if engine.setup is not None:
+            engine.setup()
+        engine.tables_from_arrow(map_shared_tables(table_dir))
+        # the first run in a fresh interpreter pays for cold allocator, CPU
+        # caches and page faults on the shared tables; later runs are hot.
+        _, timings = run_query(engine, query)
+        record = measure_query(
+            engine, query, warmup, repeat, print_result, trace_memory
+        )
+        record["cold_time"] = query_time(timings)
+        conn.send((True, record))
+    except Exception as e:
+        error = "".join(traceback.TracebackException.from_exception(e).format())
+        conn.send((False, error))
+    finally:
+        conn.close()
+
+
+def measure_isolated_query(
+    engine: Engine,
+    query: int,
+    table_dir: str,
+    warmup: int = 0,
+    repeat: int = 1,
+    print_result: bool = False,
+    trace_memory: bool = False,
+) -> Dict:
+    """Like `measure_query`, but in a freshly spawned interpreter.
+
+    The worker maps the tables from `table_dir` instead of loading them.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    worker = ctx.Process(
+        target=_isolated_worker,
+        args=(
+            engine,
+            query,
+            table_dir,
+            warmup,
+            repeat,
+            print_result,
+            trace_memory,
+            child_conn,
+        ),
+    )
+    worker.start()
+    child_conn.close()
+    try:
+        success, payload = parent_conn.recv()
+    except EOFError:
+        success, payload = False, None
+    worker.join()
+    if not success:
+        if payload is None:
+            payload = f"worker exited with code {worker.exitcode}"
+        raise RuntimeError(f"q{query} failed in isolated worker:\n{payload}")
+    return payload
+
+
+def run_refresh(
+    engine: Engine,
+    function: str,
+    refresh_set: int,
+    scale_factor: str,
+    origin: Optional[float] = None,
+) -> Dict:
+    """Run refresh function "RF1" or "RF2" of `refresh_set`.
+
+    The rows to insert or keys to delete are generated before the timer
+    starts. Returns a record with the time of the refresh function and its
+    start relative to `origin`; failures are recorded, not raised.
+    """
+    if function == "RF1":
+        apply = engine.refresh_insert
+        data = refresh_orders(float(scale_factor), refresh_set)
+    else:
+        apply = engine.refresh_delete
+        data = deleted_order_keys(float(scale_factor), refresh_set)
+    start_time = time.perf_counter()
+    if origin is None:
+        origin = start_time
+    try:
+        apply(data)
+        success = True
+    except Exception as e:
+        error = "".join(traceback.TracebackException.from_exception(e).format())
+        print(f"{function} of refresh set {refresh_set} failed:\n{error}")
+        success = False
+    end_time = time.perf_counter()
+    return {
+        "function": function,
+        "refresh_set": refresh_set,
+        "start_offset": start_time - origin,
+        "latency": end_time - start_time,
+        "success": success,
+    }
+
+
+def run_refresh_stream(engine: Engine, streams: int, scale_factor: str) -> List[Dict]:
+    """Run one RF1/RF2 pair per query stream, as the throughput test does.
+
+    Refresh set 1 belongs to the power run, so the pairs use sets 2 onwards.
+    """
+    stream_start = time.perf_counter()
+    return [
+        run_refresh(engine, function, refresh_set, scale_factor, stream_start)
+        for refresh_set in range(2, streams + 2)
+        for function in ("RF1", "RF2")
+    ]
+
+
+def log_refresh(
+    engine: Engine,
+    records: List[Dict],
+    test: str,
+    writer: Optional[MetricsWriter] = None,
+):
+    for record in records:
+        print(
+            f"{record['function']} of refresh set {record['refresh_set']} "
+            f"time (s): {record['latency']}"
+        )
+        if writer is None:
+            continue
+        metric = log_time_fn(
+            engine.name,
+            None,
+            version=engine.version,
+            without_io_time=record["latency"],
+            success=record["success"],
+            test=test,
+            refresh_function=record["function"],
+            refresh_set=record["refresh_set"],
+            start_offset=record["start_offset"],
+        )
+        writer.write(metric)
+
+
+def run_stream(engine: Engine, stream: int, queries: List[int]) -> List[Dict]:
+    """Run the queries of one throughput test stream back to back.
+
+    Returns one record per query with its latency and its start relative to
+    the start of the stream; failed queries are recorded and skipped.
+    """
+    records = []
+    stream_start = time.perf_counter()
+    for position, query in enumerate(stream_queries(stream, queries)):
+        start_time = time.perf_counter()
+        try:
+            run_query(engine, query, optimize=False)
+            success = True
+        except Exception as e:
+            error = "".join(traceback.TracebackException.from_exception(e).format())
+            print(f"Stream {stream} q{query} failed:\n{error}")
+            success = False
+        end_time = time.perf_counter()
+        records.append(
+            {
+                "stream": stream,
+                "position": position,
+                "query": query,
+                "start_offset": start_time - stream_start,
+                "latency": end_time - start_time,
+                "success": success,
+            }
+        )
+    return records
+
+
+def _stream_worker(engine, stream, queries, table_dir, barrier, conn):
+    try:
+        if engine.setup is not None:
+            engine.setup()
+        engine.tables_from_arrow(map_shared_tables(table_dir))
+        barrier.wait()
+        conn.send((True, run_stream(engine, stream, queries)))
+    except Exception as e:
+        # release the other streams and the driver waiting on the barrier.
+        barrier.abort()
+        error = "".join(traceback.TracebackException.from_exception(e).format())
+        conn.send((False, error))
+    finally:
+        conn.close()
+
+
+def _run_stream_processes(engine, streams, queries, table_dir):
+    ctx = multiprocessing.get_context("spawn")
+    barrier = ctx.Barrier(streams + 1)
+    workers = []
+    for stream in range(1, streams + 1):
+        parent_conn, child_conn = ctx.Pipe(duplex=False)
+        worker = ctx.Process(
+            target=_stream_worker,
+            args=(engine, stream, queries, table_dir, barrier, child_conn),
+        )
+        worker.start()
+        child_conn.close()
+        workers.append((worker, parent_conn))
+
+    payloads = []
+    try:
+        barrier.wait()
+    except threading.BrokenBarrierError:
+        pass
+    start_time = time.perf_counter()
+    for worker, parent_conn in workers:
+        try:
+            payloads.append(parent_conn.recv())
+        except EOFError:
+            payloads.append((False, f"worker exited with code {worker.exitcode}"))
+    elapsed = time.perf_counter() - start_time
+    for worker, _ in workers:
+        worker.join()
+
+    errors = [payload for success, payload in payloads if not success]
+    if errors:
+        raise RuntimeError("throughput stream failed:\n" + "\n".join(errors))
+    return [payload for _, payload in payloads], [], elapsed
+
+
+def _run_stream_threads(engine, streams, queries, refresh, scale_factor):
+    barrier = threading.Barrier(streams + 2 if refresh else streams + 1)
+    results = [None] * streams
+    refresh_records = []
+
+    def target(index):
+        barrier.wait()
+        results[index] = run_stream(engine, index + 1, queries)
+
+    def refresh_target():
+        barrier.wait()
+        refresh_records.extend(run_refresh_stream(engine, streams, scale_factor))
+
+    threads = [
+        threading.Thread(target=target, args=(index,)) for index in range(streams)
+    ]
+    if refresh:
+        threads.append(threading.Thread(target=refresh_target))
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start_time = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return results, refresh_records, time.perf_counter() - start_time
+
+
+def run_throughput(
+    engine: Engine,
+    queries: List[int],
+    streams: int,
+    executor: str = "thread",
+    table_dir: Optional[str] = None,
+    refresh: bool = False,
+    scale_factor: str = SCALE_FACTOR,
+) -> Tuple[List[List[Dict]], List[Dict], float]:
+    """Run the TPC-H throughput test: `streams` concurrent query streams.
+
+    With the "thread" executor all streams share the tables loaded in this
+    process, and engines backed by a cluster submit their jobs from one
+    thread per stream. With "process" every stream runs in its own spawned
+    interpreter on the tables mapped from `table_dir`. With `refresh`, a
+    refresh stream runs alongside the query streams (thread executor only).
+    All streams start together; returns the records of every query stream,
+    those of the refresh stream and the elapsed time until the last stream
+    finished.
+    """
+    if executor == "process":
+        return _run_stream_processes(engine, streams, queries, table_dir)
+    return _run_stream_threads(engine, streams, queries, refresh, scale_factor)
+
+
+def log_throughput(
+    engine: Engine,
+    queries: List[int],
+    results: List[List[Dict]],
+    elapsed: float,
+    scale_factor: str,
+    writer: Optional[MetricsWriter] = None,
+):
+    # a stream thread that died returns no records, and neither does a
+    # stream without queries.
+    results = [records for records in results if records]
+    if not results:
+        print("Throughput test: no stream ran a query")
+        if writer is not None:
+            writer.write(
+                {
+                    "framework": engine.name,
+                    "version": engine.version,
+                    "test": "throughput_summary",
+                    "is_success": False,
+                }
+            )
+        return
+    stream_times = [
+        records[-1]["start_offset"] + records[-1]["latency"] for records in results
+    ]
+    for records, stream_time in zip(results, stream_times):
+        print(f"Stream {records[0]['stream']} time (s): {stream_time}")
+        if writer is None:
+            continue
+        for record in records:
+            metric = log_time_fn(
+                engine.name,
+                record["query"],
+                version=engine.version,
+                without_io_time=record["latency"],
+                success=record["success"],
+                test="throughput",
+                stream=record["stream"],
+                position=record["position"],
+                start_offset=record["start_offset"],
+            )
+            writer.write(metric)
+
+    summary = throughput_metrics(len(results), len(queries), elapsed, scale_factor)
+    print(
+        f"Throughput test: {summary['streams']} streams in {elapsed} s, "
+        f"{summary['queries_per_hour']:.1f} queries per hour"
+    )
+    if writer is not None:
+        writer.write(
+            {
+                "framework": engine.name,
+                "version": engine.version,
+                "test": "throughput_summary",
+                "is_success": True,
+                "stream_times": stream_times,
+                **summary,
+            }
+        )
+
+
+def run_engine(
+    engine: Engine,
+    queries: List[int],
+    log_time: bool = True,
+    print_result: bool = False,
+    include_io: bool = False,
+    warmup: int = 0,
+    repeat: int = 1,
+    isolate: bool = False,
+    drop_cache_cmd: Optional[str] = None,
+    trace_memory: bool = False,
+    metrics_dir: str = "metrics",
+    scale_factor: str = SCALE_FACTOR,
+    run_id: Optional[str] = None,
+    dataset_path: Optional[str] = None,
+    streams: int = 0,
+    stream_executor: str = "thread",
+    refresh: bool = False,
+    load_threads: Optional[int] = None,
+):
+    if load_threads is None:
+        load_threads = os.cpu_count() or 1
+    share_tables = isolate or (streams > 0 and stream_executor == "process")
+    if share_tables and engine.tables_to_arrow is None:
+        raise ValueError(
+            f"{engine.name} can not hand its tables over to other processes"
+        )
+    if refresh and engine.refresh_insert is None:
+        raise ValueError(f"{engine.name} does not implement the refresh functions")
+    if refresh and streams > 0 and stream_executor == "process":
+        raise ValueError("refresh functions need the thread stream executor")
+    if include_io and engine.unload is None:
+        raise ValueError(f"{engine.name} can not unload its tables to include io")
+    if include_io and (isolate or refresh):
+        raise ValueError("include_io can not be combined with isolate or refresh")
+    if isolate and drop_cache_cmd is not None:
+        # isolated workers map their tables from /dev/shm, which dropping the
+        # page cache leaves in memory, so their runs are always warm.
+        raise ValueError("drop_cache_cmd has no effect on isolated runs")
+
+    writer = None
+    if log_time:
+        run_id = run_id or new_run_id()
+        print(f"Run id: {run_id}")
+        config = {
+            "include_io": include_io,
+            "warmup": warmup,
+            "repeat": repeat,
+            "isolate": isolate,
+            "trace_memory": trace_memory,
+            "streams": streams,
+            "stream_executor": stream_executor,
+            "refresh": refresh,
+            "load_threads": load_threads if engine.parallel_load else 1,
+            **engine.kwargs,
+            **engine.config,
+        }
+        writer = MetricsWriter(
+            metrics_dir,
+            engine.name,
+            engine.version,
+            scale_factor,
+            run_id,
+            dataset_path=dataset_path,
+            config=config,
+        )
+
+    if not include_io:
+        data_start_time = time.perf_counter()
+        io_timings = load_tables(engine, queries, load_threads)
+        print(f"Total data loading time (s): {time.perf_counter() - data_start_time}")
+        table_times = zip(
+            io_timings["io_tables"],
+            io_timings["read_times"],
+            io_timings["convert_times"],
+        )
+        for table, read_time, convert_time in table_times:
+            print(f"  {table} read (s): {read_time}, convert (s): {convert_time}")
+
+    if refresh:
+        records = [run_refresh(engine, "RF1", 1, scale_factor)]
+        log_refresh(engine, records, "power", writer)
+
+    table_dir = None
+    if share_tables:
+        table_dir = write_shared_tables(engine.tables_to_arrow())
+
+    total_start = time.perf_counter()
+    try:
+        for query in queries:
+            try:
+                if isolate:
+                    record = measure_isolated_query(
+                        engine,
+                        query,
+                        table_dir,
+                        warmup,
+                        repeat,
+                        print_result,
+                        trace_memory,
+                    )
+                else:
+                    record = measure_query(
+                        engine,
+                        query,
+                        warmup,
+                        repeat,
+                        print_result,
+                        trace_memory,
+                        include_io,
+                        drop_cache_cmd,
+                        load_threads,
+                    )
+                success = True
+            except Exception as e:
+                print("".join(traceback.TracebackException.from_exception(e).format()))
+                record = summarize_runs([], [])
+                success = False
+            if writer is not None:
+                metric = log_time_fn(
+                    engine.name,
+                    query,
+                    version=engine.version,
+                    success=success,
+                    test="power",
+                    **record,
+                )
+                writer.write(metric)
+        print(f"Total query execution time (s): {time.perf_counter() - total_start}")
+
+        if refresh:
+            records = [run_refresh(engine, "RF2", 1, scale_factor)]
+            log_refresh(engine, records, "power", writer)
+
+        if streams > 0:
+            if include_io:
+                load_tables(engine, queries, load_threads)
+            results, refresh_records, elapsed = run_throughput(
+                engine,
+                queries,
+                streams,
+                stream_executor,
+                table_dir,
+                refresh,
+                scale_factor,
+            )
+            log_refresh(engine, refresh_records, "throughput", writer)
+            log_throughput(engine, queries, results, elapsed, scale_factor, writer)
+    finally:
+        if writer is not None:
+            writer.close()
+        if table_dir is not None:
+            remove_shared_tables(table_dir)
+
+
+def query_time(timings: Dict) -> float:
+    return timings["execute_time"] + timings["materialize_time"]
+
+
+def summarize_runs(runs: List[Dict], warmup_times: List[float]) -> Dict:
+    """Build the timing fields of a query record from its measured runs.
+
+    Phase timings, `without_io_time` and, for runs that loaded their tables,
+    `with_io_time` and the per table load times are medians over the runs;
+    failed queries report zeros.
+    """
+    phases = [
+        "execute_time",
+        "optimize_time",
+        "materialize_time",
+        "convert_result_time",
+    ]
+    if not runs:
+        return {"without_io_time": 0.0, **{phase: 0.0 for phase in phases}}
+    samples = [query_time(timings) for timings in runs]
+    record = {
+        "without_io_time": statistics.median(samples),
+        **{phase: statistics.median(run[phase] for run in runs) for phase in phases},
+        **summarize(samples),
+        "samples": samples,
+        "warmup_times": warmup_times,
+    }
+    if "io_time" in runs[0]:
+        tables = runs[0]["io_tables"]
+        record.update(
+            {
+                "with_io_time": statistics.median(
+                    run["io_time"] + query_time(run) for run in runs
+                ),
+                "io_time": statistics.median(run["io_time"] for run in runs),
+                "after_load_time": statistics.median(
+                    run["after_load_time"] for run in runs
+                ),
+                "io_tables": tables,
+                **{
+                    times: [
+                        statistics.median(run[times][i] for run in runs)
+                        for i in range(len(tables))
+                    ]
+                    for times in ("read_times", "convert_times")
+                },
+            }
+        )
+    return record
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="TPC-H benchmark driver.",
+        epilog="Remaining arguments are forwarded to each engine.",
+    )
+    parser.add_argument(
+        "--engines",
+        type=str,
+        nargs="+",
+        required=True,
+        choices=sorted(ENGINES),
+        help="whitespace separated engines to benchmark.",
+    )
+    parser.add_argument(
+        "--run_id",
+        type=str,
+        default=new_run_id(),
+        help="id recorded with the time metrics of all engines.",
+    )
+    parser.add_argument(
+        "--share_tables",
+        default=False,
+        action="store_true",
+        help="decode the dataset once into shared memory for all engines.",
+    )
+    args, engine_argv = parser.parse_known_args()
+    engine_argv += ["--run_id", args.run_id]
+
+    shared_dir = None
+    if args.share_tables:
+        path_parser = argparse.ArgumentParser(add_help=False)
+        path_parser.add_argument("--path", type=str, required=True)
+        path = path_parser.parse_known_args(engine_argv)[0].path
+        start = time.perf_counter()
+        shared_dir = write_dataset_tables(path)
+        print(f"Shared tables time (s): {time.perf_counter() - start}")
+
+    try:
+        if len(args.engines) == 1:
+            name = args.engines[0]
+            if shared_dir is not None and name in SHARED_TABLE_ENGINES:
+                engine_argv += ["--shared_dir", shared_dir]
+            module = importlib.import_module(ENGINES[name])
+            module.main(engine_argv)
+            return
+
+        # every engine gets its own interpreter so that none of them inherits
+        # threads, memory pools or caches from the previous one.
+        for name in args.engines:
+            print(f"Engine: {name}")
+            cmd = [sys.executable, "-u", "-m", ENGINES[name]] + engine_argv
+            if shared_dir is not None and name in SHARED_TABLE_ENGINES:
+                cmd += ["--shared_dir", shared_dir]
+            completed = subprocess.run(cmd)
+            if completed.returncode != 0:
+                print(f"{name} exited with code {completed.returncode}")
+    finally:
+        if shared_dir is not None:
+            remove_shared_tables(shared_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,95 @@
 import argparse
 import os
-import time
-import traceback
+import threading
+from functools import partial
+from typing import Dict, Optional
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 
 pd.set_option("display.max_columns", None)
 
 import duckdb
-from common_utils import log_time_fn, parse_common_arguments, print_result_fn
+from common_utils import get_run_options, parse_common_arguments
+from driver import Engine, run_engine
 from duckdb import DuckDBPyRelation
+from isolation import map_shared_tables
 
 dataset_dict = {}
 
+# tables live in one in-memory database that every thread queries through its
+# own cursor, since a duckdb connection must not be shared between threads.
+database = duckdb.connect()
+_local = threading.local()
+# Arrow tables the driver decoded once for all engines, mapped by run_queries
+# with --shared_dir.
+shared_tables: Dict[str, pa.Table] = {}
+# how the loaders make a table available, set by configure: "table" copies
+# it into the in-memory database, "view" queries the Parquet files in place
+# and "persistent" copies it into an on-disk database file once, which later
+# runs reuse.
+load_options = {"mode": "table"}
+
+
+def open_database(database_file: str):
+    """Keep the tables in `database_file` instead of in memory."""
+    global database
+    database.close()
+    database = duckdb.connect(database_file)
+
+
+def configure_database(threads: Optional[int], memory_limit: Optional[str]):
+    """Apply the connection settings and return the ones in effect."""
+    if threads is not None:
+        database.execute(f"set threads = {threads};")
+    if memory_limit is not None:
+        database.execute(f"set memory_limit = '{memory_limit}';")
+    threads, memory_limit = database.sql(
+        "select current_setting('threads'), current_setting('memory_limit');"
+    ).fetchone()
+    return {"threads": threads, "memory_limit": memory_limit}
+
+
+def configure(
+    load_mode: str = "table",
+    threads: Optional[int] = None,
+    memory_limit: Optional[str] = None,
+) -> Dict:
+    """Set the load mode and the connection settings and return the latter
+    as in effect; the driver calls it again in the worker processes it
+    spawns, which start with a fresh connection."""
+    load_options["mode"] = load_mode
+    return configure_database(threads, memory_limit)
+
+
+def connection() -> duckdb.DuckDBPyConnection:
+    if not hasattr(_local, "cursor"):
+        _local.cursor = database.cursor()
+    return _local.cursor
+
 
 def create_table(path: str, talbe_name: str):
-    duckdb.sql(
-        f"create temp table if not exists {talbe_name} as select * from read_parquet('{path}/*.parquet');"
+    if load_options["mode"] == "view":
+        # projections and filters are pushed into the Parquet scan of every
+        # query; hive partition columns are read from the directory names.
+        connection().sql(
+            f"create or replace view {talbe_name} as select * from "
+            f"read_parquet('{path}/**/*.parquet', hive_partitioning = true);"
+        )
+        return talbe_name
+    shared = shared_tables.get(talbe_name.lower())
+    if shared is None:
+        connection().sql(
+            f"create table if not exists {talbe_name} as select * from read_parquet('{path}/*.parquet');"
+        )
+        return talbe_name
+    # the mapped Arrow table is scanned as is, without decoding Parquet again.
+    connection().register("shared_table", shared)
+    connection().sql(
+        f"create table if not exists {talbe_name} as select * from shared_table;"
     )
+    connection().unregister("shared_table")
     return talbe_name
 
 
@@ -104,7 +176,7 @@ def load_partsupp(root: str):
 def q01(root: str):
     lineitem = load_lineitem(root)
 
-    total = duckdb.sql(
+    total = connection().sql(
         """SELECT
                 L_RETURNFLAG,
                 L_LINESTATUS,
@@ -140,7 +212,7 @@ def q02(root: str):
     size = 15
     type = "BRASS"
     region_name = "EUROPE"
-    total = duckdb.sql(
+    total = connection().sql(
         f"""SELECT
                 S_ACCTBAL,
                 S_NAME,
@@ -195,7 +267,7 @@ def q03(root: str):
 
     mktsegment = "HOUSEHOLD"
     date = "1995-03-04"
-    total = duckdb.sql(
+    total = connection().sql(
         f"""SELECT
             L_ORDERKEY,
             SUM(L_EXTENDEDPRICE * (1 - L_DISCOUNT)) AS REVENUE,
@@ -228,7 +300,7 @@ def q04(root: str):
     orders = load_orders(root)
 
     date = "1993-08-01"
-    total = duckdb.sql(
+    total = connection().sql(
         f"""SELECT
                 O_ORDERPRIORITY,
                 COUNT(*) AS ORDER_COUNT
@@ -265,7 +337,7 @@ def q05(root: str):
 
     region_name = "ASIA"
     date = "1996-01-01"
-    total = duckdb.sql(
+    total = connection().sql(
         f"""SELECT
                 N_NAME,
                 SUM(L_EXTENDEDPRICE * (1 - L_DISCOUNT)) AS REVENUE
@@ -298,7 +370,7 @@ def q06(root: str):
     lineitem = load_lineitem(root)
 
     date = "1996-01-01"
-    total = duckdb.sql(
+    total = connection().sql(
         f"""SELECT
                 SUM(L_EXTENDEDPRICE * L_DISCOUNT) AS REVENUE
             FROM
@@ -321,7 +393,7 @@ def q07(root: str):
 
     nation1 = "FRANCE"
     nation2 = "GERMANY"
-    total = duckdb.sql(
+    total = connection().sql(
         f"""SELECT
                 SUPP_NATION,
                 CUST_NATION,
@@ -375,7 +447,7 @@ def q08(root: str):
     nation_name = "BRAZIL"
     region_name = "AMERICA"
     type = "ECONOMY ANODIZED STEEL"
-    total = duckdb.sql(
+    total = connection().sql(
         f"""SELECT
                 O_YEAR,
                 SUM(CASE
@@ -428,7 +500,7 @@ def q09(root: str):
 
     name = "ghost"
 
-    total = duckdb.sql(
+    total = connection().sql(
         f"""SELECT
                 NATION,
                 O_YEAR,
@@ -472,7 +544,7 @@ def q10(root: str):
     customer = load_customer(root)
 
     date = "1994-11-01"
-    total = duckdb.sql(
+    total = connection().sql(
         f"""SELECT
                 C_CUSTKEY,
                 C_NAME,
@@ -518,7 +590,7 @@ def q11(root: str):
     nation_name = "GERMANY"
     fraction = 0.0001
 
-    total = duckdb.sql(
+    total = connection().sql(
         f"""SELECT
                 PS_PARTKEY,
                 SUM(PS_SUPPLYCOST * PS_AVAILQTY) AS VALUE
@@ -558,7 +630,7 @@ def q12(root):
     shipmode1 = "MAIL"
     shipmode2 = "SHIP"
     date = "1994-01-01"
-    total = duckdb.sql(
+    total = connection().sql(
         f"""SELECT
                 L_SHIPMODE,
                 SUM(CASE
@@ -598,7 +670,7 @@ def q13(root: str):
 
     word1 = "special"
     word2 = "requests"
-    total = duckdb.sql(
+    total = connection().sql(
         f"""SELECT
                 C_COUNT, COUNT(*) AS CUSTDIST
             FROM (
@@ -626,7 +698,7 @@ def q14(root):
     part = load_part(root)
 
     date = "1994-03-01"
-    total = duckdb.sql(
+    total = connection().sql(
         f"""SELECT
                 100.00 * SUM(CASE
                     WHEN P_TYPE LIKE 'PROMO%'
@@ -649,8 +721,8 @@ def q15(root):
     supplier = load_supplier(root)
 
     date = "1996-01-01"
-    _ = duckdb.execute(
-        f"""CREATE TEMP VIEW REVENUE (SUPPLIER_NO, TOTAL_REVENUE) AS
+    _ = connection().execute(
+        f"""CREATE OR REPLACE TEMP VIEW REVENUE (SUPPLIER_NO, TOTAL_REVENUE) AS
                 SELECT
                     L_SUPPKEY,
                     CAST(SUM(L_EXTENDEDPRICE * (1 - L_DISCOUNT)) AS DECIMAL(12,2))
@@ -662,7 +734,7 @@ def q15(root):
                 GROUP BY
                     L_SUPPKEY"""
     )
-    total = duckdb.sql(
+    total = connection().sql(
         """SELECT
                 S_SUPPKEY,
                 S_NAME,
@@ -683,7 +755,7 @@ def q15(root):
             ORDER BY
                 S_SUPPKEY"""
     )
-    # _ = duckdb.execute(
+    # _ = connection().execute(
     #     "DROP VIEW REVENUE"
     # )
     return total
@@ -704,7 +776,7 @@ def q16(root):
     size6 = 3
     size7 = 36
     size8 = 9
-    total = duckdb.sql(
+    total = connection().sql(
         f"""SELECT
                 P_BRAND,
                 P_TYPE,
@@ -745,7 +817,7 @@ def q17(root):
 
     brand = "Brand#23"
     container = "MED BOX"
-    total = duckdb.sql(
+    total = connection().sql(
         f"""SELECT
                 SUM(L_EXTENDEDPRICE) / 7.0 AS AVG_YEARLY
             FROM
@@ -773,7 +845,7 @@ def q18(root):
     customer = load_customer(root)
 
     quantity = 300
-    total = duckdb.sql(
+    total = connection().sql(
         f"""SELECT
                 C_NAME,
                 C_CUSTKEY,
@@ -819,7 +891,7 @@ def q19(root):
     brand2 = "Brand#24"
     brand3 = "Brand#35"
     quantity = 4
-    total = duckdb.sql(
+    total = connection().sql(
         f"""SELECT
                 SUM(L_EXTENDEDPRICE* (1 - L_DISCOUNT)) AS REVENUE
             FROM
@@ -869,7 +941,7 @@ def q20(root):
 
     name = "azure"
     date = "1996-01-01"
-    total = duckdb.sql(
+    total = connection().sql(
         f"""SELECT
                 S_NAME,
                 S_ADDRESS
@@ -919,7 +991,7 @@ def q21(root):
     supplier = load_supplier(root)
 
     nation_name = "SAUDI ARABIA"
-    total = duckdb.sql(
+    total = connection().sql(
         f"""SELECT
                 S_NAME,
                 COUNT(*) AS NUMWAIT
@@ -975,7 +1047,7 @@ def q22(root):
     I5 = 30
     I6 = 18
     I7 = 17
-    total = duckdb.sql(
+    total = connection().sql(
         f"""SELECT
                 CNTRYCODE,
                 COUNT(*) AS NUMCUST,
@@ -1017,6 +1089,17 @@ def q22(root):
     return total
 
 
+table_loaders = {
+    "lineitem": load_lineitem,
+    "part": load_part,
+    "orders": load_orders,
+    "customer": load_customer,
+    "nation": load_nation,
+    "region": load_region,
+    "supplier": load_supplier,
+    "partsupp": load_partsupp,
+}
+
 query_to_loaders = {
     1: [load_lineitem],
     2: [load_part, load_partsupp, load_supplier, load_nation, load_region],
@@ -1090,44 +1173,128 @@ query_to_runner = {
 }
 
 
-def run_queries(path, queries, log_time=True, print_result=False, include_io=True):
-    print(f"print_result: {print_result}")
-    version = duckdb.__version__
-    data_start_time = time.time()
-    for query in queries:
-        loaders = query_to_loaders[query]
-        for loader in loaders:
-            loader(path)
-    print(f"Total data loading time (s): {time.time() - data_start_time}")
-
-    total_start = time.time()
-    for query in queries:
-        try:
-            start_time = time.time()
-            result = query_to_runner[query](path)
-            result = result.df()
-            without_io_time = time.time() - start_time
-            success = True
-            if print_result:
-                print_result_fn("duckdb", result, query)
-        except Exception as e:
-            print("".join(traceback.TracebackException.from_exception(e).format()))
-            without_io_time = 0.0
-            success = False
-        finally:
-            pass
-        if log_time:
-            log_time_fn(
-                "duckdb",
-                query,
-                version=version,
-                without_io_time=without_io_time,
-                success=success,
+def materialize(result: DuckDBPyRelation, result_format: str = "pandas"):
+    """Fetch `result` as Python tuples for "fetchall", and as an Arrow table,
+    which `convert_result` turns into the "pandas" or "polars" frame, for the
+    other formats."""
+    if result_format == "fetchall":
+        return result.fetchall()
+    return result.fetch_arrow_table()
+
+
+def convert_result(result: pa.Table, result_format: str = "pandas"):
+    if result_format == "pandas":
+        return result.to_pandas()
+    if result_format == "polars":
+        import polars as pl
+
+        return pl.from_arrow(result)
+    return result
+
+
+def tables_to_arrow() -> Dict[str, pa.Table]:
+    return {
+        name: connection().sql(f"select * from {table_name}").fetch_arrow_table()
+        for name, table_name in dataset_dict.items()
+    }
+
+
+def tables_from_arrow(tables: Dict[str, pa.Table]):
+    for name, table in tables.items():
+        table_name = name.upper()
+        connection().register("arrow_table", table)
+        connection().sql(
+            f"create or replace table {table_name} as select * from arrow_table;"
+        )
+        connection().unregister("arrow_table")
+        dataset_dict[name] = table_name
+
+
+def refresh_insert(tables: Dict[str, pa.Table]):
+    for name, table in tables.items():
+        if name in dataset_dict:
+            connection().register("refresh_table", table)
+            connection().sql(
+                f"insert into {dataset_dict[name]} by name select * from refresh_table;"
+            )
+            connection().unregister("refresh_table")
+
+
+def refresh_delete(order_keys: np.ndarray):
+    connection().register("refresh_keys", pa.table({"ORDERKEY": order_keys}))
+    for name, column in (("orders", "O_ORDERKEY"), ("lineitem", "L_ORDERKEY")):
+        if name in dataset_dict:
+            connection().sql(
+                f"delete from {dataset_dict[name]} "
+                f"where {column} in (select ORDERKEY from refresh_keys);"
             )
-    print(f"Total query execution time (s): {time.time() - total_start}")
+    connection().unregister("refresh_keys")
+
+
+def unload_tables():
+    # tables of a persistent database stay in its file for the next load.
+    if load_options["mode"] != "persistent":
+        kind = "view" if load_options["mode"] == "view" else "table"
+        for table_name in dataset_dict.values():
+            connection().sql(f"drop {kind} if exists {table_name};")
+    dataset_dict.clear()
+
+
+def run_queries(
+    path,
+    queries,
+    log_time=True,
+    print_result=False,
+    include_io=False,
+    shared_dir=None,
+    load_mode="table",
+    database_file=None,
+    result_format="pandas",
+    threads=None,
+    memory_limit=None,
+    **run_options,
+):
+    if shared_dir is not None:
+        shared_tables.update(map_shared_tables(shared_dir))
+    if load_mode == "persistent":
+        if database_file is None:
+            raise ValueError("the persistent load mode needs a database file")
+        open_database(database_file)
+    setup = partial(configure, load_mode, threads, memory_limit)
+    settings = setup()
+    # fetchall already builds the Python rows while fetching.
+    converts = result_format in ("pandas", "polars")
+    # views can not be updated, and refreshing a persistent database would
+    # change the dataset of every later run.
+    refreshable = load_mode == "table"
+    engine = Engine(
+        name="duckdb",
+        version=duckdb.__version__,
+        query_to_loaders=query_to_loaders,
+        table_loaders=table_loaders,
+        query_to_runner=query_to_runner,
+        args=(path,),
+        materialize=partial(materialize, result_format=result_format),
+        convert_result=(
+            partial(convert_result, result_format=result_format) if converts else None
+        ),
+        tables_to_arrow=tables_to_arrow,
+        tables_from_arrow=tables_from_arrow,
+        refresh_insert=refresh_insert if refreshable else None,
+        refresh_delete=refresh_delete if refreshable else None,
+        unload=unload_tables,
+        setup=setup,
+        config={
+            "shared_tables": shared_dir is not None,
+            "load_mode": load_mode,
+            "result_format": result_format,
+            **settings,
+        },
+    )
+    run_engine(engine, queries, log_time, print_result, include_io, **run_options)
 
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(description="TPC-H benchmark.")
     # aws settings
     parser.add_argument("--account", type=str, help="AWS access id")
@@ -1135,8 +1302,48 @@ def main():
     parser.add_argument(
         "--endpoint", type=str, help="AWS region endpoint related to your S3"
     )
+    parser.add_argument(
+        "--shared_dir",
+        type=str,
+        required=False,
+        help="map the tables from the Arrow IPC files the driver wrote here.",
+    )
+    parser.add_argument(
+        "--load_mode",
+        type=str,
+        default="table",
+        choices=["table", "view", "persistent"],
+        help="copy tables into memory, query the Parquet files through views, "
+        "or keep the tables in --database_file.",
+    )
+    parser.add_argument(
+        "--database_file",
+        type=str,
+        required=False,
+        help="duckdb database file of the persistent load mode.",
+    )
+    parser.add_argument(
+        "--result_format",
+        type=str,
+        default="pandas",
+        choices=["pandas", "polars", "arrow", "fetchall"],
+        help="format of the query results; pandas and polars are converted "
+        "from Arrow and timed as convert_result_time.",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        required=False,
+        help="number of threads duckdb runs queries with, defaults to all cores.",
+    )
+    parser.add_argument(
+        "--memory_limit",
+        type=str,
+        required=False,
+        help="duckdb memory limit, e.g. 8GB, defaults to 80%% of the memory.",
+    )
     parser = parse_common_arguments(parser)
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     path: str = args.path
     print(f"Path: {args.path}")
 
@@ -1145,6 +1352,9 @@ def main():
         queries = args.queries
     print(f"Queries to run: {queries}")
     print(f"Include IO: {args.include_io}")
+    print(f"Shared tables: {args.shared_dir}")
+    print(f"Load mode: {args.load_mode}")
+    print(f"Result format: {args.result_format}")
 
     if "s3://" in path:
         import boto3
@@ -1153,7 +1363,20 @@ def main():
             "s3", aws_access_key_id=args.account, aws_secret_access_key=args.key
         )
 
-    run_queries(path, queries, args.log_time, args.print_result, args.include_io)
+    run_queries(
+        path,
+        queries,
+        args.log_time,
+        args.print_result,
+        args.include_io,
+        args.shared_dir,
+        args.load_mode,
+        args.database_file,
+        args.result_format,
+        args.threads,
+        args.memory_limit,
+        **get_run_options(args),
+    )
 
 
 if __name__ == "__main__":
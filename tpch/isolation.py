@@ -0,0 +1,76 @@
+import os
+import shutil
+import subprocess
+import tempfile
+from typing import Dict
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+# tables handed to query workers live here, so workers map them from memory.
+SHM_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+def write_shared_tables(tables: Dict[str, pa.Table]) -> str:
+    """Write tables as Arrow IPC files into a fresh shared memory directory.
+
+    Returns the directory, which the caller removes with `remove_shared_tables`.
+    """
+    directory = tempfile.mkdtemp(prefix="tpch-", dir=SHM_DIR)
+    for name, table in tables.items():
+        path = os.path.join(directory, f"{name}.arrow")
+        with pa.OSFile(path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+    return directory
+
+
+def map_shared_tables(directory: str) -> Dict[str, pa.Table]:
+    """Map the files written by `write_shared_tables` without copying them."""
+    tables = {}
+    for file_name in sorted(os.listdir(directory)):
+        name, _ = os.path.splitext(file_name)
+        source = pa.memory_map(os.path.join(directory, file_name), "r")
+        tables[name] = pa.ipc.open_file(source).read_all()
+    return tables
+
+
+def write_dataset_tables(root: str) -> str:
+    """Decode every table of the Parquet dataset at `root` into shared memory.
+
+    Each table directory becomes one Arrow IPC file, written batch by batch,
+    so engine processes started later map the decoded columns with
+    `map_shared_tables` instead of each decoding the Parquet files again.
+    Returns the directory, which the caller removes with `remove_shared_tables`.
+    """
+    directory = tempfile.mkdtemp(prefix="tpch-", dir=SHM_DIR)
+    for name in sorted(os.listdir(root)):
+        if not os.path.isdir(os.path.join(root, name)):
+            continue
+        dataset = ds.dataset(os.path.join(root, name), format="parquet")
+        path = os.path.join(directory, f"{name}.arrow")
+        with pa.OSFile(path, "wb") as sink:
+            with pa.ipc.new_file(sink, dataset.schema) as writer:
+                for batch in dataset.to_batches():
+                    writer.write_batch(batch)
+    return directory
+
+
+def remove_shared_tables(directory: str):
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+def drop_page_cache(command: str):
+    """Run a user supplied command that drops the OS page cache.
+
+    Dropping caches usually needs root, e.g.
+    `sync && echo 3 | sudo tee /proc/sys/vm/drop_caches`, so a failing
+    command only prints a warning and the run continues with warm caches.
+    """
+    completed = subprocess.run(command, shell=True)
+    if completed.returncode != 0:
+        print(
+            f"Failed to drop page cache: `{command}` "
+            f"exited with code {completed.returncode}"
+        )
+
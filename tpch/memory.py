@@ -0,0 +1,158 @@
+import os
+import threading
+import time
+import tracemalloc
+from typing import Callable, Dict, Optional
+
+import pyarrow as pa
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# `engine_usage` callables that failed, reported once and not called again.
+failed_engine_usage = set()
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * PAGE_SIZE
+
+
+def arrow_total_allocated() -> Optional[int]:
+    """Bytes ever allocated by the default Arrow memory pool, including
+    freed ones, or None on pyarrow versions that do not count them."""
+    pool = pa.default_memory_pool()
+    if not hasattr(pool, "total_bytes_allocated"):
+        return None
+    return pool.total_bytes_allocated()
+
+
+class MemoryMonitor:
+    """Track the memory used while a block of code runs.
+
+    A background thread samples the process RSS and the bytes held by the
+    Arrow memory pool every `interval` seconds to find their high-water
+    marks. The Arrow pool also counts all bytes allocated in the block,
+    including temporaries freed before it ends, while `*_net_delta` fields
+    only hold what is still allocated at its end. With `trace_python`,
+    tracemalloc also records the peak above the start and the net delta of
+    the Python allocator (which includes NumPy buffers), at a noticeable
+    cost in speed. Engines whose data lives
+    outside this process pass `engine_usage`, returning byte counters such as
+    the storage of their workers; it is sampled every `engine_interval`
+    seconds for the high-water mark and the net increase of every counter.
+    An `engine_usage` that fails is reported once and yields no counters
+    from then on, leaving the queries and the other metrics unaffected.
+
+    Usage::
+
+        with MemoryMonitor() as monitor:
+            run()
+        record.update(monitor.metrics())
+    """
+
+    def __init__(
+        self,
+        interval: float = 0.01,
+        trace_python: bool = False,
+        engine_usage: Optional[Callable[[], Dict[str, int]]] = None,
+        engine_interval: float = 0.5,
+    ):
+        self.interval = interval
+        self.trace_python = trace_python
+        self.engine_usage = engine_usage
+        self.engine_interval = engine_interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.rss_before = current_rss()
+        self.arrow_before = pa.total_allocated_bytes()
+        self.arrow_total_before = arrow_total_allocated()
+        self.peak_rss = self.rss_before
+        self.peak_arrow = self.arrow_before
+        if self.engine_usage is not None:
+            self.engine_before = self._engine_usage()
+            self.peak_engine = dict(self.engine_before)
+            self.engine_sampled = time.perf_counter()
+        if self.trace_python:
+            tracemalloc.start()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        # one last sample, so short blocks still see their final state.
+        self._record()
+        self.rss_after = current_rss()
+        self.arrow_after = pa.total_allocated_bytes()
+        self.arrow_total_after = arrow_total_allocated()
+        if self.engine_usage is not None:
+            self.engine_after = self._engine_usage()
+            self._record_engine(self.engine_after)
+        if self.trace_python:
+            self.traced_after, self.traced_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        return False
+
+    def _record(self):
+        self.peak_rss = max(self.peak_rss, current_rss())
+        self.peak_arrow = max(self.peak_arrow, pa.total_allocated_bytes())
+        if (
+            self.engine_usage is not None
+            and time.perf_counter() - self.engine_sampled >= self.engine_interval
+        ):
+            self._record_engine(self._engine_usage())
+            self.engine_sampled = time.perf_counter()
+
+    def _engine_usage(self) -> Dict[str, int]:
+        if self.engine_usage in failed_engine_usage:
+            return {}
+        try:
+            return self.engine_usage()
+        except Exception as e:
+            failed_engine_usage.add(self.engine_usage)
+            print(f"Failed to read the engine's memory usage: {e!r}")
+            return {}
+
+    def _record_engine(self, usage: Dict[str, int]):
+        for key, value in usage.items():
+            self.peak_engine[key] = max(self.peak_engine.get(key, value), value)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self._record()
+
+    def metrics(self) -> Dict:
+        metrics = {
+            "rss_before": self.rss_before,
+            "rss_after": self.rss_after,
+            "peak_rss": self.peak_rss,
+            "peak_rss_increase": self.peak_rss - self.rss_before,
+            "peak_arrow_bytes": self.peak_arrow,
+            "peak_arrow_increase": self.peak_arrow - self.arrow_before,
+            "arrow_net_delta": self.arrow_after - self.arrow_before,
+        }
+        if self.arrow_total_before is not None:
+            metrics["arrow_bytes_allocated"] = (
+                self.arrow_total_after - self.arrow_total_before
+            )
+        if self.trace_python:
+            # tracing starts with the block, so its peak is above the start.
+            metrics["traced_peak_bytes"] = self.traced_peak
+            metrics["traced_net_delta"] = self.traced_after
+        if self.engine_usage is not None:
+            for key, value in self.engine_after.items():
+                metrics[f"peak_{key}"] = self.peak_engine.get(key, value)
+                metrics[f"{key}_increase"] = value - self.engine_before.get(key, 0)
+        return metrics
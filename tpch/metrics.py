@@ -0,0 +1,147 @@
+import json
+import os
+import platform
+import socket
+import sys
+import time
+import uuid
+from typing import Dict, List, Optional
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# columns whose type can not be inferred from a single batch, e.g. empty lists.
+COLUMN_TYPES = {
+    "query": pa.int64(),
+    "samples": pa.list_(pa.float64()),
+    "warmup_times": pa.list_(pa.float64()),
+    "outliers": pa.list_(pa.int64()),
+    "stream_times": pa.list_(pa.float64()),
+    "io_tables": pa.list_(pa.string()),
+    "read_times": pa.list_(pa.float64()),
+    "convert_times": pa.list_(pa.float64()),
+}
+
+
+def new_run_id() -> str:
+    return time.strftime("%Y%m%dT%H%M%S") + "-" + uuid.uuid4().hex[:8]
+
+
+def _cpu_model() -> Optional[str]:
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or None
+
+
+def _total_memory() -> Optional[int]:
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def host_metadata() -> Dict:
+    return {
+        "hostname": socket.gethostname(),
+        "platform": platform.platform(),
+        "python_version": sys.version.split()[0],
+        "cpu_model": _cpu_model(),
+        "cpu_count": os.cpu_count(),
+        "total_memory": _total_memory(),
+    }
+
+
+class MetricsWriter:
+    """Append time metrics to a Parquet dataset.
+
+    Records are buffered and written in batches under
+    `root/engine=<name>/engine_version=<version>/scale_factor=<sf>/run_id=<id>/`.
+    Every batch goes to its own uniquely named file, written to a temporary
+    name and renamed into place, so concurrent writers never touch the same
+    file and readers never see a partial one. Each record also carries the
+    host metadata, dataset path and run configuration.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        engine: str,
+        engine_version: str,
+        scale_factor: str,
+        run_id: str,
+        dataset_path: Optional[str] = None,
+        config: Optional[Dict] = None,
+        batch_size: int = 32,
+    ):
+        self.directory = os.path.join(
+            root,
+            f"engine={engine}",
+            f"engine_version={engine_version}",
+            f"scale_factor={scale_factor}",
+            f"run_id={run_id}",
+        )
+        self.batch_size = batch_size
+        self.metadata = {
+            "dataset_path": dataset_path,
+            "config": json.dumps(config or {}, sort_keys=True, default=str),
+            **host_metadata(),
+        }
+        self._records: List[Dict] = []
+
+    def write(self, record: Dict):
+        self._records.append({**record, **self.metadata, "logged_at": time.time()})
+        if len(self._records) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._records:
+            return
+        # records of one batch may carry different fields, e.g. power and
+        # throughput test records; `from_pylist` only looks at the first one.
+        names = list(dict.fromkeys(name for record in self._records for name in record))
+        rows = [{name: record.get(name) for name in names} for record in self._records]
+        table = normalize(pa.Table.from_pylist(rows))
+        os.makedirs(self.directory, exist_ok=True)
+        file_name = f"part-{uuid.uuid4().hex}.parquet"
+        tmp_path = os.path.join(self.directory, f".{file_name}.tmp")
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, os.path.join(self.directory, file_name))
+        self._records = []
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+def normalize(table: pa.Table) -> pa.Table:
+    for name, type_ in COLUMN_TYPES.items():
+        index = table.schema.get_field_index(name)
+        if index >= 0 and table.schema.field(index).type != type_:
+            table = table.set_column(index, name, table.column(index).cast(type_))
+    return table
+
+
+def open_metrics(root: str) -> ds.Dataset:
+    """Open every run written under `root` as one dataset.
+
+    Columns only present in some runs, e.g. `cold_time`, read as null
+    elsewhere.
+    """
+    files = ds.dataset(root, format="parquet", partitioning="hive")
+    schemas = [fragment.physical_schema for fragment in files.get_fragments()]
+    if not schemas:
+        return files
+    schema = pa.unify_schemas([files.schema] + schemas)
+    return ds.dataset(root, schema=schema, format="parquet", partitioning="hive")
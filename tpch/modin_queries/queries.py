@@ -1,25 +1,70 @@
 import argparse
 import json
 import os
-import time
-import traceback
-from typing import Dict
+from typing import Dict, Optional
 
 import modin
+import modin.config as modin_cfg
+import numpy as np
 import modin.pandas as pd
-import ray
-from common_utils import log_time_fn, parse_common_arguments, print_result_fn
+import pyarrow as pa
+from categories import DOMAINS, encode_categories
+from common_utils import convert_timer, get_run_options, parse_common_arguments
+from driver import Engine, run_engine
+from modin.utils import to_pandas
+from table_cache import TableCache
 
 dataset_dict = {}
+# pd.read_parquet arguments for every table, set by run_queries.
+read_options = {}
+# tables whose low-cardinality columns are loaded as categoricals, set by
+# run_queries.
+categorical_tables = set()
+# converted tables cached on disk, opened by run_queries with --cache_dir.
+cache = TableCache()
+
+
+def cache_key(table: str, data_path: str) -> Optional[str]:
+    return cache.key(
+        data_path,
+        engine="modin",
+        read_options=read_options,
+        categorical=table in categorical_tables,
+    )
+
+
+def read_cached(key: Optional[str]):
+    table = cache.read(key)
+    if table is None:
+        return None
+    types_mapper = None
+    if read_options.get("dtype_backend") == "pyarrow":
+        types_mapper = pd.ArrowDtype
+    return pd.DataFrame(table.to_pandas(types_mapper=types_mapper))
+
+
+def write_cached(key: Optional[str], df: pd.DataFrame):
+    if key is not None:
+        table = pa.Table.from_pandas(to_pandas(df), preserve_index=False)
+        cache.write(key, [table])
 
 
 def load_lineitem(root: str, storage_options: Dict):
     if "lineitem" not in dataset_dict:
         data_path = root + "/lineitem"
-        df = pd.read_parquet(data_path, storage_options=storage_options)
-        df.L_SHIPDATE = pd.to_datetime(df.L_SHIPDATE, format="%Y-%m-%d")
-        df.L_RECEIPTDATE = pd.to_datetime(df.L_RECEIPTDATE, format="%Y-%m-%d")
-        df.L_COMMITDATE = pd.to_datetime(df.L_COMMITDATE, format="%Y-%m-%d")
+        key = cache_key("lineitem", data_path)
+        df = read_cached(key)
+        if df is None:
+            df = pd.read_parquet(
+                data_path, storage_options=storage_options, **read_options
+            )
+            with convert_timer("lineitem"):
+                df.L_SHIPDATE = pd.to_datetime(df.L_SHIPDATE, format="%Y-%m-%d")
+                df.L_RECEIPTDATE = pd.to_datetime(df.L_RECEIPTDATE, format="%Y-%m-%d")
+                df.L_COMMITDATE = pd.to_datetime(df.L_COMMITDATE, format="%Y-%m-%d")
+                if "lineitem" in categorical_tables:
+                    encode_categories(df, "lineitem")
+            write_cached(key, df)
         result = df
         dataset_dict["lineitem"] = result
     else:
@@ -30,7 +75,10 @@ def load_lineitem(root: str, storage_options: Dict):
 def load_part(root: str, storage_options: Dict):
     if "part" not in dataset_dict:
         data_path = root + "/part"
-        df = pd.read_parquet(data_path, storage_options=storage_options)
+        df = pd.read_parquet(data_path, storage_options=storage_options, **read_options)
+        if "part" in categorical_tables:
+            with convert_timer("part"):
+                encode_categories(df, "part")
         result = df
         dataset_dict["part"] = result
     else:
@@ -41,8 +89,15 @@ def load_part(root: str, storage_options: Dict):
 def load_orders(root: str, storage_options: Dict):
     if "orders" not in dataset_dict:
         data_path = root + "/orders"
-        df = pd.read_parquet(data_path, storage_options=storage_options)
-        df.O_ORDERDATE = pd.to_datetime(df.O_ORDERDATE, format="%Y-%m-%d")
+        key = cache_key("orders", data_path)
+        df = read_cached(key)
+        if df is None:
+            df = pd.read_parquet(
+                data_path, storage_options=storage_options, **read_options
+            )
+            with convert_timer("orders"):
+                df.O_ORDERDATE = pd.to_datetime(df.O_ORDERDATE, format="%Y-%m-%d")
+            write_cached(key, df)
         result = df
         dataset_dict["orders"] = result
     else:
@@ -53,7 +108,7 @@ def load_orders(root: str, storage_options: Dict):
 def load_customer(root: str, storage_options: Dict):
     if "customer" not in dataset_dict:
         data_path = root + "/customer"
-        df = pd.read_parquet(data_path, storage_options=storage_options)
+        df = pd.read_parquet(data_path, storage_options=storage_options, **read_options)
         result = df
         dataset_dict["customer"] = result
     else:
@@ -64,7 +119,10 @@ def load_customer(root: str, storage_options: Dict):
 def load_nation(root: str, storage_options: Dict):
     if "nation" not in dataset_dict:
         data_path = root + "/nation"
-        df = pd.read_parquet(data_path, storage_options=storage_options)
+        df = pd.read_parquet(data_path, storage_options=storage_options, **read_options)
+        if "nation" in categorical_tables:
+            with convert_timer("nation"):
+                encode_categories(df, "nation")
         result = df
         dataset_dict["nation"] = result
     else:
@@ -75,7 +133,10 @@ def load_nation(root: str, storage_options: Dict):
 def load_region(root: str, storage_options: Dict):
     if "region" not in dataset_dict:
         data_path = root + "/region"
-        df = pd.read_parquet(data_path, storage_options=storage_options)
+        df = pd.read_parquet(data_path, storage_options=storage_options, **read_options)
+        if "region" in categorical_tables:
+            with convert_timer("region"):
+                encode_categories(df, "region")
         result = df
         dataset_dict["region"] = result
     else:
@@ -86,7 +147,7 @@ def load_region(root: str, storage_options: Dict):
 def load_supplier(root: str, storage_options: Dict):
     if "supplier" not in dataset_dict:
         data_path = root + "/supplier"
-        df = pd.read_parquet(data_path, storage_options=storage_options)
+        df = pd.read_parquet(data_path, storage_options=storage_options, **read_options)
         result = df
         dataset_dict["supplier"] = result
     else:
@@ -97,7 +158,7 @@ def load_supplier(root: str, storage_options: Dict):
 def load_partsupp(root: str, storage_options: Dict):
     if "partsupp" not in dataset_dict:
         data_path = root + "/partsupp"
-        df = pd.read_parquet(data_path, storage_options=storage_options)
+        df = pd.read_parquet(data_path, storage_options=storage_options, **read_options)
         result = df
         dataset_dict["partsupp"] = result
     else:
@@ -134,7 +195,9 @@ def q01(root: str, storage_options: Dict):
         * (1 - lineitem_filtered.L_DISCOUNT)
         * (1 + lineitem_filtered.L_TAX)
     )
-    gb = lineitem_filtered.groupby(["L_RETURNFLAG", "L_LINESTATUS"], as_index=False)
+    gb = lineitem_filtered.groupby(
+        ["L_RETURNFLAG", "L_LINESTATUS"], as_index=False, observed=True
+    )
     total = gb.agg(
         {
             "L_QUANTITY": "sum",
@@ -360,7 +423,7 @@ def q05(root: str, storage_options: Dict):
         jn4, left_on=["S_SUPPKEY", "S_NATIONKEY"], right_on=["L_SUPPKEY", "N_NATIONKEY"]
     )
     jn5["REVENUE"] = jn5.L_EXTENDEDPRICE * (1.0 - jn5.L_DISCOUNT)
-    gb = jn5.groupby("N_NAME", as_index=False)["REVENUE"].sum()
+    gb = jn5.groupby("N_NAME", as_index=False, observed=True)["REVENUE"].sum()
     total = gb.sort_values("REVENUE", ascending=False)
 
     return total
@@ -474,7 +537,9 @@ def q07(root: str, storage_options: Dict):
     total = pd.concat([total1, total2])
 
     total = (
-        total.groupby(["SUPP_NATION", "CUST_NATION", "L_YEAR"], as_index=False)
+        total.groupby(
+            ["SUPP_NATION", "CUST_NATION", "L_YEAR"], as_index=False, observed=True
+        )
         .agg(REVENUE=pd.NamedAgg(column="VOLUME", aggfunc="sum"))
         .sort_values(
             by=["SUPP_NATION", "CUST_NATION", "L_YEAR"], ascending=[True, True, True]
@@ -580,7 +645,7 @@ def q09(root: str, storage_options: Dict):
         (1 * jn5.PS_SUPPLYCOST) * jn5.L_QUANTITY
     )
     jn5["O_YEAR"] = jn5.O_ORDERDATE.dt.year
-    gb = jn5.groupby(["N_NAME", "O_YEAR"], as_index=False)["TMP"].sum()
+    gb = jn5.groupby(["N_NAME", "O_YEAR"], as_index=False, observed=True)["TMP"].sum()
     total = gb.sort_values(["N_NAME", "O_YEAR"], ascending=[True, False])
     total = total.rename(columns={"TMP": "SUM_PROFIT"})
 
@@ -614,6 +679,7 @@ def q10(root: str, storage_options: Dict):
             "C_COMMENT",
         ],
         as_index=False,
+        observed=True,
     )["REVENUE"].sum()
     total = gb.sort_values("REVENUE", ascending=False)
     total = total.head(20)
@@ -692,7 +758,9 @@ def q12(root: str, storage_options: Dict):
     def g2(x):
         return ((x != "1-URGENT") & (x != "2-HIGH")).sum()
 
-    total = jn.groupby("L_SHIPMODE", as_index=False)["O_ORDERPRIORITY"].agg((g1, g2))
+    total = jn.groupby("L_SHIPMODE", as_index=False, observed=True)[
+        "O_ORDERPRIORITY"
+    ].agg((g1, g2))
     total = total.sort_values("L_SHIPMODE").rename(
         columns={"g1": "HIGH_LINE_COUNT", "g2": "LOW_LINE_COUNT"}
     )
@@ -823,9 +891,9 @@ def q16(root: str, storage_options: Dict):
     )
     total = total[total["S_SUPPKEY"].isna()]
     total = total.loc[:, ["P_BRAND", "P_TYPE", "P_SIZE", "PS_SUPPKEY"]]
-    total = total.groupby(["P_BRAND", "P_TYPE", "P_SIZE"], as_index=False)[
-        "PS_SUPPKEY"
-    ].nunique()
+    total = total.groupby(
+        ["P_BRAND", "P_TYPE", "P_SIZE"], as_index=False, observed=True
+    )["PS_SUPPKEY"].nunique()
     total.columns = ["P_BRAND", "P_TYPE", "P_SIZE", "SUPPLIER_CNT"]
     total = total.sort_values(
         by=["SUPPLIER_CNT", "P_BRAND", "P_TYPE", "P_SIZE"],
@@ -1137,6 +1205,17 @@ def q22(root: str, storage_options: Dict):
     return total
 
 
+table_loaders = {
+    "lineitem": load_lineitem,
+    "part": load_part,
+    "orders": load_orders,
+    "customer": load_customer,
+    "nation": load_nation,
+    "region": load_region,
+    "supplier": load_supplier,
+    "partsupp": load_partsupp,
+}
+
 query_to_loaders = {
     1: [load_lineitem],
     2: [load_part, load_partsupp, load_supplier, load_nation, load_region],
@@ -1210,6 +1289,90 @@ query_to_runner = {
 }
 
 
+def refresh_insert(tables: Dict[str, pa.Table]):
+    for name, table in tables.items():
+        if name in dataset_dict:
+            df = dataset_dict[name]
+            new = pd.DataFrame(table.to_pandas()).astype(df.dtypes.to_dict())
+            dataset_dict[name] = pd.concat([df, new], ignore_index=True)
+
+
+def refresh_delete(order_keys: np.ndarray):
+    for name, column in (("orders", "O_ORDERKEY"), ("lineitem", "L_ORDERKEY")):
+        if name in dataset_dict:
+            df = dataset_dict[name]
+            df = df[~df[column].isin(order_keys)]
+            dataset_dict[name] = df.reset_index(drop=True)
+
+
+def unload_tables():
+    dataset_dict.clear()
+
+
+def configure_modin(
+    modin_engine: str,
+    cpu_count: Optional[int] = None,
+    npartitions: Optional[int] = None,
+    min_row_partition_size: Optional[int] = None,
+    min_column_partition_size: Optional[int] = None,
+) -> Dict:
+    """Select the Modin engine and the partition shape, before any frame is
+    created, and return the settings in effect."""
+    # Engine.put first resolves the current engine, which fails when none of
+    # the distributed engines is installed; the variable makes it resolve to
+    # the selected one.
+    os.environ["MODIN_ENGINE"] = modin_engine
+    modin_cfg.Engine.put(modin_engine.capitalize())
+    if cpu_count is not None:
+        modin_cfg.CpuCount.put(cpu_count)
+    if npartitions is not None:
+        modin_cfg.NPartitions.put(npartitions)
+    if min_row_partition_size is not None:
+        modin_cfg.MinRowPartitionSize.put(min_row_partition_size)
+    if min_column_partition_size is not None:
+        modin_cfg.MinColumnPartitionSize.put(min_column_partition_size)
+    return {
+        "modin_engine": modin_engine,
+        "cpu_count": modin_cfg.CpuCount.get(),
+        "npartitions": modin_cfg.NPartitions.get(),
+        "min_row_partition_size": modin_cfg.MinRowPartitionSize.get(),
+        "min_column_partition_size": modin_cfg.MinColumnPartitionSize.get(),
+    }
+
+
+def start_engine(
+    modin_engine: str, endpoint: Optional[str] = None, cpu_count: Optional[int] = None
+):
+    """Start or connect to the workers of the Modin engine. `endpoint` is the
+    address of an existing cluster, or `local` to start the engine in this
+    process with `cpu_count` workers; the python engine runs in the benchmark
+    process itself."""
+    if modin_engine == "ray":
+        import ray
+
+        if endpoint == "local":
+            ray.init(num_cpus=cpu_count)
+        else:
+            ray.init(address=endpoint or "auto")
+    elif modin_engine == "dask":
+        from distributed import Client, LocalCluster
+
+        if endpoint == "local" or endpoint is None:
+            Client(LocalCluster(n_workers=cpu_count))
+        else:
+            Client(endpoint)
+    elif modin_engine == "unidist" and endpoint not in (None, "local"):
+        # unidist is launched by Modin itself, e.g. under mpiexec.
+        print(f"Ignoring endpoint {endpoint} for the unidist engine")
+
+
+def stop_engine(modin_engine: str):
+    if modin_engine == "ray":
+        import ray
+
+        ray.shutdown()
+
+
 def run_queries(
     path,
     storage_options,
@@ -1217,42 +1380,41 @@ def run_queries(
     log_time=True,
     print_result=False,
     include_io=False,
+    dtype_backend="numpy",
+    categorical=False,
+    cache_dir=None,
+    cache_size=50.0,
+    engine_config=None,
+    **run_options,
 ):
-    version = modin.__version__
-    data_start_time = time.time()
-    for query in queries:
-        loaders = query_to_loaders[query]
-        for loader in loaders:
-            loader(path, storage_options)
-    print(f"Total data loading time (s): {time.time() - data_start_time}")
-
-    total_start = time.time()
-    for query in queries:
-        try:
-            start_time = time.time()
-            result = query_to_runner[query](path, storage_options)
-            without_io_time = time.time() - start_time
-            success = True
-            if print_result:
-                print_result_fn("modin_ray", result, query)
-        except Exception as e:
-            print("".join(traceback.TracebackException.from_exception(e).format()))
-            without_io_time = 0.0
-            success = False
-        finally:
-            pass
-        if log_time:
-            log_time_fn(
-                "modin_ray",
-                query,
-                version=version,
-                without_io_time=without_io_time,
-                success=success,
-            )
-    print(f"Total query execution time (s): {time.time() - total_start}")
-
-
-def main():
+    if dtype_backend == "pyarrow":
+        read_options["dtype_backend"] = "pyarrow"
+    if categorical:
+        categorical_tables.update(DOMAINS)
+    if cache_dir is not None:
+        cache.open(cache_dir, int(cache_size * 1024**3))
+    engine_config = engine_config or {"modin_engine": modin_cfg.Engine.get().lower()}
+    engine = Engine(
+        name=f"modin_{engine_config['modin_engine']}",
+        version=modin.__version__,
+        query_to_loaders=query_to_loaders,
+        table_loaders=table_loaders,
+        query_to_runner=query_to_runner,
+        args=(path, storage_options),
+        refresh_insert=refresh_insert,
+        refresh_delete=refresh_delete,
+        unload=unload_tables,
+        config={
+            "dtype_backend": dtype_backend,
+            "categorical": categorical,
+            "cache_dir": cache_dir,
+            **engine_config,
+        },
+    )
+    run_engine(engine, queries, log_time, print_result, include_io, **run_options)
+
+
+def main(argv=None):
     parser = argparse.ArgumentParser(description="TPC-H benchmark.")
     parser.add_argument(
         "--storage_options",
@@ -1264,10 +1426,74 @@ def main():
         "--endpoint",
         type=str,
         required=False,
-        help="the endpoint of existing Ray cluster.",
+        help="the endpoint of existing Ray or Dask cluster, "
+        "or `local` to start the engine in this process.",
+    )
+    parser.add_argument(
+        "--modin_engine",
+        type=str,
+        default="ray",
+        choices=["ray", "dask", "unidist", "python"],
+        help="the Modin execution engine, `python` runs serially in this process.",
+    )
+    parser.add_argument(
+        "--unidist_backend",
+        type=str,
+        required=False,
+        choices=["mpi", "pymp", "pyseq"],
+        help="the backend of the unidist engine, `pymp` and `pyseq` need no MPI.",
+    )
+    parser.add_argument(
+        "--cpu_count",
+        type=int,
+        required=False,
+        help="CPUs used by Modin and the workers of a local engine.",
+    )
+    parser.add_argument(
+        "--npartitions",
+        type=int,
+        required=False,
+        help="number of row and column partitions, defaults to the CPU count.",
+    )
+    parser.add_argument(
+        "--min_row_partition_size",
+        type=int,
+        required=False,
+        help="minimum number of rows in a row partition.",
+    )
+    parser.add_argument(
+        "--min_column_partition_size",
+        type=int,
+        required=False,
+        help="minimum number of columns in a column partition.",
+    )
+    parser.add_argument(
+        "--dtype_backend",
+        type=str,
+        default="numpy",
+        choices=["numpy", "pyarrow"],
+        help="back the loaded frames by NumPy arrays or by Arrow arrays.",
+    )
+    parser.add_argument(
+        "--categorical",
+        default=False,
+        action="store_true",
+        help="load low-cardinality string columns as categoricals.",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        required=False,
+        help="cache the converted lineitem and orders tables in this directory.",
+    )
+    parser.add_argument(
+        "--cache_size",
+        type=float,
+        default=50.0,
+        help="size limit of the table cache in GiB.",
     )
     parser = parse_common_arguments(parser)
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # path to TPC-H data in parquet.
     print(f"Path: {args.path}")
@@ -1284,8 +1510,23 @@ def main():
         queries = args.queries
     print(f"Queries to run: {queries}")
     print(f"Include IO: {args.include_io}")
-
-    ray.init(address="auto")
+    print(f"Dtype backend: {args.dtype_backend}")
+    print(f"Categorical: {args.categorical}")
+    print(f"Cache directory: {args.cache_dir}")
+
+    if args.unidist_backend is not None:
+        os.environ["UNIDIST_BACKEND"] = args.unidist_backend
+    engine_config = configure_modin(
+        args.modin_engine,
+        args.cpu_count,
+        args.npartitions,
+        args.min_row_partition_size,
+        args.min_column_partition_size,
+    )
+    if args.modin_engine == "unidist":
+        engine_config["unidist_backend"] = os.environ.get("UNIDIST_BACKEND", "mpi")
+    print(f"Modin configuration: {engine_config}")
+    start_engine(args.modin_engine, args.endpoint, args.cpu_count)
     run_queries(
         args.path,
         storage_options,
@@ -1293,7 +1534,14 @@ def main():
         args.log_time,
         args.print_result,
         args.include_io,
-    )
+        args.dtype_backend,
+        args.categorical,
+        args.cache_dir,
+        args.cache_size,
+        engine_config,
+        **get_run_options(args),
+    )
+    stop_engine(args.modin_engine)
 
 
 if __name__ == "__main__":
@@ -1,23 +1,116 @@
 import argparse
 import json
 import os
-import time
-import traceback
-from typing import Dict
+from datetime import date
+from functools import partial
+from typing import Dict, List, Optional
 
+import fsspec
+import numpy as np
 import pandas as pd
-from common_utils import log_time_fn, parse_common_arguments, print_result_fn
+import pyarrow as pa
+import pyarrow.parquet as pq
+from categories import DOMAINS, encode_categories
+from common_utils import convert_timer, get_run_options, parse_common_arguments
+from driver import Engine, run_engine
+from isolation import map_shared_tables
+from table_cache import TableCache
 
 dataset_dict = {}
+# `pd.read_parquet` arguments for every table, set by `configure`.
+read_options = {}
+# `pd.read_parquet` arguments per table, set by `prune_tables`.
+load_options = {}
+# tables whose low-cardinality columns are loaded as categoricals, set by
+# `configure`.
+categorical_tables = set()
+# converted tables cached on disk, opened by `run_queries` with `--cache_dir`.
+cache = TableCache()
+# Arrow tables the driver decoded once for all engines, mapped by `run_queries`
+# with `--shared_dir`.
+shared_tables: Dict[str, pa.Table] = {}
+
+
+def typed_filters(filters: List, schema: pa.Schema) -> List:
+    """Write the date literals of `filters` as ISO strings where the column
+    stores its dates as strings, so they compare with the column's type."""
+
+    def literal(column: str, value):
+        if isinstance(value, list):
+            return [literal(column, v) for v in value]
+        column_type = schema.field(column).type
+        if isinstance(value, date) and (
+            pa.types.is_string(column_type) or pa.types.is_large_string(column_type)
+        ):
+            return value.isoformat()
+        return value
+
+    return [
+        [(column, op, literal(column, value)) for column, op, value in conjunction]
+        for conjunction in filters
+    ]
+
+
+def read_table(table: str, data_path: str, storage_options: Dict) -> pd.DataFrame:
+    options = load_options.get(table, {})
+    if table not in shared_tables:
+        if options.get("filters") is not None:
+            fs, path = fsspec.core.url_to_fs(data_path, **(storage_options or {}))
+            schema = pq.ParquetDataset(path, filesystem=fs).schema
+            options = {**options, "filters": typed_filters(options["filters"], schema)}
+        return pd.read_parquet(
+            data_path, storage_options=storage_options, **read_options, **options
+        )
+    shared = shared_tables[table]
+    if options.get("filters") is not None:
+        filters = typed_filters(options["filters"], shared.schema)
+        shared = shared.filter(pq.filters_to_expression(filters))
+    if "columns" in options:
+        shared = shared.select(options["columns"])
+    return to_pandas(shared)
+
+
+def cache_key(table: str, data_path: str) -> Optional[str]:
+    # shared tables are already decoded, there is nothing left to cache.
+    if table in shared_tables:
+        return None
+    return cache.key(
+        data_path,
+        engine="pandas",
+        read_options=read_options,
+        load_options=load_options.get(table, {}),
+        categorical=table in categorical_tables,
+    )
+
+
+def to_pandas(table: pa.Table) -> pd.DataFrame:
+    types_mapper = None
+    if read_options.get("dtype_backend") == "pyarrow":
+        types_mapper = pd.ArrowDtype
+    return table.to_pandas(types_mapper=types_mapper)
+
+
+def write_cached(key: Optional[str], df: pd.DataFrame):
+    if key is not None:
+        cache.write(key, [pa.Table.from_pandas(df, preserve_index=False)])
 
 
 def load_lineitem(root: str, storage_options: Dict):
     if "lineitem" not in dataset_dict:
         data_path = root + "/lineitem"
-        df = pd.read_parquet(data_path, storage_options=storage_options)
-        df.L_SHIPDATE = pd.to_datetime(df.L_SHIPDATE, format="%Y-%m-%d")
-        df.L_RECEIPTDATE = pd.to_datetime(df.L_RECEIPTDATE, format="%Y-%m-%d")
-        df.L_COMMITDATE = pd.to_datetime(df.L_COMMITDATE, format="%Y-%m-%d")
+        key = cache_key("lineitem", data_path)
+        cached = cache.read(key)
+        if cached is not None:
+            df = to_pandas(cached)
+        else:
+            df = read_table("lineitem", data_path, storage_options)
+            with convert_timer("lineitem"):
+                for column in ["L_SHIPDATE", "L_RECEIPTDATE", "L_COMMITDATE"]:
+                    if column in df:
+                        df[column] = pd.to_datetime(df[column], format="%Y-%m-%d")
+                if "lineitem" in categorical_tables:
+                    encode_categories(df, "lineitem")
+            write_cached(key, df)
         result = df
         dataset_dict["lineitem"] = result
     else:
@@ -28,7 +121,10 @@ def load_lineitem(root: str, storage_options: Dict):
 def load_part(root: str, storage_options: Dict):
     if "part" not in dataset_dict:
         data_path = root + "/part"
-        df = pd.read_parquet(data_path, storage_options=storage_options)
+        df = read_table("part", data_path, storage_options)
+        if "part" in categorical_tables:
+            with convert_timer("part"):
+                encode_categories(df, "part")
         result = df
         dataset_dict["part"] = result
     else:
@@ -39,8 +135,16 @@ def load_part(root: str, storage_options: Dict):
 def load_orders(root: str, storage_options: Dict):
     if "orders" not in dataset_dict:
         data_path = root + "/orders"
-        df = pd.read_parquet(data_path, storage_options=storage_options)
-        df.O_ORDERDATE = pd.to_datetime(df.O_ORDERDATE, format="%Y-%m-%d")
+        key = cache_key("orders", data_path)
+        cached = cache.read(key)
+        if cached is not None:
+            df = to_pandas(cached)
+        else:
+            df = read_table("orders", data_path, storage_options)
+            if "O_ORDERDATE" in df:
+                with convert_timer("orders"):
+                    df.O_ORDERDATE = pd.to_datetime(df.O_ORDERDATE, format="%Y-%m-%d")
+            write_cached(key, df)
         result = df
         dataset_dict["orders"] = result
     else:
@@ -51,7 +155,7 @@ def load_orders(root: str, storage_options: Dict):
 def load_customer(root: str, storage_options: Dict):
     if "customer" not in dataset_dict:
         data_path = root + "/customer"
-        df = pd.read_parquet(data_path, storage_options=storage_options)
+        df = read_table("customer", data_path, storage_options)
         result = df
         dataset_dict["customer"] = result
     else:
@@ -62,7 +166,10 @@ def load_customer(root: str, storage_options: Dict):
 def load_nation(root: str, storage_options: Dict):
     if "nation" not in dataset_dict:
         data_path = root + "/nation"
-        df = pd.read_parquet(data_path, storage_options=storage_options)
+        df = read_table("nation", data_path, storage_options)
+        if "nation" in categorical_tables:
+            with convert_timer("nation"):
+                encode_categories(df, "nation")
         result = df
         dataset_dict["nation"] = result
     else:
@@ -73,7 +180,10 @@ def load_nation(root: str, storage_options: Dict):
 def load_region(root: str, storage_options: Dict):
     if "region" not in dataset_dict:
         data_path = root + "/region"
-        df = pd.read_parquet(data_path, storage_options=storage_options)
+        df = read_table("region", data_path, storage_options)
+        if "region" in categorical_tables:
+            with convert_timer("region"):
+                encode_categories(df, "region")
         result = df
         dataset_dict["region"] = result
     else:
@@ -84,7 +194,7 @@ def load_region(root: str, storage_options: Dict):
 def load_supplier(root: str, storage_options: Dict):
     if "supplier" not in dataset_dict:
         data_path = root + "/supplier"
-        df = pd.read_parquet(data_path, storage_options=storage_options)
+        df = read_table("supplier", data_path, storage_options)
         result = df
         dataset_dict["supplier"] = result
     else:
@@ -95,7 +205,7 @@ def load_supplier(root: str, storage_options: Dict):
 def load_partsupp(root: str, storage_options: Dict):
     if "partsupp" not in dataset_dict:
         data_path = root + "/partsupp"
-        df = pd.read_parquet(data_path, storage_options=storage_options)
+        df = read_table("partsupp", data_path, storage_options)
         result = df
         dataset_dict["partsupp"] = result
     else:
@@ -132,7 +242,9 @@ def q01(root: str, storage_options: Dict):
         * (1 - lineitem_filtered.L_DISCOUNT)
         * (1 + lineitem_filtered.L_TAX)
     )
-    gb = lineitem_filtered.groupby(["L_RETURNFLAG", "L_LINESTATUS"], as_index=False)
+    gb = lineitem_filtered.groupby(
+        ["L_RETURNFLAG", "L_LINESTATUS"], as_index=False, observed=True
+    )
     total = gb.agg(
         {
             "L_QUANTITY": "sum",
@@ -358,7 +470,7 @@ def q05(root: str, storage_options: Dict):
         jn4, left_on=["S_SUPPKEY", "S_NATIONKEY"], right_on=["L_SUPPKEY", "N_NATIONKEY"]
     )
     jn5["REVENUE"] = jn5.L_EXTENDEDPRICE * (1.0 - jn5.L_DISCOUNT)
-    gb = jn5.groupby("N_NAME", as_index=False)["REVENUE"].sum()
+    gb = jn5.groupby("N_NAME", as_index=False, observed=True)["REVENUE"].sum()
     total = gb.sort_values("REVENUE", ascending=False)
 
     return total
@@ -472,7 +584,9 @@ def q07(root: str, storage_options: Dict):
     total = pd.concat([total1, total2])
 
     total = (
-        total.groupby(["SUPP_NATION", "CUST_NATION", "L_YEAR"], as_index=False)
+        total.groupby(
+            ["SUPP_NATION", "CUST_NATION", "L_YEAR"], as_index=False, observed=True
+        )
         .agg(REVENUE=pd.NamedAgg(column="VOLUME", aggfunc="sum"))
         .sort_values(
             by=["SUPP_NATION", "CUST_NATION", "L_YEAR"], ascending=[True, True, True]
@@ -578,7 +692,7 @@ def q09(root: str, storage_options: Dict):
         (1 * jn5.PS_SUPPLYCOST) * jn5.L_QUANTITY
     )
     jn5["O_YEAR"] = jn5.O_ORDERDATE.dt.year
-    gb = jn5.groupby(["N_NAME", "O_YEAR"], as_index=False)["TMP"].sum()
+    gb = jn5.groupby(["N_NAME", "O_YEAR"], as_index=False, observed=True)["TMP"].sum()
     total = gb.sort_values(["N_NAME", "O_YEAR"], ascending=[True, False])
     total = total.rename(columns={"TMP": "SUM_PROFIT"})
 
@@ -612,6 +726,7 @@ def q10(root: str, storage_options: Dict):
             "C_COMMENT",
         ],
         as_index=False,
+        observed=True,
     )["REVENUE"].sum()
     total = gb.sort_values("REVENUE", ascending=False)
     total = total.head(20)
@@ -690,7 +805,9 @@ def q12(root: str, storage_options: Dict):
     def g2(x):
         return ((x != "1-URGENT") & (x != "2-HIGH")).sum()
 
-    total = jn.groupby("L_SHIPMODE", as_index=False)["O_ORDERPRIORITY"].agg((g1, g2))
+    total = jn.groupby("L_SHIPMODE", as_index=False, observed=True)[
+        "O_ORDERPRIORITY"
+    ].agg((g1, g2))
     total = total.sort_values("L_SHIPMODE").rename(
         columns={"g1": "HIGH_LINE_COUNT", "g2": "LOW_LINE_COUNT"}
     )
@@ -816,7 +933,7 @@ def q16(root: str, storage_options: Dict):
     filtered_df = filtered_df[filtered_df["S_SUPPKEY"].isna()]
 
     # Group by and count unique suppliers
-    total = filtered_df.groupby(["P_BRAND", "P_TYPE", "P_SIZE"]).agg(SUPPLIER_CNT=("PS_SUPPKEY", "nunique")).reset_index()
+    total = filtered_df.groupby(["P_BRAND", "P_TYPE", "P_SIZE"], observed=True).agg(SUPPLIER_CNT=("PS_SUPPKEY", "nunique")).reset_index()
 
     # Sort the result
     total = total.sort_values(by=["SUPPLIER_CNT", "P_BRAND", "P_TYPE", "P_SIZE"], ascending=[False, True, True, True])
@@ -1135,6 +1252,17 @@ def q22(root: str, storage_options: Dict):
     return total
 
 
+table_loaders = {
+    "lineitem": load_lineitem,
+    "part": load_part,
+    "orders": load_orders,
+    "customer": load_customer,
+    "nation": load_nation,
+    "region": load_region,
+    "supplier": load_supplier,
+    "partsupp": load_partsupp,
+}
+
 query_to_loaders = {
     1: [load_lineitem],
     2: [load_part, load_partsupp, load_supplier, load_nation, load_region],
@@ -1182,6 +1310,265 @@ query_to_loaders = {
     22: [load_customer, load_orders],
 }
 
+# columns and row filters (conjunctions in `pd.read_parquet` form) each query
+# needs from its tables. `prune_tables` combines them for the queries to run.
+query_to_columns = {
+    1: {
+        "lineitem": [
+            "L_DISCOUNT",
+            "L_EXTENDEDPRICE",
+            "L_LINESTATUS",
+            "L_ORDERKEY",
+            "L_QUANTITY",
+            "L_RETURNFLAG",
+            "L_SHIPDATE",
+            "L_TAX",
+        ],
+    },
+    2: {
+        "part": ["P_MFGR", "P_PARTKEY", "P_SIZE", "P_TYPE"],
+        "partsupp": ["PS_PARTKEY", "PS_SUPPKEY", "PS_SUPPLYCOST"],
+        "supplier": [
+            "S_ACCTBAL",
+            "S_ADDRESS",
+            "S_COMMENT",
+            "S_NAME",
+            "S_NATIONKEY",
+            "S_PHONE",
+            "S_SUPPKEY",
+        ],
+        "nation": ["N_NAME", "N_NATIONKEY", "N_REGIONKEY"],
+        "region": ["R_NAME", "R_REGIONKEY"],
+    },
+    3: {
+        "lineitem": ["L_DISCOUNT", "L_EXTENDEDPRICE", "L_ORDERKEY", "L_SHIPDATE"],
+        "orders": ["O_CUSTKEY", "O_ORDERDATE", "O_ORDERKEY", "O_SHIPPRIORITY"],
+        "customer": ["C_CUSTKEY", "C_MKTSEGMENT"],
+    },
+    4: {
+        "lineitem": ["L_COMMITDATE", "L_ORDERKEY", "L_RECEIPTDATE"],
+        "orders": ["O_ORDERDATE", "O_ORDERKEY", "O_ORDERPRIORITY"],
+    },
+    5: {
+        "lineitem": ["L_DISCOUNT", "L_EXTENDEDPRICE", "L_ORDERKEY", "L_SUPPKEY"],
+        "orders": ["O_CUSTKEY", "O_ORDERDATE", "O_ORDERKEY"],
+        "customer": ["C_CUSTKEY", "C_NATIONKEY"],
+        "nation": ["N_NAME", "N_NATIONKEY", "N_REGIONKEY"],
+        "region": ["R_NAME", "R_REGIONKEY"],
+        "supplier": ["S_NATIONKEY", "S_SUPPKEY"],
+    },
+    6: {
+        "lineitem": ["L_DISCOUNT", "L_EXTENDEDPRICE", "L_QUANTITY", "L_SHIPDATE"],
+    },
+    7: {
+        "lineitem": [
+            "L_DISCOUNT",
+            "L_EXTENDEDPRICE",
+            "L_ORDERKEY",
+            "L_SHIPDATE",
+            "L_SUPPKEY",
+        ],
+        "supplier": ["S_NATIONKEY", "S_SUPPKEY"],
+        "orders": ["O_CUSTKEY", "O_ORDERKEY"],
+        "customer": ["C_CUSTKEY", "C_NATIONKEY"],
+        "nation": ["N_NAME", "N_NATIONKEY"],
+    },
+    8: {
+        "part": ["P_PARTKEY", "P_TYPE"],
+        "lineitem": [
+            "L_DISCOUNT",
+            "L_EXTENDEDPRICE",
+            "L_ORDERKEY",
+            "L_PARTKEY",
+            "L_SUPPKEY",
+        ],
+        "supplier": ["S_NATIONKEY", "S_SUPPKEY"],
+        "orders": ["O_CUSTKEY", "O_ORDERDATE", "O_ORDERKEY"],
+        "customer": ["C_CUSTKEY", "C_NATIONKEY"],
+        "nation": ["N_NAME", "N_NATIONKEY", "N_REGIONKEY"],
+        "region": ["R_NAME", "R_REGIONKEY"],
+    },
+    9: {
+        "lineitem": [
+            "L_DISCOUNT",
+            "L_EXTENDEDPRICE",
+            "L_ORDERKEY",
+            "L_PARTKEY",
+            "L_QUANTITY",
+            "L_SUPPKEY",
+        ],
+        "orders": ["O_ORDERDATE", "O_ORDERKEY"],
+        "part": ["P_NAME", "P_PARTKEY"],
+        "nation": ["N_NAME", "N_NATIONKEY"],
+        "partsupp": ["PS_PARTKEY", "PS_SUPPKEY", "PS_SUPPLYCOST"],
+        "supplier": ["S_NATIONKEY", "S_SUPPKEY"],
+    },
+    10: {
+        "lineitem": ["L_DISCOUNT", "L_EXTENDEDPRICE", "L_ORDERKEY", "L_RETURNFLAG"],
+        "orders": ["O_CUSTKEY", "O_ORDERDATE", "O_ORDERKEY"],
+        "nation": ["N_NAME", "N_NATIONKEY"],
+        "customer": [
+            "C_ACCTBAL",
+            "C_ADDRESS",
+            "C_COMMENT",
+            "C_CUSTKEY",
+            "C_NAME",
+            "C_NATIONKEY",
+            "C_PHONE",
+        ],
+    },
+    11: {
+        "partsupp": ["PS_AVAILQTY", "PS_PARTKEY", "PS_SUPPKEY", "PS_SUPPLYCOST"],
+        "supplier": ["S_NATIONKEY", "S_SUPPKEY"],
+        "nation": ["N_NAME", "N_NATIONKEY"],
+    },
+    12: {
+        "lineitem": [
+            "L_COMMITDATE",
+            "L_ORDERKEY",
+            "L_RECEIPTDATE",
+            "L_SHIPDATE",
+            "L_SHIPMODE",
+        ],
+        "orders": ["O_ORDERKEY", "O_ORDERPRIORITY"],
+    },
+    13: {
+        "customer": ["C_CUSTKEY"],
+        "orders": ["O_COMMENT", "O_CUSTKEY", "O_ORDERKEY"],
+    },
+    14: {
+        "lineitem": ["L_DISCOUNT", "L_EXTENDEDPRICE", "L_PARTKEY", "L_SHIPDATE"],
+        "part": ["P_PARTKEY", "P_TYPE"],
+    },
+    15: {
+        "lineitem": ["L_DISCOUNT", "L_EXTENDEDPRICE", "L_SHIPDATE", "L_SUPPKEY"],
+        "supplier": ["S_ADDRESS", "S_NAME", "S_PHONE", "S_SUPPKEY"],
+    },
+    16: {
+        "part": ["P_BRAND", "P_PARTKEY", "P_SIZE", "P_TYPE"],
+        "partsupp": ["PS_PARTKEY", "PS_SUPPKEY"],
+        "supplier": ["S_COMMENT", "S_SUPPKEY"],
+    },
+    17: {
+        "lineitem": ["L_EXTENDEDPRICE", "L_PARTKEY", "L_QUANTITY"],
+        "part": ["P_BRAND", "P_CONTAINER", "P_PARTKEY"],
+    },
+    18: {
+        "lineitem": ["L_ORDERKEY", "L_QUANTITY"],
+        "orders": ["O_CUSTKEY", "O_ORDERDATE", "O_ORDERKEY", "O_TOTALPRICE"],
+        "customer": ["C_CUSTKEY", "C_NAME"],
+    },
+    19: {
+        "lineitem": [
+            "L_DISCOUNT",
+            "L_EXTENDEDPRICE",
+            "L_PARTKEY",
+            "L_QUANTITY",
+            "L_SHIPINSTRUCT",
+            "L_SHIPMODE",
+        ],
+        "part": ["P_BRAND", "P_CONTAINER", "P_PARTKEY", "P_SIZE"],
+    },
+    20: {
+        "lineitem": ["L_PARTKEY", "L_QUANTITY", "L_SHIPDATE", "L_SUPPKEY"],
+        "part": ["P_NAME", "P_PARTKEY"],
+        "nation": ["N_NAME", "N_NATIONKEY"],
+        "partsupp": ["PS_AVAILQTY", "PS_PARTKEY", "PS_SUPPKEY"],
+        "supplier": ["S_ADDRESS", "S_NAME", "S_NATIONKEY", "S_SUPPKEY"],
+    },
+    21: {
+        "lineitem": ["L_COMMITDATE", "L_ORDERKEY", "L_RECEIPTDATE", "L_SUPPKEY"],
+        "orders": ["O_ORDERKEY", "O_ORDERSTATUS"],
+        "supplier": ["S_NAME", "S_NATIONKEY", "S_SUPPKEY"],
+        "nation": ["N_NAME", "N_NATIONKEY"],
+    },
+    22: {
+        "customer": ["C_ACCTBAL", "C_CUSTKEY", "C_PHONE"],
+        "orders": ["O_CUSTKEY"],
+    },
+}
+
+query_to_filters = {
+    1: {"lineitem": [("L_SHIPDATE", "<=", date(1998, 9, 2))]},
+    3: {
+        "lineitem": [("L_SHIPDATE", ">", date(1995, 3, 4))],
+        "orders": [("O_ORDERDATE", "<", date(1995, 3, 4))],
+        "customer": [("C_MKTSEGMENT", "==", "HOUSEHOLD")],
+    },
+    4: {
+        "orders": [
+            ("O_ORDERDATE", ">=", date(1993, 8, 1)),
+            ("O_ORDERDATE", "<", date(1993, 11, 1)),
+        ],
+    },
+    5: {
+        "orders": [
+            ("O_ORDERDATE", ">=", date(1996, 1, 1)),
+            ("O_ORDERDATE", "<", date(1997, 1, 1)),
+        ],
+    },
+    6: {
+        "lineitem": [
+            ("L_SHIPDATE", ">=", date(1996, 1, 1)),
+            ("L_SHIPDATE", "<", date(1997, 1, 1)),
+            ("L_DISCOUNT", ">=", 0.08),
+            ("L_DISCOUNT", "<=", 0.1),
+            ("L_QUANTITY", "<", 24),
+        ],
+    },
+    7: {
+        "lineitem": [
+            ("L_SHIPDATE", ">=", date(1995, 1, 1)),
+            ("L_SHIPDATE", "<", date(1997, 1, 1)),
+        ],
+    },
+    8: {
+        "orders": [
+            ("O_ORDERDATE", ">=", date(1995, 1, 1)),
+            ("O_ORDERDATE", "<", date(1997, 1, 1)),
+        ],
+    },
+    10: {
+        "lineitem": [("L_RETURNFLAG", "==", "R")],
+        "orders": [
+            ("O_ORDERDATE", ">=", date(1994, 11, 1)),
+            ("O_ORDERDATE", "<", date(1995, 2, 1)),
+        ],
+    },
+    12: {
+        "lineitem": [
+            ("L_RECEIPTDATE", ">=", date(1994, 1, 1)),
+            ("L_RECEIPTDATE", "<", date(1995, 1, 1)),
+            ("L_SHIPMODE", "in", ["MAIL", "SHIP"]),
+        ],
+    },
+    14: {
+        "lineitem": [
+            ("L_SHIPDATE", ">=", date(1994, 3, 1)),
+            ("L_SHIPDATE", "<", date(1994, 4, 1)),
+        ],
+    },
+    15: {
+        "lineitem": [
+            ("L_SHIPDATE", ">=", date(1996, 1, 1)),
+            ("L_SHIPDATE", "<", date(1996, 4, 1)),
+        ],
+    },
+    19: {
+        "lineitem": [
+            ("L_SHIPINSTRUCT", "==", "DELIVER IN PERSON"),
+            ("L_SHIPMODE", "in", ["AIR", "AIR REG"]),
+        ],
+    },
+    20: {
+        "lineitem": [
+            ("L_SHIPDATE", ">=", date(1996, 1, 1)),
+            ("L_SHIPDATE", "<", date(1997, 1, 1)),
+        ],
+    },
+    21: {"orders": [("O_ORDERSTATUS", "==", "F")]},
+}
+
 query_to_runner = {
     1: q01,
     2: q02,
@@ -1208,6 +1595,80 @@ query_to_runner = {
 }
 
 
+def prune_tables(queries: List[int]):
+    """Make the loaders read only what `queries` need.
+
+    Tables are read with the union of the columns of the queries. Rows are
+    filtered in the Parquet reader when every query using a table filters
+    it, keeping the rows that pass any of their filters.
+    """
+    load_options.clear()
+    for query in queries:
+        for table, columns in query_to_columns[query].items():
+            options = load_options.setdefault(table, {"columns": [], "filters": []})
+            options["columns"] += [c for c in columns if c not in options["columns"]]
+            conjunction = query_to_filters.get(query, {}).get(table)
+            if conjunction is None or options["filters"] is None:
+                options["filters"] = None
+            else:
+                options["filters"].append(conjunction)
+    # the refresh functions find rows by their order key.
+    for table, key in [("orders", "O_ORDERKEY"), ("lineitem", "L_ORDERKEY")]:
+        if table in load_options and key not in load_options[table]["columns"]:
+            load_options[table]["columns"].append(key)
+
+
+def tables_to_arrow() -> Dict[str, pa.Table]:
+    return {
+        name: pa.Table.from_pandas(df, preserve_index=False)
+        for name, df in dataset_dict.items()
+    }
+
+
+def tables_from_arrow(tables: Dict[str, pa.Table]):
+    for name, table in tables.items():
+        dataset_dict[name] = to_pandas(table)
+
+
+def refresh_insert(tables: Dict[str, pa.Table]):
+    for name, table in tables.items():
+        if name in dataset_dict:
+            df = dataset_dict[name]
+            new = table.select(list(df.columns)).to_pandas()
+            new = new.astype(df.dtypes.to_dict())
+            dataset_dict[name] = pd.concat([df, new], ignore_index=True)
+
+
+def refresh_delete(order_keys: np.ndarray):
+    for name, column in (("orders", "O_ORDERKEY"), ("lineitem", "L_ORDERKEY")):
+        if name in dataset_dict:
+            df = dataset_dict[name]
+            df = df[~df[column].isin(order_keys)]
+            dataset_dict[name] = df.reset_index(drop=True)
+
+
+def unload_tables():
+    dataset_dict.clear()
+
+
+def configure(
+    dtype_backend: str = "numpy",
+    categorical: bool = False,
+    prune_queries: Optional[List[int]] = None,
+):
+    """Set the loader options; the driver calls it again in the worker
+    processes it spawns, which do not inherit them."""
+    read_options.clear()
+    if dtype_backend == "pyarrow":
+        read_options["dtype_backend"] = "pyarrow"
+    categorical_tables.clear()
+    if categorical:
+        categorical_tables.update(DOMAINS)
+    load_options.clear()
+    if prune_queries is not None:
+        prune_tables(prune_queries)
+
+
 def run_queries(
     path,
     storage_options,
@@ -1215,42 +1676,45 @@ def run_queries(
     log_time=True,
     print_result=False,
     include_io=False,
+    prune=False,
+    dtype_backend="numpy",
+    categorical=False,
+    cache_dir=None,
+    cache_size=50.0,
+    shared_dir=None,
+    **run_options,
 ):
-    version = pd.__version__
-    data_start_time = time.time()
-    for query in queries:
-        loaders = query_to_loaders[query]
-        for loader in loaders:
-            loader(path, storage_options)
-    print(f"Total data loading time (s): {time.time() - data_start_time}")
-
-    total_start = time.time()
-    for query in queries:
-        try:
-            start_time = time.time()
-            result = query_to_runner[query](path, storage_options)
-            without_io_time = time.time() - start_time
-            success = True
-            if print_result:
-                print_result_fn("pandas", result, query)
-        except Exception as e:
-            print("".join(traceback.TracebackException.from_exception(e).format()))
-            without_io_time = 0.0
-            success = False
-        finally:
-            pass
-        if log_time:
-            log_time_fn(
-                "pandas",
-                query,
-                version=version,
-                without_io_time=without_io_time,
-                success=success,
-            )
-    print(f"Total query execution time (s): {time.time() - total_start}")
-
-
-def main():
+    setup = partial(configure, dtype_backend, categorical, queries if prune else None)
+    setup()
+    if cache_dir is not None:
+        cache.open(cache_dir, int(cache_size * 1024**3))
+    if shared_dir is not None:
+        shared_tables.update(map_shared_tables(shared_dir))
+    engine = Engine(
+        name="pandas",
+        version=pd.__version__,
+        query_to_loaders=query_to_loaders,
+        table_loaders=table_loaders,
+        query_to_runner=query_to_runner,
+        args=(path, storage_options),
+        tables_to_arrow=tables_to_arrow,
+        tables_from_arrow=tables_from_arrow,
+        refresh_insert=refresh_insert,
+        refresh_delete=refresh_delete,
+        unload=unload_tables,
+        setup=setup,
+        config={
+            "prune": prune,
+            "dtype_backend": dtype_backend,
+            "categorical": categorical,
+            "cache_dir": cache_dir,
+            "shared_tables": shared_dir is not None,
+        },
+    )
+    run_engine(engine, queries, log_time, print_result, include_io, **run_options)
+
+
+def main(argv=None):
     parser = argparse.ArgumentParser(description="TPC-H benchmark.")
     parser.add_argument(
         "--storage_options",
@@ -1258,8 +1722,45 @@ def main():
         required=False,
         help="storage options json file.",
     )
+    parser.add_argument(
+        "--prune",
+        default=False,
+        action="store_true",
+        help="only read the columns and rows the queries need.",
+    )
+    parser.add_argument(
+        "--dtype_backend",
+        type=str,
+        default="numpy",
+        choices=["numpy", "pyarrow"],
+        help="back the loaded frames by NumPy arrays or by Arrow arrays.",
+    )
+    parser.add_argument(
+        "--categorical",
+        default=False,
+        action="store_true",
+        help="load low-cardinality string columns as categoricals.",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        required=False,
+        help="cache the converted lineitem and orders tables in this directory.",
+    )
+    parser.add_argument(
+        "--cache_size",
+        type=float,
+        default=50.0,
+        help="size limit of the table cache in GiB.",
+    )
+    parser.add_argument(
+        "--shared_dir",
+        type=str,
+        required=False,
+        help="map the tables from the Arrow IPC files the driver wrote here.",
+    )
     parser = parse_common_arguments(parser)
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # path to TPC-H data in parquet.
     path = args.path
@@ -1277,6 +1778,11 @@ def main():
         queries = args.queries
     print(f"Queries to run: {queries}")
     print(f"Include IO: {args.include_io}")
+    print(f"Prune: {args.prune}")
+    print(f"Dtype backend: {args.dtype_backend}")
+    print(f"Categorical: {args.categorical}")
+    print(f"Cache directory: {args.cache_dir}")
+    print(f"Shared tables: {args.shared_dir}")
 
     run_queries(
         path,
@@ -1285,6 +1791,13 @@ def main():
         args.log_time,
         args.print_result,
         args.include_io,
+        args.prune,
+        args.dtype_backend,
+        args.categorical,
+        args.cache_dir,
+        args.cache_size,
+        args.shared_dir,
+        **get_run_options(args),
     )
 
 
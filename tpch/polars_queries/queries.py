@@ -1,22 +1,50 @@
 import argparse
 import json
 import os
-import time
-import traceback
 from datetime import datetime
+from functools import partial
 from typing import Dict
 
+import numpy as np
 import polars as pl
+import pyarrow as pa
 
-from common_utils import log_time_fn, parse_common_arguments, print_result_fn
+from common_utils import get_run_options, parse_common_arguments
+from driver import Engine, run_engine
+from isolation import map_shared_tables
 
 dataset_dict = {}
+# Arrow tables the driver decoded once for all engines, mapped by run_queries
+# with --shared_dir.
+shared_tables: Dict[str, pa.Table] = {}
+# loader settings, set by configure. With "scan", tables are scanned lazily
+# instead of read into memory, so queries only hold the data they touch.
+load_options = {"scan": False}
+# polars 1.23 added the `engine="streaming"` argument of `collect`, and 2.0
+# removed the `streaming` flag it replaces.
+STREAMING_ENGINE = tuple(int(v) for v in pl.__version__.split(".")[:2]) >= (1, 23)
+
+
+def read_table(table: str, data_path: str, storage_options: Dict) -> pl.LazyFrame:
+    if table in shared_tables:
+        return pl.from_arrow(shared_tables[table]).lazy()
+    if load_options["scan"]:
+        return pl.scan_parquet(data_path, storage_options=storage_options)
+    return pl.read_parquet(data_path, storage_options=storage_options).lazy()
+
+
+def collect(result: pl.LazyFrame, streaming: bool = False) -> pl.DataFrame:
+    if not streaming:
+        return result.collect()
+    if STREAMING_ENGINE:
+        return result.collect(engine="streaming")
+    return result.collect(streaming=True)
 
 
 def load_lineitem_lazy(root: str, storage_options: Dict):
     if "lineitem" not in dataset_dict:
         data_path = root + "/lineitem/*.parquet"
-        p = pl.read_parquet(data_path, storage_options=storage_options).lazy()
+        p = read_table("lineitem", data_path, storage_options)
         p = p.with_columns(pl.col("L_SHIPDATE").cast(pl.Date))
         p = p.with_columns(pl.col("L_RECEIPTDATE").cast(pl.Date))
         p = p.with_columns(pl.col("L_COMMITDATE").cast(pl.Date))
@@ -30,7 +58,7 @@ def load_lineitem_lazy(root: str, storage_options: Dict):
 def load_part_lazy(root: str, storage_options: Dict):
     if "part" not in dataset_dict:
         data_path = root + "/part/*.parquet"
-        result = pl.read_parquet(data_path, storage_options=storage_options).lazy()
+        result = read_table("part", data_path, storage_options)
         dataset_dict["part"] = result
     else:
         result = dataset_dict["part"]
@@ -40,7 +68,7 @@ def load_part_lazy(root: str, storage_options: Dict):
 def load_orders_lazy(root: str, storage_options: Dict):
     if "orders" not in dataset_dict:
         data_path = root + "/orders/*.parquet"
-        result = pl.read_parquet(data_path, storage_options=storage_options).lazy()
+        result = read_table("orders", data_path, storage_options)
         result = result.with_columns(pl.col("O_ORDERDATE").cast(pl.Date))
         dataset_dict["orders"] = result
     else:
@@ -51,7 +79,7 @@ def load_orders_lazy(root: str, storage_options: Dict):
 def load_customer_lazy(root: str, storage_options: Dict):
     if "customer" not in dataset_dict:
         data_path = root + "/customer/*.parquet"
-        result = pl.read_parquet(data_path, storage_options=storage_options).lazy()
+        result = read_table("customer", data_path, storage_options)
         dataset_dict["customer"] = result
     else:
         result = dataset_dict["customer"]
@@ -61,7 +89,7 @@ def load_customer_lazy(root: str, storage_options: Dict):
 def load_nation_lazy(root: str, storage_options: Dict):
     if "nation" not in dataset_dict:
         data_path = root + "/nation/*.parquet"
-        result = pl.read_parquet(data_path, storage_options=storage_options).lazy()
+        result = read_table("nation", data_path, storage_options)
         dataset_dict["nation"] = result
     else:
         result = dataset_dict["nation"]
@@ -71,7 +99,7 @@ def load_nation_lazy(root: str, storage_options: Dict):
 def load_region_lazy(root: str, storage_options: Dict):
     if "region" not in dataset_dict:
         data_path = root + "/region/*.parquet"
-        result = pl.read_parquet(data_path, storage_options=storage_options).lazy()
+        result = read_table("region", data_path, storage_options)
         dataset_dict["region"] = result
     else:
         result = dataset_dict["region"]
@@ -81,7 +109,7 @@ def load_region_lazy(root: str, storage_options: Dict):
 def load_supplier_lazy(root: str, storage_options: Dict):
     if "supplier" not in dataset_dict:
         data_path = root + "/supplier/*.parquet"
-        result = pl.read_parquet(data_path, storage_options=storage_options).lazy()
+        result = read_table("supplier", data_path, storage_options)
         dataset_dict["supplier"] = result
     else:
         result = dataset_dict["supplier"]
@@ -91,7 +119,7 @@ def load_supplier_lazy(root: str, storage_options: Dict):
 def load_partsupp_lazy(root: str, storage_options: Dict):
     if "partsupp" not in dataset_dict:
         data_path = root + "/partsupp/*.parquet"
-        result = pl.read_parquet(data_path, storage_options=storage_options).lazy()
+        result = read_table("partsupp", data_path, storage_options)
         dataset_dict["partsupp"] = result
     else:
         result = dataset_dict["partsupp"]
@@ -899,6 +927,17 @@ def q22(root: str, storage_options: Dict):
     return q_final
 
 
+table_loaders = {
+    "lineitem": load_lineitem_lazy,
+    "part": load_part_lazy,
+    "orders": load_orders_lazy,
+    "customer": load_customer_lazy,
+    "nation": load_nation_lazy,
+    "region": load_region_lazy,
+    "supplier": load_supplier_lazy,
+    "partsupp": load_partsupp_lazy,
+}
+
 query_to_loaders = {
     1: [load_lineitem_lazy],
     2: [
@@ -990,6 +1029,52 @@ query_to_runner = {
 }
 
 
+def optimize(result: pl.LazyFrame) -> pl.LazyFrame:
+    # run the query optimizer on its own; `collect` optimizes again, so this
+    # time is reported separately rather than added to the query latency.
+    result.explain(optimized=True)
+    return result
+
+
+def materialize(result: pl.LazyFrame, streaming: bool = False) -> pl.DataFrame:
+    return collect(result, streaming)
+
+
+def tables_to_arrow() -> Dict[str, pa.Table]:
+    return {name: lf.collect().to_arrow() for name, lf in dataset_dict.items()}
+
+
+def tables_from_arrow(tables: Dict[str, pa.Table]):
+    for name, table in tables.items():
+        dataset_dict[name] = pl.from_arrow(table).lazy()
+
+
+def refresh_insert(tables: Dict[str, pa.Table]):
+    for name, table in tables.items():
+        if name in dataset_dict:
+            df = dataset_dict[name].collect()
+            new = pl.from_arrow(table).select(df.columns).cast(df.schema)
+            dataset_dict[name] = pl.concat([df, new]).lazy()
+
+
+def refresh_delete(order_keys: np.ndarray):
+    keys = pl.Series(order_keys)
+    for name, column in (("orders", "O_ORDERKEY"), ("lineitem", "L_ORDERKEY")):
+        if name in dataset_dict:
+            lf = dataset_dict[name].filter(~pl.col(column).is_in(keys))
+            dataset_dict[name] = lf.collect().lazy()
+
+
+def unload_tables():
+    dataset_dict.clear()
+
+
+def configure(scan: bool = False):
+    """Set the loader options; the driver calls it again in the worker
+    processes it spawns, which do not inherit them."""
+    load_options["scan"] = scan
+
+
 def run_queries(
     path,
     storage_options,
@@ -997,42 +1082,40 @@ def run_queries(
     log_time=True,
     print_result=False,
     include_io=False,
+    streaming=False,
+    shared_dir=None,
+    scan=False,
+    **run_options,
 ):
-    version = pl.__version__
-    data_start_time = time.time()
-    for query in queries:
-        loaders = query_to_loaders[query]
-        for loader in loaders:
-            loader(path, storage_options)
-    print(f"Total data loading time (s): {time.time() - data_start_time}")
-
-    total_start = time.time()
-    for query in queries:
-        try:
-            start_time = time.time()
-            result = query_to_runner[query](path, storage_options)
-            without_io_time = time.time() - start_time
-            success = True
-            if print_result:
-                print_result_fn("polars", result.collect(), query)
-        except Exception as e:
-            print("".join(traceback.TracebackException.from_exception(e).format()))
-            without_io_time = 0.0
-            success = False
-        finally:
-            pass
-        if log_time:
-            log_time_fn(
-                "polars",
-                query,
-                version=version,
-                without_io_time=without_io_time,
-                success=success,
-            )
-    print(f"Total query execution time (s): {time.time() - total_start}")
+    setup = partial(configure, scan)
+    setup()
+    if shared_dir is not None:
+        shared_tables.update(map_shared_tables(shared_dir))
+    engine = Engine(
+        name="polars",
+        version=pl.__version__,
+        query_to_loaders=query_to_loaders,
+        table_loaders=table_loaders,
+        query_to_runner=query_to_runner,
+        args=(path, storage_options),
+        materialize=partial(materialize, streaming=streaming),
+        optimize=optimize,
+        tables_to_arrow=tables_to_arrow,
+        tables_from_arrow=tables_from_arrow,
+        refresh_insert=refresh_insert,
+        refresh_delete=refresh_delete,
+        unload=unload_tables,
+        setup=setup,
+        config={
+            "streaming": streaming,
+            "scan": scan,
+            "shared_tables": shared_dir is not None,
+        },
+    )
+    run_engine(engine, queries, log_time, print_result, include_io, **run_options)
 
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(description="TPC-H benchmark.")
     parser.add_argument(
         "--storage_options",
@@ -1040,8 +1123,26 @@ def main():
         required=False,
         help="storage options json file.",
     )
+    parser.add_argument(
+        "--streaming",
+        default=False,
+        action="store_true",
+        help="collect query results with the streaming engine.",
+    )
+    parser.add_argument(
+        "--scan",
+        default=False,
+        action="store_true",
+        help="scan the Parquet files lazily instead of loading the tables.",
+    )
+    parser.add_argument(
+        "--shared_dir",
+        type=str,
+        required=False,
+        help="map the tables from the Arrow IPC files the driver wrote here.",
+    )
     parser = parse_common_arguments(parser)
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # path to TPC-H data in parquet.
     path = args.path
@@ -1059,6 +1160,9 @@ def main():
         queries = args.queries
     print(f"Queries to run: {queries}")
     print(f"Include IO: {args.include_io}")
+    print(f"Streaming: {args.streaming}")
+    print(f"Scan: {args.scan}")
+    print(f"Shared tables: {args.shared_dir}")
 
     run_queries(
         path,
@@ -1067,6 +1171,10 @@ def main():
         args.log_time,
         args.print_result,
         args.include_io,
+        streaming=args.streaming,
+        shared_dir=args.shared_dir,
+        scan=args.scan,
+        **get_run_options(args),
     )
 
 
@@ -1,13 +1,17 @@
 import argparse
 import os
-import time
-import traceback
+from typing import Dict
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 import pyspark
 import pyspark.pandas as ps
-from common_utils import log_time_fn, parse_common_arguments, print_result_fn
+from common_utils import get_run_options, parse_common_arguments
+from driver import Engine, run_engine
+from pyspark.pandas.frame import CachedDataFrame
 from pyspark.sql import SparkSession
+from pyspark_queries.session import add_session_arguments, build_session
 
 dataset_dict = {}
 spark: SparkSession = None
@@ -1170,6 +1174,17 @@ def q22(root: str):
     return total
 
 
+table_loaders = {
+    "lineitem": load_lineitem,
+    "part": load_part,
+    "orders": load_orders,
+    "customer": load_customer,
+    "nation": load_nation,
+    "region": load_region,
+    "supplier": load_supplier,
+    "partsupp": load_partsupp,
+}
+
 query_to_loaders = {
     1: [load_lineitem],
     2: [load_part, load_partsupp, load_supplier, load_nation, load_region],
@@ -1243,52 +1258,68 @@ query_to_runner = {
 }
 
 
+def materialize(result):
+    return result.to_pandas()
+
+
+def _replace_table(name: str, df: ps.DataFrame):
+    # cache the new version before unpersisting the one it is computed from.
+    df = df.spark.cache()
+    len(df)
+    if isinstance(dataset_dict[name], CachedDataFrame):
+        dataset_dict[name].spark.unpersist()
+    dataset_dict[name] = df
+
+
+def refresh_insert(tables: Dict[str, pa.Table]):
+    for name, table in tables.items():
+        if name in dataset_dict:
+            df = dataset_dict[name]
+            new = ps.from_pandas(table.to_pandas().astype(df.dtypes.to_dict()))
+            _replace_table(name, ps.concat([df, new], ignore_index=True))
+
+
+def refresh_delete(order_keys: np.ndarray):
+    for name, column in (("orders", "O_ORDERKEY"), ("lineitem", "L_ORDERKEY")):
+        if name in dataset_dict:
+            df = dataset_dict[name]
+            _replace_table(name, df[~df[column].isin(order_keys.tolist())])
+
+
+def unload_tables():
+    # the frames wrap cached Spark frames that are not reachable from them.
+    spark.catalog.clearCache()
+    dataset_dict.clear()
+
+
 def run_queries(
     path,
     queries,
     log_time=True,
     print_result=False,
     include_io=False,
+    session_config=None,
+    **run_options,
 ):
-    version = pyspark.__version__
-    data_start_time = time.time()
-    for query in queries:
-        loaders = query_to_loaders[query]
-        for loader in loaders:
-            loader(path)
-    print(f"Total data loading time (s): {time.time() - data_start_time}")
-
-    total_start = time.time()
-    for query in queries:
-        try:
-            start_time = time.time()
-            result = query_to_runner[query](path)
-            result = result.to_pandas()
-            without_io_time = time.time() - start_time
-            success = True
-            if print_result:
-                print_result_fn("pyspark_pandas", result, query)
-        except Exception as e:
-            print("".join(traceback.TracebackException.from_exception(e).format()))
-            without_io_time = 0.0
-            success = False
-        finally:
-            pass
-        if log_time:
-            log_time_fn(
-                "pyspark_pandas",
-                query,
-                version=version,
-                without_io_time=without_io_time,
-                success=success,
-            )
-    print(f"Total query execution time (s): {time.time() - total_start}")
-
-
-def main():
+    engine = Engine(
+        name="pyspark_pandas",
+        version=pyspark.__version__,
+        query_to_loaders=query_to_loaders,
+        table_loaders=table_loaders,
+        query_to_runner=query_to_runner,
+        args=(path,),
+        materialize=materialize,
+        refresh_insert=refresh_insert,
+        refresh_delete=refresh_delete,
+        unload=unload_tables,
+        config=dict(session_config or {}),
+    )
+    run_engine(engine, queries, log_time, print_result, include_io, **run_options)
+
+
+def main(argv=None):
     global spark
     parser = argparse.ArgumentParser(description="TPC-H benchmark.")
-    parser.add_argument("--master", type=str, help="Spark master URI")
 
     # aws settings
     parser.add_argument("--account", type=str, help="AWS access id")
@@ -1296,21 +1327,9 @@ def main():
     parser.add_argument(
         "--endpoint", type=str, help="AWS region endpoint related to your S3"
     )
-
-    parser.add_argument(
-        "--executor_cores",
-        type=int,
-        default=32,
-        help="Number of cores for each Spark executor",
-    )
-    parser.add_argument(
-        "--executor_memory",
-        type=str,
-        default="64G",
-        help="Memory size for each Spark executor",
-    )
+    parser = add_session_arguments(parser)
     parser = parse_common_arguments(parser)
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     path: str = args.path
     print(f"Path: {args.path}")
 
@@ -1319,18 +1338,12 @@ def main():
         queries = args.queries
     print(f"Queries to run: {queries}")
     print(f"Include IO: {args.include_io}")
+    print(f"Profiles: {args.profile}")
 
     account = args.account
     key = args.key
 
-    spark = (
-        SparkSession.builder.appName("PySpark tpch query")
-        .master(args.master)
-        .config("spark.executor.cores", args.executor_cores)
-        .config("spark.executor.memory", args.executor_memory)
-        .config("spark.ui.showConsoleProgress", "false")
-        .getOrCreate()
-    )
+    spark, session_config = build_session(args)
 
     spark.sparkContext.setLogLevel("ERROR")
 
@@ -1345,7 +1358,15 @@ def main():
             "spark.jars.packages", "org.apache.spark:spark-hadoop-cloud_2.12:3.5.0"
         )
 
-    run_queries(path, queries, args.log_time, args.print_result, args.include_io)
+    run_queries(
+        path,
+        queries,
+        args.log_time,
+        args.print_result,
+        args.include_io,
+        session_config,
+        **get_run_options(args),
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,154 @@
+import os
+from argparse import ArgumentParser
+from typing import Dict, List, Optional, Tuple
+
+from py4j.protocol import Py4JError
+from pyspark import StorageLevel
+from pyspark.sql import DataFrame, SparkSession
+
+# named sets of Spark settings, selected with --profile. Several profiles are
+# applied in the given order, so e.g. `--profile no_aqe arrow` combines them;
+# `default` keeps Spark's own defaults (AQE is on since Spark 3.2).
+PROFILES: Dict[str, Dict[str, str]] = {
+    "default": {},
+    "no_aqe": {"spark.sql.adaptive.enabled": "false"},
+    "aqe": {
+        "spark.sql.adaptive.enabled": "true",
+        "spark.sql.adaptive.coalescePartitions.enabled": "true",
+        "spark.sql.adaptive.skewJoin.enabled": "false",
+    },
+    "aqe_skew": {
+        "spark.sql.adaptive.enabled": "true",
+        "spark.sql.adaptive.coalescePartitions.enabled": "true",
+        "spark.sql.adaptive.skewJoin.enabled": "true",
+        "spark.sql.adaptive.skewJoin.skewedPartitionFactor": "2",
+        "spark.sql.adaptive.skewJoin.skewedPartitionThresholdInBytes": "64MB",
+    },
+    "broadcast": {
+        "spark.sql.autoBroadcastJoinThreshold": "256MB",
+        "spark.sql.adaptive.autoBroadcastJoinThreshold": "256MB",
+    },
+    "no_broadcast": {
+        "spark.sql.autoBroadcastJoinThreshold": "-1",
+        "spark.sql.adaptive.autoBroadcastJoinThreshold": "-1",
+    },
+    # the default of 200 shuffle partitions is made for clusters; a local
+    # session gets a couple per core.
+    "local": {"spark.sql.shuffle.partitions": str(2 * (os.cpu_count() or 1))},
+    "arrow": {
+        "spark.sql.execution.arrow.pyspark.enabled": "true",
+        "spark.sql.execution.arrow.pyspark.fallback.enabled": "true",
+    },
+}
+
+# how tables are cached, selected with --storage_level. Spark caches frames
+# deserialized in memory and on disk by default; `none` keeps no cache, so
+# every query reads the Parquet files again.
+STORAGE_LEVELS: Dict[str, Optional[StorageLevel]] = {
+    "memory_only": StorageLevel(False, True, False, True),
+    "memory_and_disk": StorageLevel(True, True, False, True),
+    "memory_only_ser": StorageLevel(False, True, False, False),
+    "memory_and_disk_ser": StorageLevel(True, True, False, False),
+    "none": None,
+}
+
+# settings reported in the run configuration, whichever profile is active.
+TUNED_KEYS = sorted(
+    {key for settings in PROFILES.values() for key in settings}
+    | {"spark.sql.shuffle.partitions"}
+)
+
+
+def add_session_arguments(parser: ArgumentParser) -> ArgumentParser:
+    parser.add_argument("--master", type=str, help="Spark master URI")
+    parser.add_argument(
+        "--executor_cores",
+        type=int,
+        default=32,
+        help="Number of cores for each Spark executor",
+    )
+    parser.add_argument(
+        "--executor_memory",
+        type=str,
+        default="64G",
+        help="Memory size for each Spark executor",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        nargs="+",
+        default=["default"],
+        choices=sorted(PROFILES),
+        help="whitespace separated tuning profiles, applied in order.",
+    )
+    parser.add_argument(
+        "--spark_conf",
+        type=str,
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="Spark setting applied after the profiles, can be repeated.",
+    )
+    return parser
+
+
+def profile_settings(
+    profiles: List[str], overrides: Optional[List[str]] = None
+) -> Dict[str, str]:
+    settings = {}
+    for name in profiles:
+        settings.update(PROFILES[name])
+    for override in overrides or []:
+        key, _, value = override.partition("=")
+        settings[key] = value
+    return settings
+
+
+def build_session(args) -> Tuple[SparkSession, Dict]:
+    """Start the Spark session of an engine and describe its settings.
+
+    Returns the session and the run configuration recorded with every
+    metric: the profiles and the values in effect of the tuned settings.
+    """
+    settings = profile_settings(args.profile, args.spark_conf)
+    builder = (
+        SparkSession.builder.appName("PySpark tpch query")
+        .master(args.master)
+        .config("spark.executor.cores", args.executor_cores)
+        .config("spark.executor.memory", args.executor_memory)
+        .config("spark.ui.showConsoleProgress", "false")
+    )
+    for key, value in settings.items():
+        builder = builder.config(key, value)
+    spark = builder.getOrCreate()
+    # a session that already existed keeps its settings; runtime SQL settings
+    # can still be changed.
+    for key, value in settings.items():
+        if key.startswith("spark.sql."):
+            spark.conf.set(key, value)
+    keys = sorted(set(TUNED_KEYS) | set(settings))
+    config = {
+        "profiles": args.profile,
+        "spark_conf": {key: spark.conf.get(key, None) for key in keys},
+    }
+    return spark, config
+
+
+def cached_bytes(spark: SparkSession, df: DataFrame) -> Optional[Tuple[int, int]]:
+    """Memory and disk bytes of the cache of `df`, from Spark's storage status.
+
+    Returns None when `df` is not cached or not materialized yet.
+    """
+    try:
+        cache_manager = spark._jsparkSession.sharedState().cacheManager()
+        cached = cache_manager.lookupCachedData(df._jdf)
+        if cached.isEmpty():
+            return None
+        builder = cached.get().cachedRepresentation().cacheBuilder()
+        rdd_id = builder.cachedColumnBuffers().id()
+    except Py4JError:
+        return None
+    for info in spark.sparkContext._jsc.sc().getRDDStorageInfo():
+        if info.id() == rdd_id:
+            return info.memSize(), info.diskSize()
+    return None
@@ -1,21 +1,53 @@
 import argparse
 import os
-import time
-import traceback
+from typing import Dict
 
+import numpy as np
+import pandas as pd
+import pyarrow as pa
 import pyspark
-from common_utils import log_time_fn, parse_common_arguments, print_result_fn
+import pyspark.sql.functions as F
+from common_utils import get_run_options, parse_common_arguments
+from driver import Engine, run_engine
 from pyspark.sql import SparkSession
+from pyspark_queries.session import (
+    STORAGE_LEVELS,
+    add_session_arguments,
+    build_session,
+    cached_bytes,
+)
 
 dataset_dict = {}
 spark: SparkSession = None
+# storage level of the cached tables, set by run_queries. Loaders only mark
+# the tables for caching; cache_tables fills the caches after loading, so
+# that no query is charged for it.
+cache_options = {"storage_level": "memory_and_disk"}
+# tables whose cache has been filled.
+cached_tables = set()
+
+
+def persist(df):
+    level = STORAGE_LEVELS[cache_options["storage_level"]]
+    return df if level is None else df.persist(level)
+
+
+def cache_tables():
+    if cache_options["storage_level"] == "none":
+        return
+    for name, df in dataset_dict.items():
+        if name not in cached_tables:
+            df.count()
+            cached_tables.add(name)
+            sizes = cached_bytes(spark, df)
+            if sizes is not None:
+                print(f"Cached {name}: {sizes[0]} bytes in memory, {sizes[1]} on disk")
 
 
 def load_lineitem(root: str):
     if "lineitem" not in dataset_dict:
         data_path = root + "/lineitem"
-        df = spark.read.parquet(data_path).cache()
-        print(df.count)
+        df = persist(spark.read.parquet(data_path))
         df.createOrReplaceTempView("lineitem")
         dataset_dict["lineitem"] = df
     else:
@@ -26,8 +58,7 @@ def load_lineitem(root: str):
 def load_part(root: str):
     if "part" not in dataset_dict:
         data_path = root + "/part"
-        df = spark.read.parquet(data_path).cache()
-        print(df.count)
+        df = persist(spark.read.parquet(data_path))
         df.createOrReplaceTempView("part")
         dataset_dict["part"] = df
     else:
@@ -38,8 +69,7 @@ def load_part(root: str):
 def load_orders(root: str):
     if "orders" not in dataset_dict:
         data_path = root + "/orders"
-        df = spark.read.parquet(data_path).cache()
-        print(df.count)
+        df = persist(spark.read.parquet(data_path))
         df.createOrReplaceTempView("orders")
         dataset_dict["orders"] = df
     else:
@@ -50,8 +80,7 @@ def load_orders(root: str):
 def load_customer(root: str):
     if "customer" not in dataset_dict:
         data_path = root + "/customer"
-        df = spark.read.parquet(data_path).cache()
-        print(df.count)
+        df = persist(spark.read.parquet(data_path))
         df.createOrReplaceTempView("customer")
         dataset_dict["customer"] = df
     else:
@@ -62,8 +91,7 @@ def load_customer(root: str):
 def load_nation(root: str):
     if "nation" not in dataset_dict:
         data_path = root + "/nation"
-        df = spark.read.parquet(data_path).cache()
-        print(df.count)
+        df = persist(spark.read.parquet(data_path))
         df.createOrReplaceTempView("nation")
         dataset_dict["nation"] = df
     else:
@@ -74,8 +102,7 @@ def load_nation(root: str):
 def load_region(root: str):
     if "region" not in dataset_dict:
         data_path = root + "/region"
-        df = spark.read.parquet(data_path).cache()
-        print(df.count)
+        df = persist(spark.read.parquet(data_path))
         df.createOrReplaceTempView("region")
         dataset_dict["region"] = df
     else:
@@ -86,8 +113,7 @@ def load_region(root: str):
 def load_supplier(root: str):
     if "supplier" not in dataset_dict:
         data_path = root + "/supplier"
-        df = spark.read.parquet(data_path).cache()
-        print(df.count)
+        df = persist(spark.read.parquet(data_path))
         df.createOrReplaceTempView("supplier")
         dataset_dict["supplier"] = df
     else:
@@ -98,8 +124,7 @@ def load_supplier(root: str):
 def load_partsupp(root: str):
     if "partsupp" not in dataset_dict:
         data_path = root + "/partsupp"
-        df = spark.read.parquet(data_path).cache()
-        print(df.count)
+        df = persist(spark.read.parquet(data_path))
         df.createOrReplaceTempView("partsupp")
         dataset_dict["partsupp"] = df
     else:
@@ -1022,6 +1047,17 @@ def q22(root):
     return total
 
 
+table_loaders = {
+    "lineitem": load_lineitem,
+    "part": load_part,
+    "orders": load_orders,
+    "customer": load_customer,
+    "nation": load_nation,
+    "region": load_region,
+    "supplier": load_supplier,
+    "partsupp": load_partsupp,
+}
+
 query_to_loaders = {
     1: [load_lineitem],
     2: [load_part, load_partsupp, load_supplier, load_nation, load_region],
@@ -1095,52 +1131,76 @@ query_to_runner = {
 }
 
 
+def materialize(result):
+    return result.toPandas()
+
+
+def _replace_table(name: str, df):
+    # cache the new version before unpersisting the one it is computed from.
+    df = persist(df)
+    if cache_options["storage_level"] != "none":
+        df.count()
+    df.createOrReplaceTempView(name)
+    dataset_dict[name].unpersist()
+    dataset_dict[name] = df
+
+
+def refresh_insert(tables: Dict[str, pa.Table]):
+    for name, table in tables.items():
+        if name in dataset_dict:
+            df = dataset_dict[name]
+            new = spark.createDataFrame(table.to_pandas())
+            new = new.select([F.col(f.name).cast(f.dataType) for f in df.schema])
+            _replace_table(name, df.unionByName(new))
+
+
+def refresh_delete(order_keys: np.ndarray):
+    keys = spark.createDataFrame(pd.DataFrame({"ORDERKEY": order_keys}))
+    for name, column in (("orders", "O_ORDERKEY"), ("lineitem", "L_ORDERKEY")):
+        if name in dataset_dict:
+            df = dataset_dict[name]
+            kept = df.join(keys, df[column] == keys.ORDERKEY, "left_anti")
+            _replace_table(name, kept)
+
+
+def unload_tables():
+    for df in dataset_dict.values():
+        df.unpersist()
+    dataset_dict.clear()
+    cached_tables.clear()
+
+
 def run_queries(
     path,
     queries,
     log_time=True,
     print_result=False,
     include_io=False,
+    session_config=None,
+    storage_level="memory_and_disk",
+    **run_options,
 ):
-    version = pyspark.__version__
-    data_start_time = time.time()
-    for query in queries:
-        loaders = query_to_loaders[query]
-        for loader in loaders:
-            loader(path)
-    print(f"Total data loading time (s): {time.time() - data_start_time}")
-
-    total_start = time.time()
-    for query in queries:
-        try:
-            start_time = time.time()
-            result = query_to_runner[query](path)
-            result = result.toPandas()
-            without_io_time = time.time() - start_time
-            success = True
-            if print_result:
-                print_result_fn("pyspark_sql", result, query)
-        except Exception as e:
-            print("".join(traceback.TracebackException.from_exception(e).format()))
-            without_io_time = 0.0
-            success = False
-        finally:
-            pass
-        if log_time:
-            log_time_fn(
-                "pyspark_sql",
-                query,
-                version=version,
-                without_io_time=without_io_time,
-                success=success,
-            )
-    print(f"Total query execution time (s): {time.time() - total_start}")
-
-
-def main():
+    cache_options["storage_level"] = storage_level
+    engine = Engine(
+        name="pyspark_sql",
+        version=pyspark.__version__,
+        query_to_loaders=query_to_loaders,
+        table_loaders=table_loaders,
+        query_to_runner=query_to_runner,
+        args=(path,),
+        materialize=materialize,
+        after_load=cache_tables,
+        refresh_insert=refresh_insert,
+        refresh_delete=refresh_delete,
+        unload=unload_tables,
+        config={**(session_config or {}), "storage_level": storage_level},
+    )
+    run_engine(engine, queries, log_time, print_result, include_io, **run_options)
+
+
+def main(argv=None):
     global spark
     parser = argparse.ArgumentParser(description="TPC-H benchmark.")
-    parser.add_argument("--master", type=str, help="Spark master URI")
 
     # aws settings
     parser.add_argument("--account", type=str, help="AWS access id")
@@ -1148,21 +1208,16 @@ def main():
     parser.add_argument(
         "--endpoint", type=str, help="AWS region endpoint related to your S3"
     )
-
-    parser.add_argument(
-        "--executor_cores",
-        type=int,
-        default=32,
-        help="Number of cores for each Spark executor",
-    )
     parser.add_argument(
-        "--executor_memory",
+        "--storage_level",
         type=str,
-        default="64G",
-        help="Memory size for each Spark executor",
+        default="memory_and_disk",
+        choices=sorted(STORAGE_LEVELS),
+        help="how the tables are cached before the queries run, or none.",
     )
+    parser = add_session_arguments(parser)
     parser = parse_common_arguments(parser)
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     path: str = args.path
     print(f"Path: {args.path}")
 
@@ -1171,18 +1226,13 @@ def main():
         queries = args.queries
     print(f"Queries to run: {queries}")
     print(f"Include IO: {args.include_io}")
+    print(f"Profiles: {args.profile}")
+    print(f"Storage level: {args.storage_level}")
 
     account = args.account
     key = args.key
 
-    spark = (
-        SparkSession.builder.appName("PySpark tpch query")
-        .master(args.master)
-        .config("spark.executor.cores", args.executor_cores)
-        .config("spark.executor.memory", args.executor_memory)
-        .config("spark.ui.showConsoleProgress", "false")
-        .getOrCreate()
-    )
+    spark, session_config = build_session(args)
 
     spark.sparkContext.setLogLevel("ERROR")
 
@@ -1197,7 +1247,16 @@ def main():
             "spark.jars.packages", "org.apache.spark:spark-hadoop-cloud_2.12:3.5.0"
         )
 
-    run_queries(path, queries, args.log_time, args.print_result, args.include_io)
+    run_queries(
+        path,
+        queries,
+        args.log_time,
+        args.print_result,
+        args.include_io,
+        session_config,
+        args.storage_level,
+        **get_run_options(args),
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,67 @@
+import argparse
+import json
+import subprocess
+import sys
+
+import pyarrow.dataset as ds
+from metrics import new_run_id, open_metrics
+from pyspark_queries.session import PROFILES
+
+ENGINES = {
+    "pyspark_sql": "pyspark_queries.sql_queries",
+    "pyspark_pandas": "pyspark_queries.pandas_queries",
+}
+
+
+def summarize(metrics_dir: str, run_id: str, baseline: str):
+    """Median query time per query and profile, and its ratio to `baseline`."""
+    dataset = open_metrics(metrics_dir)
+    df = dataset.to_table(filter=ds.field("run_id") == run_id).to_pandas()
+    df = df[df["is_success"] & df["test"].eq("power")]
+    df["profile"] = df["config"].map(lambda c: " ".join(json.loads(c)["profiles"]))
+    times = df.pivot_table(
+        index="query", columns="profile", values="without_io_time", aggfunc="median"
+    )
+    if baseline in times:
+        ratios = times.div(times[baseline], axis=0).add_suffix(" / " + baseline)
+        times = times.join(ratios.drop(columns=baseline + " / " + baseline))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the TPC-H queries once per Spark tuning profile.",
+        epilog="Remaining arguments are forwarded to the engine.",
+    )
+    parser.add_argument(
+        "--engine", type=str, default="pyspark_sql", choices=sorted(ENGINES)
+    )
+    parser.add_argument(
+        "--profiles",
+        type=str,
+        nargs="+",
+        default=list(PROFILES),
+        help="profiles to compare; quote several names to combine them, "
+        'e.g. "no_aqe arrow".',
+    )
+    parser.add_argument("--master", type=str, default="local[*]")
+    parser.add_argument("--metrics_dir", type=str, default="metrics")
+    args, engine_argv = parser.parse_known_args()
+    run_id = new_run_id()
+    print(f"Run id: {run_id}")
+
+    for profile in args.profiles:
+        print(f"Profile: {profile}")
+        cmd = [sys.executable, "-u", "-m", ENGINES[args.engine]] + engine_argv
+        cmd += ["--master", args.master, "--profile"] + profile.split()
+        cmd += ["--log_time", "--metrics_dir", args.metrics_dir, "--run_id", run_id]
+        completed = subprocess.run(cmd)
+        if completed.returncode != 0:
+            print(f"{profile} exited with code {completed.returncode}")
+
+    times = summarize(args.metrics_dir, run_id, args.profiles[0])
+    print(times.round(3).to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import math
+import statistics
+from typing import Dict, List
+
+# samples whose coefficient of variation exceeds this are reported as noisy.
+CV_THRESHOLD = 0.1
+# outliers must also be at least this far from the median, relative to it, so
+# that sub-millisecond jitter on very stable queries is not flagged.
+OUTLIER_MIN_DEVIATION = 0.05
+
+
+def percentile(samples: List[float], q: float) -> float:
+    """Return the q-th percentile (0-100) using linear interpolation."""
+    ordered = sorted(samples)
+    if len(ordered) == 1:
+        return ordered[0]
+    rank = (len(ordered) - 1) * q / 100
+    low = math.floor(rank)
+    high = math.ceil(rank)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def find_outliers(samples: List[float]) -> List[int]:
+    """Return the indexes of samples outside Tukey's fences (1.5 IQR)."""
+    if len(samples) < 4:
+        return []
+    q1 = percentile(samples, 25)
+    q3 = percentile(samples, 75)
+    iqr = q3 - q1
+    low, high = q1 - 1.5 * iqr, q3 + 1.5 * iqr
+    median = statistics.median(samples)
+    return [
+        i
+        for i, sample in enumerate(samples)
+        if (sample < low or sample > high)
+        and abs(sample - median) > OUTLIER_MIN_DEVIATION * median
+    ]
+
+
+def summarize(samples: List[float]) -> Dict:
+    """Summarize repeated timings of one query."""
+    mean = statistics.fmean(samples)
+    stddev = statistics.stdev(samples) if len(samples) > 1 else 0.0
+    cv = stddev / mean if mean > 0 else 0.0
+    return {
+        "min_time": min(samples),
+        "median_time": statistics.median(samples),
+        "p95_time": percentile(samples, 95),
+        "mean_time": mean,
+        "stddev_time": stddev,
+        "cv": cv,
+        "is_noisy": cv > CV_THRESHOLD,
+        "outliers": find_outliers(samples),
+    }
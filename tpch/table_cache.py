@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import uuid
+from typing import Iterable, List, Optional, Tuple, Union
+
+import pyarrow as pa
+
+DEFAULT_MAX_BYTES = 50 * 1024**3
+
+
+def _source_files(source: str) -> Optional[List[Tuple[str, int, int]]]:
+    """Relative path, size and mtime of every file of a local table.
+
+    Returns None when `source` is not a local file or directory, e.g. an
+    object store URL, whose changes can not be detected.
+    """
+    if os.path.isfile(source):
+        stat = os.stat(source)
+        return [("", stat.st_size, stat.st_mtime_ns)]
+    if not os.path.isdir(source):
+        return None
+    files = []
+    for directory, _, file_names in os.walk(source):
+        for file_name in file_names:
+            path = os.path.join(directory, file_name)
+            stat = os.stat(path)
+            relative = os.path.relpath(path, source)
+            files.append((relative, stat.st_size, stat.st_mtime_ns))
+    return sorted(files)
+
+
+class TableCache:
+    """Local cache of preprocessed tables, stored as Arrow IPC files.
+
+    Loaders cache a table after its conversions, e.g. date parsing, under a
+    key made of the source path, the size and mtime of its files and the
+    settings the engine read it with, so a changed dataset or a different
+    dtype setting never hits a stale entry. Files are uncompressed and read
+    through a memory map. Reading an entry bumps its mtime, and writing one
+    evicts the least recently used entries until the cache fits in
+    `max_bytes`.
+
+    A cache without a directory is disabled: `key` returns None, `read`
+    misses and `write` does nothing.
+    """
+
+    def __init__(
+        self, directory: Optional[str] = None, max_bytes: int = DEFAULT_MAX_BYTES
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def open(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, source: str, **settings) -> Optional[str]:
+        if self.directory is None:
+            return None
+        files = _source_files(source)
+        if files is None:
+            return None
+        signature = {
+            "source": os.path.abspath(source),
+            "files": files,
+            "settings": settings,
+        }
+        data = json.dumps(signature, sort_keys=True, default=str).encode()
+        return hashlib.sha256(data).hexdigest()[:32]
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.arrow")
+
+    def read(self, key: Optional[str]) -> Optional[pa.Table]:
+        if key is None:
+            return None
+        path = self.path(key)
+        try:
+            os.utime(path)
+            return pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+        except FileNotFoundError:
+            return None
+        except pa.ArrowInvalid:
+            # e.g. a file truncated by a full disk; drop it and read the source.
+            os.remove(path)
+            return None
+
+    def write(
+        self,
+        key: Optional[str],
+        batches: Iterable[Union[pa.Table, pa.RecordBatch]],
+    ):
+        """Store `batches` under `key`, cast to the schema of the first one."""
+        if key is None:
+            return
+        path = self.path(key)
+        tmp_path = os.path.join(self.directory, f".{key}.{uuid.uuid4().hex}.tmp")
+        writer = None
+        schema = None
+        try:
+            with pa.OSFile(tmp_path, "wb") as sink:
+                for batch in batches:
+                    if writer is None:
+                        schema = batch.schema
+                        writer = pa.ipc.new_file(sink, schema)
+                    elif not batch.schema.equals(schema):
+                        batch = batch.cast(schema)
+                    if isinstance(batch, pa.Table):
+                        writer.write_table(batch)
+                    else:
+                        writer.write_batch(batch)
+                if writer is not None:
+                    writer.close()
+            if writer is None or os.path.getsize(tmp_path) > self.max_bytes:
+                os.remove(tmp_path)
+                return
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict(keep=key)
+
+    def entries(self) -> List[Tuple[str, int, float]]:
+        """Path, size and last use of every entry, least recently used first."""
+        entries = []
+        for file_name in os.listdir(self.directory):
+            if not file_name.endswith(".arrow"):
+                continue
+            path = os.path.join(self.directory, file_name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def evict(self, keep: Optional[str] = None):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if keep is not None and path == self.path(keep):
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -1,18 +1,61 @@
 import argparse
+import asyncio
 import json
 import os
-import time
-import traceback
-from typing import Dict
+import tempfile
+from typing import Dict, Optional
 
+import numpy as np
+import pyarrow as pa
 import xorbits
 import xorbits.pandas as pd
 
 pd.set_option("show_progress", False)
 
-from common_utils import log_time_fn, parse_common_arguments, print_result_fn
+from categories import DOMAINS, encode_categories
+from common_utils import get_run_options, parse_common_arguments
+from driver import Engine, run_engine
+from table_cache import TableCache
 
 dataset_dict = {}
+# tables whose low-cardinality columns are loaded as categoricals, set by
+# run_queries.
+categorical_tables = set()
+# xorbits groupby has no `observed` argument, so categorical group keys would
+# also yield the unobserved groups; only encode the columns that are never
+# grouped by.
+CATEGORICAL_COLUMNS = ["L_SHIPINSTRUCT", "P_CONTAINER", "R_NAME"]
+# converted tables cached on disk, opened by run_queries with --cache_dir.
+cache = TableCache()
+# storage backends of a local cluster, selected with --storage_backend:
+# shared memory in /dev/shm, memory-mapped files or plain files, the latter two
+# under --storage_dir.
+STORAGE_BACKENDS = ["shared_memory", "mmap", "disk"]
+
+
+def cache_key(
+    table: str, data_path: str, use_arrow_dtype: bool, gpu: bool
+) -> Optional[str]:
+    # GPU frames and xorbits' own Arrow string dtype do not round trip through
+    # pandas, so only the default dtypes are cached.
+    if use_arrow_dtype or gpu:
+        return None
+    return cache.key(
+        data_path, engine="xorbits", categorical=table in categorical_tables
+    )
+
+
+def read_cached(key: Optional[str]):
+    table = cache.read(key)
+    if table is None:
+        return None
+    return pd.DataFrame(table.to_pandas())
+
+
+def write_cached(key: Optional[str], df):
+    if key is not None:
+        table = pa.Table.from_pandas(df.to_pandas(), preserve_index=False)
+        cache.write(key, [table])
 
 
 def load_lineitem(
@@ -23,15 +66,21 @@ def load_lineitem(
 ):
     if "lineitem" not in dataset_dict:
         data_path = root + "/lineitem"
-        df = pd.read_parquet(
-            data_path,
-            use_arrow_dtype=use_arrow_dtype,
-            storage_options=storage_options,
-            gpu=gpu,
-        )
-        df.L_SHIPDATE = pd.to_datetime(df.L_SHIPDATE, format="%Y-%m-%d")
-        df.L_RECEIPTDATE = pd.to_datetime(df.L_RECEIPTDATE, format="%Y-%m-%d")
-        df.L_COMMITDATE = pd.to_datetime(df.L_COMMITDATE, format="%Y-%m-%d")
+        key = cache_key("lineitem", data_path, use_arrow_dtype, gpu)
+        df = read_cached(key)
+        if df is None:
+            df = pd.read_parquet(
+                data_path,
+                use_arrow_dtype=use_arrow_dtype,
+                storage_options=storage_options,
+                gpu=gpu,
+            )
+            df.L_SHIPDATE = pd.to_datetime(df.L_SHIPDATE, format="%Y-%m-%d")
+            df.L_RECEIPTDATE = pd.to_datetime(df.L_RECEIPTDATE, format="%Y-%m-%d")
+            df.L_COMMITDATE = pd.to_datetime(df.L_COMMITDATE, format="%Y-%m-%d")
+            if "lineitem" in categorical_tables:
+                encode_categories(df, "lineitem", CATEGORICAL_COLUMNS)
+            write_cached(key, df)
         result = df
         dataset_dict["lineitem"] = result
     else:
@@ -53,6 +102,8 @@ def load_part(
             storage_options=storage_options,
             gpu=gpu,
         )
+        if "part" in categorical_tables:
+            encode_categories(df, "part", CATEGORICAL_COLUMNS)
         result = df
         dataset_dict["part"] = result
     else:
@@ -68,13 +119,17 @@ def load_orders(
 ):
     if "orders" not in dataset_dict:
         data_path = root + "/orders"
-        df = pd.read_parquet(
-            data_path,
-            use_arrow_dtype=use_arrow_dtype,
-            storage_options=storage_options,
-            gpu=gpu,
-        )
-        df.O_ORDERDATE = pd.to_datetime(df.O_ORDERDATE, format="%Y-%m-%d")
+        key = cache_key("orders", data_path, use_arrow_dtype, gpu)
+        df = read_cached(key)
+        if df is None:
+            df = pd.read_parquet(
+                data_path,
+                use_arrow_dtype=use_arrow_dtype,
+                storage_options=storage_options,
+                gpu=gpu,
+            )
+            df.O_ORDERDATE = pd.to_datetime(df.O_ORDERDATE, format="%Y-%m-%d")
+            write_cached(key, df)
         result = df
         dataset_dict["orders"] = result
     else:
@@ -138,6 +193,8 @@ def load_region(
             storage_options=storage_options,
             gpu=gpu,
         )
+        if "region" in categorical_tables:
+            encode_categories(df, "region", CATEGORICAL_COLUMNS)
         result = df
         dataset_dict["region"] = result
     else:
@@ -1470,6 +1527,17 @@ def q22(
     return total
 
 
+table_loaders = {
+    "lineitem": load_lineitem,
+    "part": load_part,
+    "orders": load_orders,
+    "customer": load_customer,
+    "nation": load_nation,
+    "region": load_region,
+    "supplier": load_supplier,
+    "partsupp": load_partsupp,
+}
+
 query_to_loaders = {
     1: [load_lineitem],
     2: [load_part, load_partsupp, load_supplier, load_nation, load_region],
@@ -1543,6 +1611,88 @@ query_to_runner = {
 }
 
 
+def execute_tables():
+    for df in dataset_dict.values():
+        xorbits.run(df)
+
+
+def materialize(result):
+    xorbits.run(result)
+    return result
+
+
+def refresh_insert(tables: Dict[str, pa.Table]):
+    for name, table in tables.items():
+        if name in dataset_dict:
+            df = dataset_dict[name]
+            new = pd.DataFrame(table.to_pandas()).astype(df.dtypes.to_dict())
+            df = pd.concat([df, new], ignore_index=True)
+            xorbits.run(df)
+            dataset_dict[name] = df
+
+
+def refresh_delete(order_keys: np.ndarray):
+    for name, column in (("orders", "O_ORDERKEY"), ("lineitem", "L_ORDERKEY")):
+        if name in dataset_dict:
+            df = dataset_dict[name]
+            df = df[~df[column].isin(order_keys)].reset_index(drop=True)
+            xorbits.run(df)
+            dataset_dict[name] = df
+
+
+def unload_tables():
+    dataset_dict.clear()
+
+
+def storage_config(
+    backend: str,
+    storage_dir: str,
+    storage_size: Optional[int] = None,
+    spill: bool = False,
+) -> Dict:
+    """Storage section of the configuration of a local cluster.
+
+    `storage_size` bytes limit the mmap and disk backends; with `spill`, the
+    data the backend has no room for is spilled to files under `storage_dir`.
+    """
+    storage = {"backends": [backend]}
+    if backend != "shared_memory":
+        storage[backend] = {"root_dirs": os.path.join(storage_dir, backend)}
+        if storage_size is not None:
+            storage[backend]["size"] = storage_size
+    if spill:
+        storage["backends"].append("disk")
+        storage["disk"] = {"root_dirs": os.path.join(storage_dir, "spill")}
+    return {"storage": storage}
+
+
+def storage_usage() -> Dict[str, int]:
+    """Bytes used in every storage level (memory, disk) of the workers of the
+    local cluster; with --spill, the disk level holds the spilled data."""
+    from xorbits._mars.services.storage import StorageAPI
+    from xorbits._mars.storage import StorageLevel
+    from xorbits.core.adapter import session
+
+    sess = session.get_default_session()._isolated_session
+
+    async def gather():
+        usage = {}
+        for address, band in await sess._cluster_api.get_all_bands():
+            api = await StorageAPI.create(sess.session_id, address, band)
+            for level in (StorageLevel.MEMORY, StorageLevel.DISK):
+                try:
+                    info = await api.get_storage_level_info(level)
+                except KeyError:
+                    # the level has no backend.
+                    continue
+                key = f"storage_{level.name.lower()}_bytes"
+                usage[key] = usage.get(key, 0) + info.used_size
+        return usage
+
+    loop = session.get_default_session()._loop
+    return asyncio.run_coroutine_threadsafe(gather(), loop).result()
+
+
 def run_queries(
     path,
     storage_options,
@@ -1552,47 +1702,45 @@ def run_queries(
     include_io=False,
     use_arrow_dtype=False,
     gpu=False,
+    categorical=False,
+    cache_dir=None,
+    cache_size=50.0,
+    cluster_config=None,
+    **run_options,
 ):
-    version = xorbits.__version__
-    data_start_time = time.time()
-    for query in queries:
-        loaders = query_to_loaders[query]
-        for loader in loaders:
-            xorbits.run(
-                loader(path, storage_options, use_arrow_dtype=use_arrow_dtype, gpu=gpu)
-            )
-    print(f"Total data loading time (s): {time.time() - data_start_time}")
-
-    total_start = time.time()
-    for query in queries:
-        try:
-            start_time = time.time()
-            result = query_to_runner[query](
-                path, storage_options, use_arrow_dtype=use_arrow_dtype, gpu=gpu
-            )
-            xorbits.run(result)
-            without_io_time = time.time() - start_time
-            success = True
-            if print_result:
-                print_result_fn("xorbits", result, query)
-        except Exception as e:
-            print("".join(traceback.TracebackException.from_exception(e).format()))
-            without_io_time = 0.0
-            success = False
-        finally:
-            pass
-        if log_time:
-            log_time_fn(
-                "xorbits",
-                query,
-                version=version,
-                without_io_time=without_io_time,
-                success=success,
-            )
-    print(f"Total query execution time (s): {time.time() - total_start}")
-
-
-def main():
+    if categorical:
+        categorical_tables.update(DOMAINS)
+    if cache_dir is not None:
+        cache.open(cache_dir, int(cache_size * 1024**3))
+    cluster_config = cluster_config or {}
+    engine = Engine(
+        name="xorbits",
+        version=xorbits.__version__,
+        query_to_loaders=query_to_loaders,
+        table_loaders=table_loaders,
+        query_to_runner=query_to_runner,
+        args=(path, storage_options),
+        kwargs={"use_arrow_dtype": use_arrow_dtype, "gpu": gpu},
+        materialize=materialize,
+        after_load=execute_tables,
+        refresh_insert=refresh_insert,
+        refresh_delete=refresh_delete,
+        unload=unload_tables,
+        # the storage of an existing cluster is not reachable from here.
+        storage_usage=storage_usage if "endpoint" not in cluster_config else None,
+        config={
+            "categorical": categorical,
+            "cache_dir": cache_dir,
+            **cluster_config,
+        },
+        # xorbits sessions are not documented to be safe to submit to from
+        # several threads at once.
+        parallel_load=False,
+    )
+    run_engine(engine, queries, log_time, print_result, include_io, **run_options)
+
+
+def main(argv=None):
     parser = argparse.ArgumentParser(description="TPC-H benchmark.")
     parser.add_argument(
         "--storage_options",
@@ -1618,6 +1766,24 @@ def main():
         action="store_true",
         help="Use GPUs.",
     )
+    parser.add_argument(
+        "--categorical",
+        default=False,
+        action="store_true",
+        help="load low-cardinality string columns as categoricals.",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        required=False,
+        help="cache the converted lineitem and orders tables in this directory.",
+    )
+    parser.add_argument(
+        "--cache_size",
+        type=float,
+        default=50.0,
+        help="size limit of the table cache in GiB.",
+    )
     parser.add_argument(
         "--cuda_devices",
         type=int,
@@ -1629,18 +1795,76 @@ def main():
         "--mmap_root_dir",
         type=str,
         required=False,
-        help="The directory used by mmap storage backend.",
+        help="The directory used by mmap storage backend, "
+        "same as --storage_backend mmap --storage_dir.",
+    )
+    parser.add_argument(
+        "--storage_backend",
+        type=str,
+        default="shared_memory",
+        choices=STORAGE_BACKENDS,
+        help="storage backend of a local cluster.",
+    )
+    parser.add_argument(
+        "--storage_dir",
+        type=str,
+        required=False,
+        help="directory of the mmap and disk backends and of spilled data, "
+        "a temporary directory by default.",
+    )
+    parser.add_argument(
+        "--storage_size",
+        type=float,
+        required=False,
+        help="size limit of the mmap and disk backends in GiB.",
+    )
+    parser.add_argument(
+        "--spill",
+        default=False,
+        action="store_true",
+        help="spill data beyond --storage_size of the mmap backend to disk.",
+    )
+    parser.add_argument(
+        "--n_worker",
+        type=int,
+        default=1,
+        help="number of workers of a local cluster.",
+    )
+    parser.add_argument(
+        "--n_cpu",
+        type=int,
+        required=False,
+        help="CPUs of a local cluster, all cores by default.",
     )
 
     parser = parse_common_arguments(parser)
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     print(f"Use GPU: {args.gpu}")
     print(f"Use Arrow: {args.use_arrow_dtype}")
+    print(f"Categorical: {args.categorical}")
+    print(f"Cache directory: {args.cache_dir}")
     if args.mmap_root_dir is not None:
-        storage_config = {"mmap": {"root_dirs": args.mmap_root_dir}}
-        print(f"Use mmap to run: {args.mmap_root_dir}")
-    else:
-        storage_config = None
+        args.storage_backend = "mmap"
+        args.storage_dir = args.mmap_root_dir
+    if args.spill and args.storage_backend != "mmap":
+        # shared memory has no size limit to spill from.
+        parser.error("--spill needs --storage_backend mmap")
+    if args.storage_dir is None and args.storage_backend != "shared_memory":
+        args.storage_dir = tempfile.mkdtemp(prefix="xorbits-storage-")
+    storage_size = None
+    if args.storage_size is not None:
+        storage_size = int(args.storage_size * 1024**3)
+    config = storage_config(
+        args.storage_backend, args.storage_dir, storage_size, args.spill
+    )
+    print(f"Storage: {config['storage']}")
+    cluster_config = {
+        "storage_backend": args.storage_backend,
+        "storage_size": storage_size,
+        "spill": args.spill,
+        "n_worker": args.n_worker,
+        "n_cpu": args.n_cpu or os.cpu_count(),
+    }
 
     # path to TPC-H data in parquet.
     print(f"Path: {args.path}")
@@ -1662,7 +1886,16 @@ def main():
         address = None
     elif args.endpoint:
         address = args.endpoint
-    xorbits.init(address=address, storage_config=storage_config)
+    if address is None:
+        xorbits.init(
+            n_worker=args.n_worker,
+            n_cpu=args.n_cpu or "auto",
+            config=config,
+        )
+    else:
+        # the storage and size of an existing cluster are set when deploying it.
+        cluster_config = {"endpoint": address}
+        xorbits.init(address=address)
 
     try:
         run_queries(
@@ -1674,6 +1907,11 @@ def main():
             include_io=args.include_io,
             use_arrow_dtype=args.use_arrow_dtype,
             gpu=args.gpu,
+            categorical=args.categorical,
+            cache_dir=args.cache_dir,
+            cache_size=args.cache_size,
+            cluster_config=cluster_config,
+            **get_run_options(args),
         )
     finally:
         xorbits.shutdown()